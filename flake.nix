@@ -38,6 +38,7 @@
               click
               kapackpkgs.execo
               halo
+              paramiko
               pexpect
               psutil
               ptpython
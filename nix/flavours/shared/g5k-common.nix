@@ -20,6 +20,23 @@
   boot.supportedFilesystems = [ "nfs" ];
   nxc.wait-online.enable = true;
 
+  # Notify nxc start, through http server deployment was retrieved from,
+  # that machine is booted (sshd up)
+  systemd.services.nxc-boot-notify = {
+    after = [ "sshd.service" "network-online.target" ];
+    wants = [ "network-online.target" ];
+    wantedBy = [ "multi-user.target" ];
+    unitConfig.ConditionPathExists = "/etc/nxc/deployment_url";
+    serviceConfig.Type = "oneshot";
+    script = ''
+      base_url=$(cut -d/ -f1-3 /etc/nxc/deployment_url)
+      role=$(cat /etc/nxc/role 2> /dev/null || true)
+      uptime=$(cut -d' ' -f1 /proc/uptime)
+      ${pkgs.wget}/bin/wget -q -O /dev/null --tries=5 \
+        "$base_url/boot?host=$(${pkgs.inetutils}/bin/hostname)&role=$role&uptime=$uptime"
+    '';
+  };
+
   systemd.services.nxc-script = {
     after = [ "network.target" "network-online.target" ];
     wants = [ "network-online.target" ];
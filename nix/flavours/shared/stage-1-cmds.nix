@@ -73,7 +73,14 @@
                    if [ $1 == "https" ] || [ $1 == "http" ]
                    then
                       echo "Use http(s) to get deployment configuration at $d"
-                      wget -q "$d" -O $deployment_json
+                      url="$d"
+                      case $d in
+                          # only part of this machine, see nxc start --full-deployment
+                          */node/*) url="$d?host=$ip_addr" ;;
+                      esac
+                      wget -q "$url" -O $deployment_json
+                      # nxc start waits for boot notification on same server
+                      echo "$d" > /mnt-root/etc/nxc/deployment_url
                    else
                       echo "Use base64 decode to deployment configuration"
                       echo "$d" | base64 -d >> $deployment_json
@@ -110,7 +117,8 @@
                        echo "$ssh_key_pub" >> /mnt-root/root/.ssh/authorized_keys
                    fi
                    echo "Generate/complete /etc/nxc/deployment-hosts  from deployment.json"
-                   jq -r '.deployment | to_entries | map(.key + " " + (.value.host)) | .[]' \
+                   jq -r 'if .hosts then (.hosts | to_entries | map(.key + " " + .value))
+                          else (.deployment | to_entries | map(.key + " " + (.value.host))) end | .[]' \
                    $deployment_json >> /mnt-root/etc/nxc/deployment-hosts
 
                    echo "Retrieve all_compositions_registration_store_path"
@@ -8,14 +8,33 @@ import shutil
 import subprocess
 import time
 import base64
+import hashlib
+import tempfile
 import click
 import signal
 import psutil
 import itertools
 import ipaddress
+import asyncio
+import threading
+import urllib.parse
 import urllib.request
 
-from .tools.kataract import generate_scp_tasks, exec_kataract_tasks
+from .tools.kataract import (
+    generate_scp_tasks,
+    generate_pipe_tasks,
+    generate_tar_tasks,
+    generate_digest_tasks,
+    make_bundle,
+    BUNDLE_NAME,
+    parse_digests,
+    file_sha256,
+    exec_kataract_tasks,
+    failed_hosts,
+    Task,
+    Progress,
+    PROGRESS_INTERVAL,
+)
 
 # from .default_role import DefaultRole #TODO
 
@@ -430,10 +449,17 @@ def generate_deployment_info(ctx, ssh_pub_key_file=None):
     return
 
 
+def deployment_url(ctx):
+    """Url machines retrieve deployment from: by default their own slice of it
+    (entry, shared data and hosts table), not all machines entries."""
+    base_url = f"http://{ctx.httpd.ip}:{ctx.httpd.port}"
+    kind = "deploy" if ctx.full_deployment else "node"
+    return f"{base_url}/{kind}/{ctx.composition_flavour_prefix}.json"
+
+
 def generate_kexec_scripts(ctx, flavour_kernel_params=""):
     if ctx.use_httpd:
-        base_url = f"http://{ctx.httpd.ip}:{ctx.httpd.port}"
-        deploy_info_src = f"{base_url}/deploy/{ctx.composition_flavour_prefix}.json"
+        deploy_info_src = deployment_url(ctx)
     else:
         generate_deploy_info_b64(ctx)
         deploy_info_src = ctx.deployment_info_b64
@@ -595,6 +621,10 @@ def launch_ssh_kexec(ctx, ip=None, debug=False):
         # else:
         #     sudo = ""
 
+        if ctx.push_path and ctx.push_mode == "pull":
+            # machines download files themselves, no ssh held meanwhile
+            ki = f"{pull_files_command(ctx, kexec_files(ctx))} && {ki}"
+
         if "DEBUG_STAGE1" in os.environ or debug:
             # debug_stage1 = os.environ["DEBUG_STAGE1"]
             # TODO
@@ -603,85 +633,496 @@ def launch_ssh_kexec(ctx, ip=None, debug=False):
             )
             ki = f" {ki} DEBUG_INITRD=boot.debug1mounts "
 
-        def one_ssh_kexec(ip_addr):
+        def ssh_kexec_cmd(ip_addr):
             ssh_cmd = f'{ctx.ssh} {user}{ip_addr} "screen -dm bash -c \\" {ki} {kexec_script}\\""'
             ctx.vlog(ssh_cmd)
-            subprocess.call(ssh_cmd, shell=True)
-
-        if ip:
-            one_ssh_kexec(ip)
-        else:
-            for ip in ctx.deployment_info["deployment"].keys():
-                one_ssh_kexec(ip)
+            return Task(ssh_cmd, ip_addr)
+
+        ips = [ip] if ip else list(ctx.deployment_info["deployment"].keys())
+        # all launched at once (up to push_concurrency) for machines to boot together
+        results = exec_kataract_tasks(
+            [ssh_kexec_cmd(ip_addr) for ip_addr in ips],
+            elog=ctx.elog,
+            vlog=ctx.vlog,
+            concurrency=ctx.push_concurrency,
+            timeout=60,
+        )
+        if not ip:
+            # masters would hang on rebooting machines, reopened once booted
+            close_ssh_masters(ctx)
     else:
         raise Exception("Sorry, only all-in-one image version is supported up to now")
 
+    failed = [r.host for r in results if not r.ok]
+    if failed:
+        if ctx.show_spinner:
+            ctx.spinner.stop()
+        # their ssh ports or boot notifications would be waited for in vain
+        raise click.ClickException(
+            f"kexec launch failed on {len(failed)} machine(s): {' '.join(failed)}"
+        )
     if ctx.show_spinner:
-        ctx.spinner.succeed("Remote kexec(s) launched")
-
-
-def wait_ssh_ports(ctx, ips=None):
+        ctx.spinner.succeed(f"Remote kexec(s) launched: {len(results)}/{len(results)}")
+    return results
+
+
+async def probe_tcp_port(ip, port, timeout=1):
+    """Whether a TCP connection to ip:port can be established."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+
+def wait_tcp_ports(
+    ips,
+    port=22,
+    rebooting=False,
+    down_grace=10,
+    interval=0.25,
+    max_interval=2,
+    concurrency=512,
+    timeout=None,
+    progress=None,
+):
+    """Wait for port to be open on all ips. Each host is probed again only
+    while it is down, with an interval doubling up to max_interval. Rebooting
+    hosts must be seen down first (their port is still open on the old system),
+    unless still not seen down after down_grace seconds. progress(ip) is
+    called as each port opens. Return hosts still down after timeout seconds.
+    """
+    opened = set()
+
+    async def wait_one(ip, semaphore):
+        loop = asyncio.get_event_loop()
+        t0 = loop.time()
+        seen_down = not rebooting
+        delay = interval
+        while True:
+            async with semaphore:
+                is_open = await probe_tcp_port(ip, port)
+            if is_open and (seen_down or loop.time() - t0 >= down_grace):
+                opened.add(ip)
+                if progress:
+                    progress(ip)
+                return
+            if is_open:
+                # old system still up, do not miss it going down
+                delay = interval
+            else:
+                seen_down = True
+            await asyncio.sleep(delay)
+            if not is_open:
+                delay = min(2 * delay, max_interval)
+
+    async def wait_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*[wait_one(ip, semaphore) for ip in ips])
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asyncio.wait_for(wait_all(), timeout))
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.close()
+    return [ip for ip in ips if ip not in opened]
+
+
+def reboot_down_grace(ctx):
+    """Seconds a rebooting machine may still run its old system: in pull push
+    mode, files are downloaded (and served to peers) before kexec."""
+    if ctx.push_path and ctx.push_mode == "pull":
+        return ctx.push_timeout
+    return 10
+
+
+def wait_ssh_ports(ctx, ips=None, rebooting=False, on_ready=None):
     if not ctx.show_spinner:
         ctx.log("Waiting ssh ports:")
     if not ips:
         ips = ctx.ip_addresses
     nb_ips = len(ips)
-
-    nb_ssh_port = 0
-    waiting_ssh_ports_cmd = (
-        f"nmap -p22 -Pn {' '.join(ips)} -oG - | grep '22/open' | wc -l"
-    )
-    ctx.vlog(waiting_ssh_ports_cmd)
+    nb_ssh_port = [0]
 
     if ctx.show_spinner:
         ctx.spinner.start(f"Waiting ssh ports, opened: 0/{nb_ips}")
 
-    while nb_ssh_port != nb_ips:
-        output = subprocess.check_output(waiting_ssh_ports_cmd, shell=True)
-        nb_ssh_port = int(output.rstrip().decode())
+    def port_opened(ip):
+        nb_ssh_port[0] += 1
+        ctx.vlog(f"{ip}: ssh port opened ({ctx.elapsed_time():.1f}s)")
         if ctx.show_spinner:
             ctx.spinner.text(
                 "Opened ssh ports: {}/{} ({:.1f}s)".format(
-                    nb_ssh_port, nb_ips, ctx.elapsed_time()
+                    nb_ssh_port[0], nb_ips, ctx.elapsed_time()
                 )
             )
-        time.sleep(0.25)
+        if on_ready:
+            on_ready(ip)
+
+    wait_tcp_ports(
+        ips,
+        22,
+        rebooting=rebooting,
+        down_grace=reboot_down_grace(ctx),
+        progress=port_opened,
+    )
     if ctx.show_spinner:
         ctx.spinner.succeed("Deployment taken {:.1f} sec".format(ctx.elapsed_time()))
     else:
         ctx.vlog("Deployment took {:.1f}s".format(ctx.elapsed_time()))
 
 
-def push_on_machines(ctx):
-    if "all" not in ctx.deployment_info:
-        raise Exception("Sorry, only all-in-one image version is supported up to now")
+def wait_booted_machines(ctx, ips=None, notify_grace=30, on_ready=None):
+    """Wait for machines to notify httpd they booted. Machines whose image
+    does not notify are considered booted notify_grace seconds after their ssh
+    port opened. on_ready(ip) is called as each machine is booted. The
+    timeline of each machine (seconds since the call) is written in
+    envdir/boot.json."""
+    if not ips:
+        ips = ctx.ip_addresses
+    t0 = time.time()
+    ssh_opened = {}
+
+    def port_opened(ip):
+        ssh_opened[ip] = time.time()
+
+    threading.Thread(
+        target=wait_tcp_ports,
+        args=(ips, 22),
+        kwargs={
+            "rebooting": True,
+            "down_grace": reboot_down_grace(ctx),
+            "progress": port_opened,
+        },
+        daemon=True,
+    ).start()
 
+    if ctx.show_spinner:
+        ctx.spinner.start(f"Waiting boot notifications: 0/{len(ips)}")
+    else:
+        ctx.log("Waiting boot notifications:")
+    ready = set()
+    while True:
+        missing = ctx.httpd.wait_booted(ips, timeout=1)
+        silent = [
+            ip
+            for ip in missing
+            if ip in ssh_opened and time.time() - ssh_opened[ip] > notify_grace
+        ]
+        if on_ready:
+            for ip in ips:
+                if ip not in ready and (ip not in missing or ip in silent):
+                    ready.add(ip)
+                    on_ready(ip)
+        if ctx.show_spinner:
+            ctx.spinner.text(
+                "Booted machines: {}/{} ({:.1f}s)".format(
+                    len(ips) - len(missing), len(ips), ctx.elapsed_time()
+                )
+            )
+        if len(silent) == len(missing):
+            break
+    if silent:
+        ctx.wlog(f"no boot notification from: {' '.join(silent)}")
+
+    timeline = {}
+    for ip in ips:
+        timeline[ip] = dict(ctx.httpd.booted.get(ip, {}))
+        if "time" in timeline[ip]:
+            timeline[ip]["time"] -= t0
+        if ip in ssh_opened:
+            timeline[ip]["ssh_port"] = ssh_opened[ip] - t0
+    with open(op.join(ctx.envdir, "boot.json"), "w") as f:
+        json.dump(timeline, f, indent=2)
+
+    if ctx.show_spinner:
+        ctx.spinner.succeed("Deployment taken {:.1f} sec".format(ctx.elapsed_time()))
+    else:
+        ctx.vlog("Deployment took {:.1f}s".format(ctx.elapsed_time()))
+    return timeline
+
+
+def push_destination(ctx, file_input):
+    return op.join(ctx.push_path, op.basename(file_input))
+
+
+def kexec_files(ctx):
+    """Files pushed on machines: kernel, initrd, kexec_script (and deployment
+    file with push_deployment)."""
     kernel = realpath_from_store(ctx, ctx.deployment_info["all"]["kernel"])
     initrd = realpath_from_store(ctx, ctx.deployment_info["all"]["initrd"])
+    base_path = op.join(
+        ctx.envdir, f"artifact/{ctx.composition_name}/{ctx.flavour.name}"
+    )
+    kexec_script = op.join(base_path, "kexec_scripts/kexec.sh")
+    files = [kernel, initrd, kexec_script]
+    if ctx.push_deployment:
+        files.append(ctx.deployment_filename)
+    return files
+
+
+def pull_files_command(ctx, files):
+    """Shell command run on machines to download files from httpd to their
+    push destination. Interrupted downloads are resumed (range requests).
+    With pull_peers, machines get files from machines which already got
+    them, through peer helper served by httpd. Unless force_push, files
+    already present at their destination (same sha256) are not downloaded
+    again."""
+    cmds = [f"mkdir -p {ctx.push_path}"]
+    pairs = []
+    for f in files:
+        url = ctx.httpd.serve_file(f)
+        destination = push_destination(ctx, f)
+        digest = None if ctx.force_push else file_sha256(f)
+        if ctx.pull_peers:
+            pair = f"{urllib.parse.urlsplit(url).path}={destination}"
+            pairs.append(f"{pair}={digest}" if digest else pair)
+        else:
+            # partial download of this very file only
+            partial = f"{destination}.{url.split('/')[-2]}.part"
+            cmd = f"curl -fsS --retry 10 -C - -o {partial} {url} && mv {partial} {destination}"
+            if digest:
+                present = f"echo '{digest}  {destination}' | sha256sum -c --status"
+                cmd = f"{{ {present} || {{ {cmd}; }}; }}"
+            cmds.append(cmd)
+    if pairs:
+        base_url = f"http://{ctx.httpd.ip}:{ctx.httpd.port}"
+        peer = op.join(ctx.push_path, "nxc-peer.py")
+        cmds.append(f"curl -fsS --retry 10 -o {peer} {base_url}/peer.py")
+        cmds.append(f"python3 {peer} --server {base_url} {' '.join(pairs)}")
+    for f in files:
+        if os.access(f, os.X_OK):
+            cmds.append(f"chmod 755 {push_destination(ctx, f)}")
+    return " && ".join(cmds)
+
+
+def hosts_missing_files(ctx, files):
+    """For each file, list the machines which do not already hold an identical
+    copy (same sha256) at its push destination. All machines are asked in one
+    parallel round."""
+    destinations = {f: push_destination(ctx, f) for f in files}
+    ctx.vlog("check files already present on machines")
+    tasks_cmd = generate_digest_tasks(
+        ctx.ip_addresses, list(destinations.values()), ssh=ctx.ssh
+    )
+    results = exec_kataract_tasks(
+        tasks_cmd,
+        elog=ctx.elog,
+        vlog=ctx.vlog,
+        concurrency=ctx.push_concurrency,
+        timeout=60,
+    )
 
-    base_path = ctx.envdir
+    remote_digests = {r.host: parse_digests(r.stdout) for r in results}
 
-    # if ctx.multiple_compositions:
-    #    subpath = "::"
-    # else:
-    # subpath = ctx.composition_name
-    # base_path = op.join(
-    #     ctx.envdir, f"artifact/{subpath}/{ctx.flavour_name}"
-    # )
-    subpath = ctx.composition_name
-    base_path = op.join(ctx.envdir, f"artifact/{subpath}/{ctx.flavour_name}")
+    hosts_by_file = {}
+    for f, destination in destinations.items():
+        digest = file_sha256(f)
+        hosts_by_file[f] = [
+            ip
+            for ip in ctx.ip_addresses
+            if remote_digests[ip].get(destination) != digest
+        ]
+    return hosts_by_file
 
-    kexec_script = op.join(base_path, "kexec_scripts/kexec.sh")
 
-    ctx.vlog(
-        f"push kernel, initrd, kexec_script on {ctx.ip_addresses} with scp executed concurrently"
+def exec_push_tasks(ctx, tasks_cmd, concurrency, file_input, nbytes):
+    """Run push tasks of file_input (nbytes long), showing in spinner bytes
+    received by machines and their rates, and return a TaskResult per task."""
+    hosts = [t.host for t in tasks_cmd if t.host != "seed"]
+    progress = Progress(hosts, nbytes)
+    label = f"push {op.basename(file_input)}: "
+    last_update = [0]
+
+    def update(task, received):
+        progress.update(task.host, received)
+        now = time.time()
+        if ctx.show_spinner and now - last_update[0] >= PROGRESS_INTERVAL:
+            last_update[0] = now
+            ctx.spinner.text(progress.text(label))
+
+    if ctx.show_spinner:
+        ctx.spinner.start(progress.text(label))
+    t0 = time.time()
+    results = exec_kataract_tasks(
+        tasks_cmd,
+        elog=ctx.elog,
+        vlog=ctx.vlog,
+        concurrency=concurrency,
+        timeout=ctx.push_timeout,
+        retries=ctx.push_retries,
+        progress=update,
+    )
+    duration = time.time() - t0
+    if ctx.show_spinner:
+        ctx.spinner.succeed(
+            f"{label}{nbytes * len(hosts) / 1e6:.0f} MB on {len(hosts)} machine(s)"
+            f" in {duration:.1f}s ({nbytes * len(hosts) / max(duration, 1e-6) / 1e6:.1f} MB/s)"
+        )
+    ctx.push_summary.append(push_summary(file_input, nbytes, duration, results))
+    return results
+
+
+def push_summary(file_input, nbytes, duration, results):
+    """Summary of a push: aggregated rate and, per machine, bytes, rate and
+    how the file was received, slowest machines first."""
+    receivers = [r for r in results if r.host != "seed"]
+    received = sum(r.bytes for r in receivers)
+    return {
+        "file": file_input,
+        "bytes": nbytes,
+        "machines": len(receivers),
+        "duration": duration,
+        "rate": received / duration if duration else 0,
+        "failed": failed_hosts(results),
+        "tasks": sorted(
+            (r.as_dict() for r in results), key=lambda r: (r["rc"] == 0, r["rate"])
+        ),
+    }
+
+
+def write_push_summary(ctx):
+    """Write summaries of pushes in push.json of envdir."""
+    summary_file = op.join(ctx.envdir, "push.json")
+    with open(summary_file, "w") as f:
+        json.dump(ctx.push_summary, f, indent=2)
+    ctx.vlog(f"push summary written in {summary_file}")
+
+
+def drop_push_failures(ctx, results):
+    """Leave machines on which a push failed out of the deployment: they could
+    not boot the composition. Dead relays of a kataract broadcast are bypassed,
+    files are on the other machines and are not pushed again on next start.
+    Fail if no machine is left."""
+    failed = sorted({h for rs in results.values() for h in failed_hosts(rs)})
+    if not failed:
+        return
+    if set(ctx.ip_addresses) <= set(failed):
+        raise click.ClickException(f"push failed on all {len(failed)} machine(s)")
+    ctx.wlog(
+        f"push failed on {len(failed)} machine(s), deployed without them: {' '.join(failed)}"
+        " (files already pushed are skipped on next start)"
+    )
+    ctx.ip_addresses = [ip for ip in ctx.ip_addresses if ip not in failed]
+    for ip in failed:
+        ctx.deployment_info["deployment"].pop(ip, None)
+    ctx.host2ip_address = {
+        host: ip for host, ip in ctx.host2ip_address.items() if ip not in failed
+    }
+
+
+def push_bundle(ctx, hosts, files, bundle_dir):
+    """Push files on hosts as one tar stream unpacked in push_path on each of
+    them: a single kataract pipeline, or a single ssh session per host."""
+    if ctx.push_mode != "kataract":
+        tasks_cmd = generate_tar_tasks(
+            hosts, files, ctx.push_path, ssh=ctx.ssh, compression=ctx.push_compression
+        )
+        nbytes = sum(op.getsize(f) for f in files)
+        return exec_push_tasks(
+            ctx, tasks_cmd, ctx.push_concurrency, BUNDLE_NAME, nbytes
+        )
+
+    bundle = op.join(bundle_dir, BUNDLE_NAME)
+    make_bundle(files, bundle)
+    try:
+        tasks_cmd = generate_pipe_tasks(
+            hosts,
+            bundle,
+            push_destination(ctx, bundle),
+            ssh=ctx.ssh,
+            topology=ctx.push_topology,
+            timeout=ctx.push_timeout,
+            compression=ctx.push_compression,
+            unpack=ctx.push_path,
+        )
+        return exec_push_tasks(ctx, tasks_cmd, None, bundle, op.getsize(bundle))
+    finally:
+        os.remove(bundle)
+
+
+def push_on_machines(ctx):
+    if "all" not in ctx.deployment_info:
+        raise Exception("Sorry, only all-in-one image version is supported up to now")
+
+    files = kexec_files(ctx)
+    base_path = op.join(
+        ctx.envdir, f"artifact/{ctx.composition_name}/{ctx.flavour.name}"
     )
-    for file_input in [kernel, initrd, kexec_script]:
-        ctx.vlog(f"push: {file_input}")
-        tasks_cmd = generate_scp_tasks(
-            ctx.ip_addresses, file_input, ctx.push_path, scp="scp", user="root"
+
+    if ctx.push_mode == "pull":
+        ctx.vlog("push: files pulled by machines from httpd at kexec launch")
+        return {}
+
+    if ctx.force_push:
+        hosts_by_file = {f: ctx.ip_addresses for f in files}
+    else:
+        hosts_by_file = hosts_missing_files(ctx, files)
+
+    if ctx.push_mode == "kataract":
+        ctx.vlog(
+            f"push kernel, initrd, kexec_script on {ctx.ip_addresses} with kataract ({ctx.push_topology})"
+        )
+    else:
+        ctx.vlog(
+            f"push kernel, initrd, kexec_script on {ctx.ip_addresses} with scp executed concurrently"
         )
-        exec_kataract_tasks(tasks_cmd, elog=ctx.elog, vlog=ctx.vlog)
+
+    if ctx.push_bundle:
+        files = [f for f in files if hosts_by_file[f]]
+        hosts = [
+            ip for ip in ctx.ip_addresses if any(ip in hosts_by_file[f] for f in files)
+        ]
+        if not files:
+            ctx.vlog("push: all files already present on all machines")
+            return {}
+        ctx.vlog(f"push: {len(files)} file(s) bundled on {len(hosts)} machine(s)")
+        ctx.push_summary = []
+        results = {"bundle": push_bundle(ctx, hosts, files, base_path)}
+        write_push_summary(ctx)
+        drop_push_failures(ctx, results)
+        return results
+
+    ctx.push_summary = []
+    results = {}
+    for file_input in files:
+        hosts = hosts_by_file[file_input]
+        if not hosts:
+            ctx.vlog(f"push: {file_input} already present on all machines")
+            continue
+        ctx.vlog(f"push: {file_input} on {len(hosts)} machine(s)")
+        if ctx.push_mode == "kataract":
+            tasks_cmd = generate_pipe_tasks(
+                hosts,
+                file_input,
+                push_destination(ctx, file_input),
+                ssh=ctx.ssh,
+                topology=ctx.push_topology,
+                timeout=ctx.push_timeout,
+                compression=ctx.push_compression,
+            )
+            # relays wait for each other, pipeline cannot be throttled
+            concurrency = None
+        else:
+            tasks_cmd = generate_scp_tasks(
+                hosts,
+                file_input,
+                ctx.push_path,
+                scp=f"scp {ssh_control_options(ctx)}",
+                user="root",
+                compression=ctx.push_compression,
+            )
+            concurrency = ctx.push_concurrency
+        results[file_input] = exec_push_tasks(
+            ctx, tasks_cmd, concurrency, file_input, op.getsize(file_input)
+        )
+    if ctx.push_summary:
+        write_push_summary(ctx)
+    drop_push_failures(ctx, results)
+    return results
 
     # if shutil.which("kastafior"):
     #    raise NotImplementedError
@@ -716,12 +1157,78 @@ def get_ip_ssh_port(ctx, host):
     return (ip, ssh_port)
 
 
+def ssh_control_dir(ctx):
+    """Directory of control sockets of ssh master connections for envdir, kept
+    short as socket paths are limited to about 100 characters."""
+    digest = hashlib.sha1(ctx.envdir.encode()).hexdigest()[:8]
+    return op.join(tempfile.gettempdir(), f"nxc-ssh-{os.getuid()}-{digest}")
+
+
+def ssh_control_options(ctx):
+    """ssh/scp options to multiplex a connection on the master connection of
+    its host, if any (ssh connects directly otherwise)."""
+    if not ctx.ssh_master:
+        return ""
+    return f"-o ControlPath={ssh_control_dir(ctx)}/%C"
+
+
+def open_ssh_masters(ctx, ips, user="root"):
+    """Open in parallel a persistent master connection per machine, next ssh
+    and scp to them skip their handshake. Masters live until close_ssh_masters
+    (nxc stop) or until their machine goes down."""
+    if not ctx.ssh_master or not ips:
+        return
+    os.makedirs(ssh_control_dir(ctx), mode=0o700, exist_ok=True)
+    ctx.vlog(f"open ssh master connections on {len(ips)} machine(s)")
+    ssh = ctx.ssh.rstrip()
+    if ssh_control_options(ctx) not in ssh:
+        ssh = f"{ssh} {ssh_control_options(ctx)}"
+    # -f: background once authenticated, output redirected to let task finish
+    tasks_cmd = [
+        Task(
+            f"{ssh} -o ControlMaster=yes -o ControlPersist=yes"
+            " -o ServerAliveInterval=5 -o StrictHostKeyChecking=no -o LogLevel=ERROR"
+            f" -l {user} -N -f {ip} < /dev/null > /dev/null 2>&1",
+            ip,
+        )
+        for ip in ips
+    ]
+    results = exec_kataract_tasks(
+        tasks_cmd,
+        elog=ctx.elog,
+        vlog=ctx.vlog,
+        concurrency=ctx.push_concurrency,
+        timeout=60,
+    )
+    failed = [r.host for r in results if not r.ok]
+    if failed:
+        ctx.wlog(f"no ssh master connection on: {' '.join(failed)}")
+
+
+def close_ssh_masters(ctx):
+    """Close master connections opened by open_ssh_masters."""
+    control_dir = ssh_control_dir(ctx)
+    if not op.isdir(control_dir):
+        return
+    sockets = os.listdir(control_dir)
+    ctx.vlog(f"close {len(sockets)} ssh master connection(s)")
+    for socket_name in sockets:
+        # host is not used, control path is given as is
+        subprocess.call(
+            ["ssh", "-o", f"ControlPath={op.join(control_dir, socket_name)}"]
+            + ["-O", "exit", "nxc"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    shutil.rmtree(control_dir, ignore_errors=True)
+
+
 def ssh_connect(ctx, user, host, execute=True, ssh_key_file=None):
     ip, ssh_port = get_ip_ssh_port(ctx, host)
     ssh_key_option = "" if ssh_key_file is None else "-o IdentitiesOnly=yes -i " + os.path.realpath(ssh_key_file)
 
-    ssh_cmd = (f"ssh {ssh_key_option} -o StrictHostKeyChecking=no -o LogLevel=ERROR"
-               f" -l {user} -p {ssh_port} {ip}")
+    ssh_cmd = (f"ssh {ssh_key_option} {ssh_control_options(ctx)} -o StrictHostKeyChecking=no"
+               f" -o LogLevel=ERROR -l {user} -p {ssh_port} {ip}")
 
     if execute:
         return_code = subprocess.run(ssh_cmd, shell=True).returncode
@@ -29,11 +29,19 @@ from ..driver.driver import Driver
     is_flag=True,
     help="execute the 'embedded' testscript",
 )
+@click.option(
+    "--ssh-backend",
+    type=click.Choice(["auto", "paramiko", "process"]),
+    default="process",
+    help="how commands reach machines of ssh based flavours: one ssh process (default), one in-process connection per machine (paramiko, needs nixos-compose[paramiko] and does not use ssh master connections), or the latter if paramiko is available (auto)",
+)
 @click.argument("test-script-file", required=False)
 @pass_context
 # TODO @on_finished(lambda ctx: ctx.state.dump())
 # TODO @on_started(lambda ctx: ctx.assert_valid_env())
-def cli(ctx, user, deployment_file, flavour, test_script_file, test_script):
+def cli(
+    ctx, user, deployment_file, flavour, ssh_backend, test_script_file, test_script
+):
     """Start driver to intearct with deployed environment."""
     read_deployment_info(ctx, deployment_file)
 
@@ -51,6 +59,7 @@ def cli(ctx, user, deployment_file, flavour, test_script_file, test_script):
 
     ctx.external_connect = True
     ctx.no_start = True
+    ctx.ssh_backend = ssh_backend
 
     # TODO add test to ssh port
     if test_script:
@@ -7,6 +7,7 @@ import os.path as op
 
 import sys
 import glob
+import shlex
 import pyinotify
 import asyncio
 import ast
@@ -23,12 +24,16 @@ from ..actions import (
     read_hosts,
     translate_hosts2ip,
     push_on_machines,
+    open_ssh_masters,
+    close_ssh_masters,
+    ssh_control_options,
     realpath_from_store,
     get_fs_type,
 )
 
 from ..driver.driver import Driver
 from ..httpd import HTTPDaemon
+from ..tools.kataract import COMPRESSIONS, parse_topology
 from ..setup import apply_setup
 
 machine_file_towait = ""
@@ -42,6 +47,11 @@ class EventHandler(pyinotify.ProcessEvent):
 
 
 def start(ctx, interactive, execute_test_script, port, machine_file=None):
+    if ctx.stream_ready and not hasattr(ctx.flavour, "stream_machines"):
+        # machines are launched without waiting for them, driver connects them
+        raise click.UsageError(
+            f"--stream is not supported by {ctx.flavour.name} flavour"
+        )
     if (  # TODO rework (ask flavour ?)
         ctx.ip_addresses
         and (ctx.flavour.name != "vm-ramdisk")
@@ -49,18 +59,35 @@ def start(ctx, interactive, execute_test_script, port, machine_file=None):
     ) or ctx.flavour.name == "nspawn":
         if ctx.use_httpd:
             ctx.vlog("Launch: httpd to distribute deployment.json")
-            ctx.httpd = HTTPDaemon(ctx=ctx, port=port)
+            ctx.httpd = HTTPDaemon(
+                ctx=ctx,
+                port=port,
+                rate_limit=ctx.pull_rate * 1000000,
+                server=ctx.http_server,
+                peers=ctx.pull_peers,
+            )
 
         if hasattr(ctx.flavour, "generate_kexec_scripts"):
             ctx.flavour.generate_kexec_scripts()
 
         if ctx.push_path:
-            push_on_machines(ctx)
+            open_ssh_masters(ctx, ctx.ip_addresses)
+            try:
+                push_on_machines(ctx)
+            except BaseException:
+                # nxc stop is not expected after a failed start
+                close_ssh_masters(ctx)
+                raise
 
         if ctx.use_httpd:
             ctx.httpd.start(directory=ctx.envdir)
 
-        if not interactive:
+        if ctx.stream_ready and execute_test_script:
+            # test script starts while machines boot, see driver_initialize
+            ctx.flavour.launch(machine_file=machine_file, wait=False)
+            ctx.no_start = True
+            ctx.external_connect = True
+        elif not interactive:
             ctx.flavour.launch(machine_file=machine_file)
             sys.exit(0)
 
@@ -132,6 +159,79 @@ def start(ctx, interactive, execute_test_script, port, machine_file=None):
     "--push-path",
     help="remote path where to push image, kernel and kexec_script on machines (use to re-kexec)",
 )
+@click.option(
+    "--push-mode",
+    type=click.Choice(["scp", "kataract", "pull"]),
+    default="scp",
+    help="how kernel, initrd and kexec_script are pushed: concurrent scp, kataract pipeline broadcast (need python3 on machines) or pulled by machines from http server at kexec launch (need curl on machines)",
+)
+@click.option(
+    "--push-topology",
+    type=click.STRING,
+    default="chain",
+    help="kataract broadcast topology: chain, tree[:k] (k-ary tree) or rack[:k] (k-ary tree by cluster, clusters chained)",
+)
+@click.option(
+    "--push-compression",
+    type=click.Choice(COMPRESSIONS),
+    default="auto",
+    help="compression on the wire during push: auto (default, when link is slower than compression), none, zlib or zstd (kataract only, python zstandard needed on machines)",
+)
+@click.option(
+    "--push-bundle",
+    is_flag=True,
+    help="push all files at once as a single tar stream (one kataract pipeline or one ssh session per machine)",
+)
+@click.option(
+    "--push-deployment",
+    is_flag=True,
+    help="push also deployment file on machines",
+)
+@click.option(
+    "--force-push",
+    is_flag=True,
+    help="push kernel, initrd and kexec_script even on machines already holding identical files",
+)
+@click.option(
+    "--push-concurrency",
+    type=click.INT,
+    default=64,
+    help="maximum number of concurrent scp/ssh during push (not applied to kataract pipeline) and kexec launch",
+)
+@click.option(
+    "--push-timeout",
+    type=click.FLOAT,
+    default=600,
+    help="time limit in seconds of each push attempt on a machine",
+)
+@click.option(
+    "--push-retries",
+    type=click.INT,
+    default=1,
+    help="number of retries of a failed push on a machine",
+)
+@click.option(
+    "--pull-rate",
+    type=click.FLOAT,
+    default=0,
+    help="bandwidth cap in MB/s of each machine download with pull push mode (0: unlimited)",
+)
+@click.option(
+    "--pull-peers",
+    is_flag=True,
+    help="with pull push mode, machines also download files from machines which already got them, redirected by http server (peer-assisted, need python3 on machines)",
+)
+@click.option(
+    "--stream",
+    "stream_ready",
+    is_flag=True,
+    help="with test script, hand each machine to driver as soon as it is ready instead of waiting for all of them (g5k-ramdisk and g5k-nfs-store flavours)",
+)
+@click.option(
+    "--no-ssh-master",
+    is_flag=True,
+    help="do not share one ssh master connection per machine between ssh/scp invocations",
+)
 @click.option(
     "--reuse",
     is_flag=True,
@@ -142,6 +242,17 @@ def start(ctx, interactive, execute_test_script, port, machine_file=None):
     is_flag=True,
     help="deployement info is served by http (in place of kernel parameters)",
 )
+@click.option(
+    "--full-deployment",
+    is_flag=True,
+    help="machines retrieve whole deployment info from http server (all machines entries) instead of their own part and hosts table",
+)
+@click.option(
+    "--http-server",
+    type=click.Choice(["asyncio", "threading"]),
+    default="asyncio",
+    help="implementation of the HTTP server: asyncio (default, keep-alive, bounded connections) or threading (a thread by connection)",
+)
 @click.option(
     "--port",
     type=click.INT,
@@ -251,10 +362,25 @@ def cli(
     ssh,
     sudo,
     push_path,
+    push_mode,
+    push_topology,
+    push_compression,
+    push_bundle,
+    push_deployment,
+    force_push,
+    push_concurrency,
+    push_timeout,
+    push_retries,
+    pull_rate,
+    pull_peers,
+    stream_ready,
+    no_ssh_master,
     reuse,
     composition,
     flavour,
     remote_deployment_info,
+    full_deployment,
+    http_server,
     port,
     test_script,
     file_test_script,
@@ -287,9 +413,30 @@ def cli(
 
     ctx.log("Starting")
 
-    ctx.ssh = ssh
+    ctx.stream_ready = stream_ready
+    # masters are opened with ssh options, other commands (e.g. oarsh) skip them
+    ctx.ssh_master = not no_ssh_master and shlex.split(ssh)[:1] == ["ssh"]
+    if ctx.ssh_master:
+        ctx.ssh = f"{ssh.rstrip()} {ssh_control_options(ctx)} "
+    else:
+        ctx.ssh = ssh
     ctx.sudo = sudo
     ctx.push_path = push_path
+    ctx.push_mode = push_mode
+    ctx.push_topology = push_topology
+    ctx.push_compression = push_compression
+    ctx.push_bundle = push_bundle
+    ctx.push_deployment = push_deployment
+    ctx.force_push = force_push
+    ctx.push_concurrency = push_concurrency
+    ctx.push_timeout = push_timeout
+    ctx.push_retries = push_retries
+    ctx.pull_rate = pull_rate
+    ctx.pull_peers = pull_peers
+    try:
+        parse_topology(push_topology)
+    except ValueError as e:
+        raise click.ClickException(str(e))
     ctx.interactive = interactive
     ctx.execute_test_script = execute_test_script
     ctx.sigwait = sigwait
@@ -324,8 +471,10 @@ def cli(
         )
     ctx.kernel_params = kernel_params
 
-    if remote_deployment_info:
+    if remote_deployment_info or push_mode == "pull":
         ctx.use_httpd = True
+    ctx.full_deployment = full_deployment
+    ctx.http_server = http_server
 
     if parameter_file:
         with open(parameter_file, "r") as f:
@@ -4,7 +4,7 @@ import os.path as op
 import glob
 
 from ..context import pass_context
-from ..actions import read_deployment_info
+from ..actions import read_deployment_info, close_ssh_masters
 from ..flavours import get_flavour_by_name
 
 
@@ -69,4 +69,5 @@ def cli(ctx, flavour, deployment_file):
 
     read_deployment_info(ctx, deployment_file)
 
+    close_ssh_masters(ctx)
     ctx.flavour.cleanup()
@@ -78,10 +78,31 @@ class Context(object):
         self.ssh = ""
         self.sudo = ""
         self.push_path = None
+        self.push_mode = "scp"
+        self.push_topology = "chain"
+        self.push_compression = "auto"
+        self.push_bundle = False
+        self.push_deployment = False
+        # per file summaries of last push, also written in envdir/push.json
+        self.push_summary = []
+        self.force_push = False
+        self.push_concurrency = 64
+        self.push_timeout = 600
+        self.push_retries = 1
+        # MB/s cap of each machine download in pull push mode (0: unlimited)
+        self.pull_rate = 0
+        # machines also fetch pulled files from machines which got them
+        self.pull_peers = False
+        # ssh/scp multiplexed on a master connection per machine
+        self.ssh_master = True
         self.interactive = False
         self.execute_test_script = False
         self.platform = None
         self.use_httpd = False
+        # asyncio or threading (a thread by connection)
+        self.http_server = "asyncio"
+        # machines fetch whole deployment from httpd, not only their slice
+        self.full_deployment = False
         self.httpd = None
         self.alternative_stores = [
             f"{os.environ['HOME']}/.local/share/nix/root/nix",
@@ -97,6 +118,11 @@ class Context(object):
             False  # use w/ driver CLI command which must not start machines
         )
         self.external_connect: bool = False
+        # driver's ssh to machines: ssh processes (process), in-process
+        # (paramiko), or the latter if available (auto)
+        self.ssh_backend = "process"
+        # machines handed to driver as soon as each one is ready
+        self.stream_ready: bool = False
         self.vde_tap: bool = False  # use to add tap interface which allow external IP
         # access either done by port forwarding on local
         # interface
@@ -1,9 +1,16 @@
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, Iterator, List
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_EXCEPTION,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 import os
 import tempfile
 import signal
+import time
 
 from .logger import rootlog
 from .machine import Machine, retry
@@ -11,6 +18,16 @@ from .vlan import VLan
 from ..flavours import use_flavour_method_if_any
 
 
+class ParallelError(Exception):
+    """Raised by Driver.parallel when calls failed, errors by machine name"""
+
+    def __init__(self, errors: Dict[str, BaseException]):
+        self.errors = errors
+        super().__init__(
+            f"failed on {len(errors)} machine(s): {', '.join(errors.keys())}"
+        )
+
+
 class Driver:
     """A handle to the driver that sets up the environment
     and runs the tests"""
@@ -106,6 +123,9 @@ class Driver:
             subtest=subtest,
             run_tests=self.run_tests,
             join_all=self.join_all,
+            for_each_ready=self.for_each_ready,
+            parallel_execute=self.parallel_execute,
+            parallel_succeed=self.parallel_succeed,
             retry=retry,
             serial_stdout_off=self.serial_stdout_off,
             serial_stdout_on=self.serial_stdout_on,
@@ -141,26 +161,150 @@ class Driver:
             symbols = self.test_symbols()  # call eagerly
             exec(self.tests, symbols, None)
 
-    def run_tests(self) -> None:
+    def run_tests(self, sync_timeout: float = 300) -> None:
         """Run the test script (for non-interactive test runs)"""
         self.test_script()
         # TODO: Collect coverage data
-        for machine in self.machines:
-            if machine.is_up():
-                machine.execute("sync")
+
+        def sync(machine: Machine) -> None:
+            status, _ = machine.execute("sync", timeout=int(sync_timeout))
+            if status != 0:
+                raise Exception(f"sync failed (exit code {status})")
+
+        machines_up = [m for m in self.machines if m.is_up()]
+        with rootlog.nested("sync machines"):
+            try:
+                self.parallel(sync, machines_up, timeout=sync_timeout)
+            except ParallelError as e:
+                # machines which failed are already reported
+                rootlog.warning(f"final sync: {e}")
 
     @use_flavour_method_if_any
     def start_all(self) -> None:
-        """Start all machines"""
+        """Start all machines concurrently (qemu of VMs launched at once)"""
+
+        def timed_start(machine: Machine) -> float:
+            tic = time.time()
+            machine.start()
+            return time.time() - tic
+
         with rootlog.nested("start all VMs"):
-            for machine in self.machines:
-                machine.start()
+            tic = time.time()
+            durations = self.parallel(timed_start, fail_fast=True)
+            for name, duration in durations.items():
+                rootlog.info(f"{name}: started in {duration:.2f}s")
+            rootlog.info(
+                f"{len(durations)} machine(s) started in {time.time() - tic:.2f}s"
+            )
+
+    def parallel(
+        self,
+        fn: Callable[[Machine], Any],
+        machines: Optional[List[Machine]] = None,
+        fail_fast: bool = False,
+        max_workers: int = 64,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Call fn on machines (all by default) concurrently, return results by
+        machine name. With fail_fast, first exception is raised as soon as it
+        occurs and calls not yet started are cancelled. Otherwise all calls are
+        done, failed machines are logged and a ParallelError listing them is
+        raised if any. Calls not done within timeout seconds are reported as
+        failed."""
+        if machines is None:
+            machines = self.machines
+        if not machines:
+            return {}
 
-    def join_all(self) -> None:
-        """Wait for all machines to shut down"""
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(machines)))
+        futures = {m.name: executor.submit(fn, m) for m in machines}
+        return_when = FIRST_EXCEPTION if fail_fast else ALL_COMPLETED
+        done, not_done = wait(futures.values(), timeout, return_when)
+        if fail_fast:
+            for future in done:
+                if future.exception():
+                    for pending in futures.values():
+                        pending.cancel()
+                    executor.shutdown(wait=False)
+                    raise future.exception()
+        # late calls are left running
+        executor.shutdown(wait=not not_done)
+
+        errors = {
+            name: f.exception()
+            for name, f in futures.items()
+            if f in done and f.exception()
+        }
+        for name, f in futures.items():
+            if f in not_done:
+                f.cancel()
+                errors[name] = Exception(f"not done after {timeout}s")
+        for name, error in errors.items():
+            # not rootlog.error, it exits at first failed machine
+            rootlog.warning(f"{name}: {error}")
+        if errors:
+            raise ParallelError(errors)
+        return {name: f.result() for name, f in futures.items()}
+
+    def parallel_execute(
+        self,
+        machines: Optional[List[Machine]],
+        command: str,
+        timeout: Optional[int] = 900,
+    ) -> Dict[str, Tuple[int, str]]:
+        """Execute command on machines (all by default) concurrently, return
+        (status, output) by machine name."""
+        with rootlog.nested(f"parallel execute: {command}"):
+            return self.parallel(
+                lambda m: m.execute(command, timeout=timeout), machines
+            )
+
+    def parallel_succeed(
+        self,
+        machines: Optional[List[Machine]],
+        *commands: str,
+        timeout: Optional[int] = None,
+        fail_fast: bool = True,
+    ) -> Dict[str, str]:
+        """Execute each command on machines (all by default) concurrently and
+        check that it succeeds, return outputs by machine name. With
+        fail_fast=False, all machines run before failed ones are reported."""
+        with rootlog.nested(f"parallel must succeed: {', '.join(commands)}"):
+            return self.parallel(
+                lambda m: m.succeed(*commands, timeout=timeout), machines, fail_fast
+            )
+
+    def for_each_ready(
+        self, fn: Callable[[Machine], Any], machines: Optional[List[Machine]] = None
+    ) -> List[Any]:
+        """Call fn on each machine (all by default) as soon as it is connected,
+        concurrently, and return results in order. With a streaming start,
+        steps of first machines up are not delayed by the slowest ones."""
+
+        def when_ready(machine: Machine) -> Any:
+            machine.connect()
+            return fn(machine)
+
+        if machines is None:
+            machines = self.machines
+        results = self.parallel(when_ready, machines, max_workers=len(machines) or 1)
+        return [results[m.name] for m in machines]
+
+    def join_all(self, timeout: Optional[float] = 600) -> List[str]:
+        """Wait for all machines to shut down, concurrently, at most timeout
+        seconds (no deadline if None). Machines not down are reported and
+        their names returned."""
         with rootlog.nested("wait for all VMs to finish"):
-            for machine in self.machines:
-                machine.wait_for_shutdown()
+            try:
+                self.parallel(
+                    lambda m: m.wait_for_shutdown(),
+                    timeout=timeout,
+                    max_workers=len(self.machines) or 1,
+                )
+            except ParallelError as e:
+                rootlog.warning(f"join all: {e}")
+                return list(e.errors)
+        return []
 
     def serial_stdout_on(self) -> None:
         rootlog._print_serial_logs = True
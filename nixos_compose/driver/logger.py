@@ -6,6 +6,7 @@ from xml.sax.saxutils import XMLGenerator
 import codecs
 import os
 import sys
+import threading
 import time
 import unicodedata
 
@@ -16,6 +17,8 @@ class Logger:
         self.logfile_handle = codecs.open(self.logfile, "wb")
         self.xml = XMLGenerator(self.logfile_handle, encoding="utf-8")
         self.queue: "Queue[Dict[str, str]]" = Queue()
+        # XML log is written by driver threads running machines concurrently
+        self.lock = threading.RLock()
 
         self.xml.startDocument()
         self.xml.startElement("logfile", attrs={})
@@ -40,9 +43,10 @@ class Logger:
         return message
 
     def log_line(self, message: str, attributes: Dict[str, str]) -> None:
-        self.xml.startElement("line", attributes)
-        self.xml.characters(message)
-        self.xml.endElement("line")
+        with self.lock:
+            self.xml.startElement("line", attributes)
+            self.xml.characters(message)
+            self.xml.endElement("line")
 
     def info(self, *args, **kwargs) -> None:  # type: ignore
         self.log(*args, **kwargs)
@@ -56,8 +60,9 @@ class Logger:
 
     def log(self, message: str, attributes: Dict[str, str] = {}) -> None:
         self._eprint(self.maybe_prefix(message, attributes))
-        self.drain_log_queue()
-        self.log_line(message, attributes)
+        with self.lock:
+            self.drain_log_queue()
+            self.log_line(message, attributes)
 
     def log_serial(self, message: str, machine: str) -> None:
         self.enqueue({"msg": message, "machine": machine, "type": "serial"})
@@ -70,23 +75,38 @@ class Logger:
         self.queue.put(item)
 
     def drain_log_queue(self) -> None:
-        try:
-            while True:
-                item = self.queue.get_nowait()
-                msg = self.sanitise(item["msg"])
-                del item["msg"]
-                self.log_line(msg, item)
-        except Empty:
-            pass
+        with self.lock:
+            try:
+                while True:
+                    item = self.queue.get_nowait()
+                    msg = self.sanitise(item["msg"])
+                    del item["msg"]
+                    self.log_line(msg, item)
+            except Empty:
+                pass
 
     @contextmanager
     def nested(self, message: str, attributes: Dict[str, str] = {}) -> Iterator[None]:
+        if threading.current_thread() is not threading.main_thread():
+            # nest elements of concurrent threads would interleave, their
+            # blocks are logged as lines inside the nest of the main thread
+            self.log(message, attributes)
+            tic = time.time()
+            yield
+            toc = time.time()
+            self.log(
+                "(finished: {}, in {:.2f} seconds)".format(message, toc - tic),
+                attributes,
+            )
+            return
+
         self._eprint(self.maybe_prefix(message, attributes))
 
-        self.xml.startElement("nest", attrs={})
-        self.xml.startElement("head", attributes)
-        self.xml.characters(message)
-        self.xml.endElement("head")
+        with self.lock:
+            self.xml.startElement("nest", attrs={})
+            self.xml.startElement("head", attributes)
+            self.xml.characters(message)
+            self.xml.endElement("head")
 
         tic = time.time()
         self.drain_log_queue()
@@ -95,7 +115,8 @@ class Logger:
         toc = time.time()
         self.log("(finished: {}, in {:.2f} seconds)".format(message, toc - tic))
 
-        self.xml.endElement("nest")
+        with self.lock:
+            self.xml.endElement("nest")
 
 
 rootlog = Logger()
@@ -17,6 +17,8 @@ import threading
 import time
 
 from .logger import rootlog
+from .shell import FramedShell
+from .ssh import SSHConnection
 from ..flavours import use_flavour_method_if_any
 
 CHAR_TO_KEY = {
@@ -240,7 +242,8 @@ class Machine:
     monitor: Optional[socket.socket]
     shell: Optional[socket.socket]
     serial_thread: Optional[threading.Thread]
-    process_shell: Optional[subprocess.Popen]
+    process_shell: Optional[FramedShell]
+    ssh_connection: Optional[SSHConnection]
 
     booted: bool
     connected: bool
@@ -292,9 +295,14 @@ class Machine:
         self.monitor = None
         self.shell = None
         self.serial_thread = None
+        self.process_shell = None
+        self.ssh_connection = None
 
         self.booted = False
         self.connected = False
+        self.start_time: Optional[float] = None
+        # set once machine is connected by a streaming start
+        self.ready = threading.Event()
 
     def is_up(self) -> bool:
         return self.booted and self.connected
@@ -620,6 +628,8 @@ class Machine:
 
             self.log("connected to guest root shell")
             self.log("(connecting took {:.2f} seconds)".format(toc - tic))
+            if self.start_time is not None:
+                self.log("(booted in {:.2f} seconds)".format(toc - self.start_time))
             self.connected = True
 
     def copy_from_host_via_shell(self, source: str, target: str) -> None:
@@ -712,6 +722,7 @@ class Machine:
             return
 
         self.log("starting vm")
+        self.start_time = time.time()
 
         def clear(path: Path) -> Path:
             if path.exists():
@@ -720,7 +731,8 @@ class Machine:
 
         def create_socket(path: Path) -> socket.socket:
             s = socket.socket(family=socket.AF_UNIX, type=socket.SOCK_STREAM)
-            s.settimeout(1.0)
+            # qemu of all VMs are launched at once, leave them time to connect
+            s.settimeout(10.0)
             s.bind(str(path))
             s.listen(1)
             return s
@@ -886,12 +898,30 @@ class Machine:
         # command examples:
         # ['docker-compose', '-f', 'nxc/artifact/composition/docker/docker-compose.json', 'exec', '-T', ']
         # ['ssh', '-t', '-o', 'StrictHostKeyChecking=no', '-l', 'root', '10.0.2.16']
-        self.process_shell = subprocess.Popen(
-            args,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+        self.process_shell = FramedShell(args)
+
+    def start_ssh_connection(self, user: str = "root") -> bool:
+        """Open an in-process ssh connection (paramiko) to the machine, unless
+        disabled by ctx.ssh_backend. Return whether commands go through it,
+        an ssh process shell must be started otherwise."""
+        backend = self.ctx.ssh_backend
+        if backend == "process":
+            return False
+        if self.ssh_connection is not None and self.ssh_connection.is_active():
+            return True
+        try:
+            self.ssh_connection = SSHConnection(self.ip, self.ssh_port, user)
+        except ImportError:
+            if backend == "paramiko":
+                raise
+            return False
+        except Exception as e:
+            if backend == "paramiko":
+                raise
+            self.log(f"in-process ssh connection failed ({e}), use ssh process")
+            self.ssh_connection = None
+            return False
+        return True
 
     def execute_process_shell(
         self,
@@ -901,28 +931,33 @@ class Machine:
     ) -> Tuple[int, str]:
         self.connect()
 
-        process_shell = self.process_shell
-
-        try:
-            (stdout, _stderr) = process_shell.communicate(
-                command.encode(), timeout=timeout
-            )
-        except subprocess.TimeoutExpired:
-            process_shell.kill()
-            return (-1, "")
+        if self.ssh_connection is not None and not self.ssh_connection.is_active():
+            self.ssh_connection = None
+            self.restart_process_shell()
 
-        status_code = process_shell.returncode
+        if self.ssh_connection is not None:
+            status_code, stdout, _stderr = self.ssh_connection.execute(command, timeout)
+            if status_code is None or not check_return:
+                return (-1, stdout)
+            return (status_code, stdout)
 
-        # If process gone we need to restart one for next command
-        # Need more investigation why we cannot reuse previous shell...
-        if self.process_shell.poll() is not None:
-            # print("need to restart process")
+        # shell is kept from one command to the next, restarted if gone
+        if self.process_shell is None or not self.process_shell.is_alive():
+            if self.process_shell is not None:
+                self.process_shell.close()
             self.restart_process_shell()
+        result = self.process_shell.execute(command, timeout)
+        if result is None:
+            # timed out or shell exited, a new one is needed for next command
+            self.process_shell.close()
+            self.process_shell = None
+            return (-1, "")
+        status_code, stdout, _stderr = result
 
         if not check_return:
-            return (-1, stdout.decode())
+            return (-1, stdout)
 
-        return (status_code, stdout.decode())
+        return (status_code, stdout)
 
     def restart_process_shell(self):
         self.start()
@@ -0,0 +1,115 @@
+from typing import List, Optional, Tuple
+import base64
+import os
+import re
+import select
+import subprocess
+import threading
+import time
+import uuid
+
+BUFFER_SIZE = 1 << 16
+
+
+class FramedShell:
+    """A long-lived shell process (ssh, docker-compose exec, nspawn...) running
+    commands one after the other. Each command is sent base64 encoded (a
+    syntax error does not kill the shell) with a unique sentinel, its stdout
+    and stderr are read back up to end markers holding the sentinel, stdout's
+    one with the exit status.
+    """
+
+    def __init__(self, args: List[str]):
+        self.process = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.lock = threading.Lock()
+        self.synced = False
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _send(self, command: str) -> bytes:
+        sentinel = uuid.uuid4().hex
+        encoded = base64.b64encode(command.encode()).decode()
+        # stdin of command is not the one of shell, which holds next commands
+        line = (
+            f'( eval "$(echo {encoded} | base64 -d)" ) < /dev/null; '
+            f"printf '\\n{sentinel} %d\\n' $?; printf '\\n{sentinel}\\n' >&2\n"
+        )
+        self.process.stdin.write(line.encode())
+        self.process.stdin.flush()
+        return sentinel.encode()
+
+    def _receive(
+        self, sentinel: bytes, timeout: Optional[float]
+    ) -> Optional[Tuple[int, bytes, bytes]]:
+        stdout_marker = re.compile(b"\n" + sentinel + rb" (\d+)\n")
+        stderr_marker = b"\n" + sentinel + b"\n"
+        # longest stdout marker, exit status has at most 3 digits
+        marker_len = len(sentinel) + 6
+        buffers = {
+            self.process.stdout.fileno(): bytearray(),
+            self.process.stderr.fileno(): bytearray(),
+        }
+        status = None
+        stdout_fd, stderr_fd = list(buffers.keys())
+        pending = [stdout_fd, stderr_fd]
+        deadline = None if timeout is None else time.time() + timeout
+        while pending:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            readable, _, _ = select.select(pending, [], [], remaining)
+            for fd in readable:
+                data = os.read(fd, BUFFER_SIZE)
+                if not data:
+                    # shell is gone
+                    return None
+                # marker can only end in new data, earlier output is not rescanned
+                start = max(0, len(buffers[fd]) - marker_len)
+                buffers[fd] += data
+                if fd == stdout_fd:
+                    match = stdout_marker.search(buffers[fd], start)
+                    if match:
+                        status = int(match.group(1))
+                        del buffers[fd][match.start() :]
+                        pending.remove(fd)
+                elif buffers[fd].endswith(stderr_marker):
+                    del buffers[fd][-len(stderr_marker) :]
+                    pending.remove(fd)
+        return (status, bytes(buffers[stdout_fd]), bytes(buffers[stderr_fd]))
+
+    def execute(
+        self, command: str, timeout: Optional[float] = 900
+    ) -> Optional[Tuple[int, str, str]]:
+        """Run command, return its exit status, stdout and stderr, or None if
+        it timed out or the shell exited (shell must not be used anymore)."""
+        with self.lock:
+            try:
+                if not self.synced:
+                    # skip what shell prints at start (motd, warnings...)
+                    if self._receive(self._send("true"), timeout) is None:
+                        return None
+                    self.synced = True
+                result = self._receive(self._send(command), timeout)
+            except (BrokenPipeError, ValueError):
+                return None
+        if result is None:
+            return None
+        status, stdout, stderr = result
+        return (
+            status,
+            stdout.decode(errors="replace"),
+            stderr.decode(errors="replace"),
+        )
+
+    def close(self) -> None:
+        if self.is_alive():
+            self.process.kill()
+        self.process.wait()
+        for f in (self.process.stdin, self.process.stdout, self.process.stderr):
+            f.close()
@@ -0,0 +1,119 @@
+from typing import Any, Dict, Optional, Tuple
+import os
+import select
+import time
+
+from .logger import rootlog
+
+BUFFER_SIZE = 1 << 16
+
+
+def ssh_config_options(
+    host: str, port: int, user: str, config_file: str = "~/.ssh/config"
+) -> Dict[str, Any]:
+    """paramiko connect options of host from ssh config file, as ssh process
+    would use them: HostName, IdentityFile and ProxyCommand or ProxyJump apply,
+    user and port given (as by -l and -p options) take precedence. A proxy is
+    returned as its command line (proxy_command)."""
+    import paramiko
+
+    options: Dict[str, Any] = {"hostname": host, "port": int(port), "username": user}
+    config_file = os.path.expanduser(config_file)
+    if not os.path.exists(config_file):
+        return options
+    with open(config_file) as f:
+        # first obtained value wins, given port is the one of %p tokens
+        text = f"Host *\n  Port {port}\n" + f.read()
+    config = paramiko.SSHConfig.from_text(text).lookup(host)
+    options["hostname"] = config.get("hostname", host)
+    if "identityfile" in config:
+        options["key_filename"] = config["identityfile"]
+    if "proxycommand" in config and config["proxycommand"].lower() != "none":
+        options["proxy_command"] = config["proxycommand"]
+    elif "proxyjump" in config and config["proxyjump"].lower() != "none":
+        *hops, last = config["proxyjump"].split(",")
+        jump = ["-J", ",".join(hops)] if hops else []
+        command = ["ssh", *jump, "-W", f"{options['hostname']}:{port}", last]
+        options["proxy_command"] = " ".join(command)
+    return options
+
+
+class SSHConnection:
+    """An authenticated ssh connection to a machine, kept open in process
+    (paramiko). Each command runs in its own channel of the connection, which
+    costs a round trip instead of an ssh handshake. Channels can be used
+    concurrently from several threads. Host options of ~/.ssh/config are
+    honoured, ssh master connections are not used.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 22,
+        user: str = "root",
+        timeout: float = 30,
+        config_file: str = "~/.ssh/config",
+    ):
+        # optional dependency, ssh processes are used without it
+        import paramiko
+
+        self.host = host
+        self.port = port
+        self.client = paramiko.SSHClient()
+        self.client.load_system_host_keys()
+        # as ssh -o StrictHostKeyChecking=no
+        self.client.set_missing_host_key_policy(paramiko.WarningPolicy())
+        options = ssh_config_options(host, port, user, config_file)
+        proxy_command = options.pop("proxy_command", None)
+        if proxy_command:
+            options["sock"] = paramiko.ProxyCommand(proxy_command)
+        self.client.connect(
+            **options,
+            timeout=timeout,
+            allow_agent=True,
+            look_for_keys=True,
+        )
+        rootlog.info(f"in-process ssh connection to {user}@{host}:{port}")
+
+    def execute(
+        self, command: str, timeout: Optional[float] = 900
+    ) -> Tuple[Optional[int], str, str]:
+        """Run command, return its exit status (None on timeout), stdout and
+        stderr."""
+        channel = self.client.get_transport().open_session()
+        deadline = None if timeout is None else time.time() + timeout
+        status = None
+        stdout = []
+        stderr = []
+        try:
+            channel.exec_command(command)
+            while True:
+                # drain both outputs, the command blocks on a full window
+                if channel.recv_ready():
+                    stdout.append(channel.recv(BUFFER_SIZE))
+                elif channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(BUFFER_SIZE))
+                elif channel.exit_status_ready():
+                    status = channel.recv_exit_status()
+                    break
+                else:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    # exit status alone does not wake select up
+                    wait = 1 if remaining is None else min(remaining, 1)
+                    select.select([channel], [], [], wait)
+        finally:
+            channel.close()
+        return (
+            status,
+            b"".join(stdout).decode(errors="replace"),
+            b"".join(stderr).decode(errors="replace"),
+        )
+
+    def is_active(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self) -> None:
+        self.client.close()
@@ -1,21 +1,25 @@
 import os
 import os.path as op
-import time
 from string import Template
 import click
 import subprocess
 import socket
+import threading
 
 from ..flavour import Flavour
 from ..actions import (
     read_compose_info,
     realpath_from_store,
+    deployment_url,
     generate_deployment_info,
     generate_deploy_info_b64,
     generate_kexec_scripts,
     launch_ssh_kexec,
     wait_ssh_ports,
+    wait_booted_machines,
     ssh_connect,
+    open_ssh_masters,
+    ssh_control_options,
 )
 from ..driver.machine import Machine
 
@@ -66,8 +70,7 @@ def generate_kadeploy_envfile(
 
     if not deploy:
         if ctx.use_httpd:
-            base_url = f"http://{ctx.httpd.ip}:{ctx.httpd.port}"
-            deploy = f"{base_url}/deploy/{ctx.composition_flavour_prefix}.json"
+            deploy = deployment_url(ctx)
         else:
             generate_deploy_info_b64(ctx)
             deploy = ctx.deployment_info_b64
@@ -103,10 +106,18 @@ class G5kKexecBasedFlavour(Flavour):
     def generate_kexec_scripts(self):
         generate_kexec_scripts(self.ctx)
 
-    def launch(self, machine_file=None):
+    def launch(self, machine_file=None, wait=True):
         launch_ssh_kexec(self.ctx)
-        time.sleep(10)
-        wait_ssh_ports(self.ctx)
+        # rebooting machines are waited by driver on streaming start
+        self.rebooting = not wait
+        if not wait:
+            return
+        if self.ctx.use_httpd:
+            wait_booted_machines(self.ctx)
+        else:
+            wait_ssh_ports(self.ctx, rebooting=True)
+        if self.ctx.push_path:
+            open_ssh_masters(self.ctx, self.ctx.ip_addresses)
 
     def driver_initialize(self, tmp_dir):
         self.tmp_dir = tmp_dir
@@ -126,21 +137,64 @@ class G5kKexecBasedFlavour(Flavour):
                     )
                 )
 
+            if ctx.stream_ready:
+                threading.Thread(target=self.stream_machines, daemon=True).start()
+                return
+
             for machine in self.machines:
                 if not machine.connected:
                     self.start(machine)
                 machine.connected = True
+                machine.ready.set()
             return
 
+    def stream_machines(self):
+        """Connect each machine as soon as it is ready."""
+        machines = {m.ip: m for m in self.machines}
+
+        def machine_ready(ip):
+            self.machine_ready(machines[ip])
+
+        ips = list(machines.keys())
+        rebooting = getattr(self, "rebooting", False)
+        if self.ctx.use_httpd and rebooting:
+            wait_booted_machines(self.ctx, ips, on_ready=machine_ready)
+        else:
+            wait_ssh_ports(self.ctx, ips, rebooting=rebooting, on_ready=machine_ready)
+
+    def machine_ready(self, machine):
+        """Open shell of a streamed machine and release steps waiting for it."""
+        if self.ctx.push_path:
+            open_ssh_masters(self.ctx, [machine.ip])
+        self.start_shell(machine)
+        machine.connected = True
+        machine.ready.set()
+
+    def connect(self, machine):
+        # streamed machines are connected by stream_machines
+        machine.ready.wait()
+
     def start(self, machine):
+        if self.ctx.no_start and self.ctx.stream_ready:
+            # shell of a streamed machine is first opened by machine_ready, one
+            # opened before would reach the machine still rebooting
+            machine.ready.wait()
+            if machine.process_shell is None and machine.ssh_connection is None:
+                # restarted after a timed out command or a dead shell
+                self.start_shell(machine)
+        else:
+            self.start_shell(machine)
+
+    def start_shell(self, machine):
         if not self.ctx.no_start:
             print("Not Yet Implemented")
             exit(1)
-        else:
+        elif not machine.start_ssh_connection():
             machine.start_process_shell(
                 [
                     "ssh",
                     "-t",
+                    *ssh_control_options(self.ctx).split(),
                     "-o",
                     "StrictHostKeyChecking=no",
                     "-l",
@@ -242,11 +296,12 @@ class G5KImageFlavour(Flavour):
         if not self.ctx.no_start:
             print("Not Yet Implemented")
             exit(1)
-        else:
+        elif not machine.start_ssh_connection():
             machine.start_process_shell(
                 [
                     "ssh",
                     "-t",
+                    *ssh_control_options(self.ctx).split(),
                     "-o",
                     "StrictHostKeyChecking=no",
                     "-l",
@@ -10,6 +10,7 @@ from ..actions import (
     generate_deployment_info,
     ssh_connect,
     kill_proc_tree,
+    ssh_control_options,
     realpath_from_store,
 )
 from ..driver.vlan import VLan
@@ -153,10 +154,14 @@ class VmBasedFlavour(Flavour):
         return self.vlan
 
     def start_process_shell(self, machine):
+        # a VM just launched is not yet up, ssh process waits for it
+        if self.ctx.no_start and machine.start_ssh_connection():
+            return
         machine.start_process_shell(
             [
                 "ssh",
                 "-t",
+                *ssh_control_options(self.ctx).split(),
                 "-o",
                 "StrictHostKeyChecking=no",
                 "-l",
@@ -1,9 +1,410 @@
+import asyncio
+import email.utils
+import http
+import http.client
 import http.server
+import io
 import sys
 import os
+import os.path as op
+import posixpath
+import glob
+import gzip
+import hashlib
+import json
+import mimetypes
+import re
 import socket
 import socketserver
 import threading
+import time
+import urllib.parse
+
+
+class CachedFile:
+    """Content of a file served from memory, with its gzip compressed version
+    and an etag."""
+
+    def __init__(self, path, body=None):
+        if body is None:
+            with open(path, "rb") as f:
+                body = f.read()
+        self.body = body
+        self._gzip_body = None
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()}"'
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    @property
+    def gzip_body(self):
+        # only when a client accepts it
+        if self._gzip_body is None:
+            self._gzip_body = gzip.compress(self.body)
+        return self._gzip_body
+
+
+class DeploymentSlices:
+    """Parts of a deployment needed by each machine: its own entry, data
+    shared by all machines and hosts table (ip: hostname). Shared part is
+    serialized once, a slice is made by appending the entry of a machine."""
+
+    def __init__(self, deployment):
+        machines = deployment.get("deployment", {})
+        self.machines = machines
+        self.ips_by_host = {m.get("host"): ip for ip, m in machines.items()}
+        shared = {k: v for k, v in deployment.items() if k != "deployment"}
+        shared["hosts"] = {ip: m.get("host") for ip, m in machines.items()}
+        self.prefix = json.dumps(shared)[:-1].encode() + b', "deployment": '
+
+    def body(self, host):
+        """Slice of machine host (ip or hostname), None if it is unknown."""
+        ip = host if host in self.machines else self.ips_by_host.get(host)
+        if ip is None:
+            return None
+        return self.prefix + json.dumps({ip: self.machines[ip]}).encode() + b"}"
+
+
+class RateLimiter:
+    """Bandwidth cap shared by all downloads of a client: each chunk is given
+    its send time, after the chunks already scheduled."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def delay(self, nbytes):
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_time)
+            self.next_time = start + nbytes / self.rate
+            return start - now
+
+
+def parse_range(range_header, size):
+    """(start, end) (end excluded) of a single byte range, None when header
+    is absent or not supported (whole file is sent), "unsatisfiable"
+    otherwise."""
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header or "")
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # suffix: last bytes
+        start = max(size - int(last), 0)
+        end = size
+    else:
+        start = int(first)
+        end = size if not last else min(int(last) + 1, size)
+    if start >= size or start >= end:
+        return "unsatisfiable"
+    return (start, end)
+
+
+class Response:
+    """Answer to a request: status, headers and body, either bytes or the
+    start:end part of an opened file (sent with sendfile)."""
+
+    def __init__(self, status, headers=None, body=b"", file=None, start=0, end=0):
+        self.status = status
+        self.headers = headers or []
+        self.body = body
+        self.file = file
+        self.start = start
+        self.end = end
+        # called once response is sent
+        self.on_close = None
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        if self.on_close:
+            self.on_close()
+
+    def chunks(self, client):
+        """(offset, count, delay) of file parts to send to client one after
+        the other, delay being the wait before sending to respect rate_limit."""
+        limiter = HTTPDaemon.rate_limiter(client)
+        chunk_size = HTTPDaemon.chunk_size
+        if limiter:
+            # about 10 chunks per second
+            chunk_size = max(min(chunk_size, int(limiter.rate / 10)), 1 << 12)
+        for offset in range(self.start, self.end, chunk_size):
+            count = min(chunk_size, self.end - offset)
+            yield (offset, count, limiter.delay(count) if limiter else 0)
+
+
+def error_response(status, message):
+    body = f"{message}\n".encode()
+    headers = [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))]
+    return Response(status, headers, body)
+
+
+def cached_response(cached, headers, head=False):
+    """Answer from memory: 304 if client already holds this version, gzip
+    compressed body if client accepts it."""
+    if_none_match = headers.get("If-None-Match", "")
+    etags = [e.strip() for e in if_none_match.split(",")]
+    if cached.etag in etags or "*" in etags:
+        return Response(304, [("ETag", cached.etag)])
+    accept_encoding = headers.get("Accept-Encoding", "")
+    encodings = [e.split(";")[0].strip() for e in accept_encoding.split(",")]
+    body = cached.body
+    response_headers = [
+        ("Content-Type", cached.content_type),
+        ("ETag", cached.etag),
+        ("Vary", "Accept-Encoding"),
+    ]
+    if "gzip" in encodings:
+        body = cached.gzip_body
+        response_headers.append(("Content-Encoding", "gzip"))
+    response_headers.append(("Content-Length", str(len(body))))
+    return Response(200, response_headers, b"" if head else body)
+
+
+def file_response(path, headers, head=False):
+    """Answer with a (large) file, only requested range if any."""
+    try:
+        f = open(path, "rb")
+        stat = os.fstat(f.fileno())
+    except OSError:
+        return error_response(404, "File not found")
+    size = stat.st_size
+    etag = HTTPDaemon.files_etag(path, stat)
+    byte_range = parse_range(headers.get("Range"), size)
+    if_range = headers.get("If-Range")
+    if if_range and if_range != etag:
+        # file changed since first part was fetched: all again
+        byte_range = None
+    if byte_range == "unsatisfiable":
+        f.close()
+        return Response(
+            416, [("Content-Range", f"bytes */{size}"), ("Content-Length", "0")]
+        )
+    response = Response(200, file=f, start=0, end=size)
+    if byte_range is not None:
+        response.status = 206
+        response.start, response.end = byte_range
+        response.headers.append(
+            ("Content-Range", f"bytes {response.start}-{response.end - 1}/{size}")
+        )
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    response.headers += [
+        ("Content-Type", content_type),
+        ("Content-Length", str(response.end - response.start)),
+        ("Accept-Ranges", "bytes"),
+        ("ETag", etag),
+    ]
+    if head:
+        f.close()
+        response.file = None
+    return response
+
+
+def directory_response(target, headers, head=False):
+    """Answer with a file of directory (no listing)."""
+    path = urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+    # no way out of directory
+    path = posixpath.normpath("/" + path).lstrip("/")
+    full_path = op.join(HTTPDaemon.directory, path)
+    if not op.isfile(full_path):
+        return error_response(404, "File not found")
+    return file_response(full_path, headers, head)
+
+
+def boot_response(client, query):
+    """Machine notifies it booted (sshd up) with its host, role and uptime."""
+    params = {k: v[-1] for k, v in urllib.parse.parse_qs(query).items()}
+    try:
+        uptime = float(params.get("uptime", ""))
+    except ValueError:
+        uptime = None
+    with HTTPDaemon.booted_condition:
+        HTTPDaemon.booted[client] = {
+            "host": params.get("host", ""),
+            "role": params.get("role", ""),
+            "uptime": uptime,
+            "time": time.time(),
+        }
+        HTTPDaemon.booted_condition.notify_all()
+    return Response(204)
+
+
+class Peers:
+    """Machines holding served files (peers) and which later requesters of
+    these files are redirected to, so that distribution bandwidth grows with
+    machines. A peer is sent at most max_uploads machines at once, daemon
+    serves direct_uploads of them itself before busy peers get more. Peers
+    leave once no machine requested their files for linger seconds and all
+    requesters got them (or gave up, after timeout seconds)."""
+
+    def __init__(self, max_uploads=4, direct_uploads=8, linger=3, timeout=120):
+        self.max_uploads = max_uploads
+        self.direct_uploads = direct_uploads
+        self.linger = linger
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # peers (ip, port) by url path
+        self.holders = {}
+        # machines being sent to each peer
+        self.uploads = {}
+        # peer and time by (url path, client)
+        self.assignments = {}
+        # time of requests by (url path, client) not advertised complete yet
+        self.pending = {}
+        self.direct = 0
+        self.last_request = 0
+        self.redirected = 0
+        self.served = 0
+
+    def _release(self, key):
+        peer, _ = self.assignments.pop(key, (None, None))
+        if peer in self.uploads:
+            self.uploads[peer] -= 1
+
+    def _drop(self, peer):
+        for holders in self.holders.values():
+            holders.discard(peer)
+        self.uploads.pop(peer, None)
+
+    def source(self, url_path, client, failed=None):
+        """Peer to redirect client to for url_path, None if daemon serves it
+        (direct_done must be called once sent)."""
+        now = time.time()
+        with self.lock:
+            key = (url_path, client)
+            self.pending[key] = now
+            self.last_request = now
+            # retry of client
+            self._release(key)
+            if failed:
+                ip, _, port = failed.rpartition(":")
+                if port.isdigit():
+                    self._drop((ip, int(port)))
+            for k, (_, since) in list(self.assignments.items()):
+                if now - since > self.timeout:
+                    self._release(k)
+
+            candidates = [
+                p
+                for p in self.holders.get(url_path, ())
+                if p[0] != client and p in self.uploads
+            ]
+            peer = min(candidates, key=self.uploads.get, default=None)
+            if peer is None or (
+                self.uploads[peer] >= self.max_uploads
+                and self.direct < self.direct_uploads
+            ):
+                self.direct += 1
+                self.served += 1
+                return None
+            self.uploads[peer] += 1
+            self.assignments[key] = (peer, now)
+            self.redirected += 1
+            return peer
+
+    def direct_done(self):
+        with self.lock:
+            self.direct -= 1
+
+    def have(self, url_path, client, port):
+        """client got url_path and serves it on port."""
+        peer = (client, port)
+        with self.lock:
+            key = (url_path, client)
+            self._release(key)
+            self.pending.pop(key, None)
+            self.holders.setdefault(url_path, set()).add(peer)
+            self.uploads.setdefault(peer, 0)
+
+    def leave(self, client, port):
+        with self.lock:
+            self._drop((client, port))
+
+    def done(self, client, port):
+        """Whether peer is not needed anymore."""
+        peer = (client, port)
+        now = time.time()
+        with self.lock:
+            if self.uploads.get(peer):
+                return False
+            if now - self.last_request < self.linger:
+                return False
+            files = {u for u, holders in self.holders.items() if peer in holders}
+            return not any(
+                u in files and now - since < self.timeout
+                for (u, _), since in self.pending.items()
+            )
+
+
+def peer_file_response(client, path, query, headers):
+    """Redirect to a peer holding file at path, or send it."""
+    params = urllib.parse.parse_qs(query)
+    failed = params.get("failed", [None])[-1]
+    peer = HTTPDaemon.peers.source(path, client, failed)
+    if peer:
+        location = f"http://{peer[0]}:{peer[1]}{urllib.parse.quote(path)}"
+        return Response(302, [("Location", location), ("Content-Length", "0")])
+    response = file_response(HTTPDaemon.files[path], headers)
+    response.on_close = HTTPDaemon.peers.direct_done
+    return response
+
+
+def peers_response(client, url):
+    """Peer advertises a complete file (have), asks whether it is still
+    needed (status) or leaves."""
+    params = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+    try:
+        port = int(params.get("port", ""))
+    except ValueError:
+        return error_response(400, "port expected")
+    peers = HTTPDaemon.peers
+    if url.path == "/peers/have" and "path" in params:
+        peers.have(params["path"], client, port)
+    elif url.path == "/peers/leave":
+        peers.leave(client, port)
+    elif url.path == "/peers/status":
+        body = json.dumps({"done": peers.done(client, port)}).encode()
+        headers = [("Content-Type", "application/json")]
+        return Response(200, headers + [("Content-Length", str(len(body)))], body)
+    else:
+        return error_response(404, f"Unknown peers request {url.path}")
+    return Response(204)
+
+
+def respond(client, method, target, headers):
+    """Response to request of client, None if it is about a file of directory
+    not handled here."""
+    if method == "GET":
+        log_message = f"{client}: HTTP GET {target}"
+        if HTTPDaemon.ctx:
+            HTTPDaemon.ctx.vlog(log_message)
+        else:
+            print(log_message)
+        with HTTPDaemon.lock:
+            HTTPDaemon.machines.append(client)
+    head = method == "HEAD"
+    url = urllib.parse.urlsplit(target)
+    if url.path == "/boot":
+        return boot_response(client, url.query)
+    path = urllib.parse.unquote(url.path)
+    cached = HTTPDaemon.cache.get(path)
+    if cached:
+        return cached_response(cached, headers, head)
+    if path in HTTPDaemon.files:
+        if HTTPDaemon.peers and not head and path != "/peer.py":
+            return peer_file_response(client, path, url.query, headers)
+        return file_response(HTTPDaemon.files[path], headers, head)
+    if url.path.startswith("/peers/") and HTTPDaemon.peers:
+        return peers_response(client, url)
+    if path.startswith("/node/"):
+        # deploy/name reduced to the part of host (ip or hostname)
+        name = path[len("/node/") :]
+        host = urllib.parse.parse_qs(url.query).get("host", [client])[-1]
+        cached = HTTPDaemon.node_slice(f"/deploy/{name}", host)
+        if cached:
+            return cached_response(cached, headers, head)
+        return error_response(404, f"No machine {host} in deployment {name}")
+    return None
 
 
 class HTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
@@ -25,29 +426,219 @@ class HTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             sys.stderr.write(message)
 
     def do_GET(self):
-        log_message = f"{self.client_address[0]}: HTTP GET {self.path}"
-        if HTTPDaemon.ctx:
-            HTTPDaemon.ctx.vlog(log_message)
+        response = respond(self.client_address[0], "GET", self.path, self.headers)
+        if response:
+            self.send(response)
         else:
-            print(log_message)
-        http.server.SimpleHTTPRequestHandler.do_GET(self)
-        with HTTPDaemon.lock:
-            HTTPDaemon.machines.append(self.client_address[0])
-            # if len(HTTPDaemon.machines) == HTTPDaemon.expected_nb_machines:
-            #    HTTPDaemon.get_done_event.set()
+            http.server.SimpleHTTPRequestHandler.do_GET(self)
+
+    def do_HEAD(self):
+        response = respond(self.client_address[0], "HEAD", self.path, self.headers)
+        if response:
+            self.send(response)
+        else:
+            http.server.SimpleHTTPRequestHandler.do_HEAD(self)
+
+    def send(self, response):
+        try:
+            self.send_response(response.status)
+            for name, value in response.headers:
+                self.send_header(name, value)
+            self.end_headers()
+            if response.body:
+                self.wfile.write(response.body)
+            if not response.file:
+                return
+            for offset, count, delay in response.chunks(self.client_address[0]):
+                time.sleep(delay)
+                if self.connection.sendfile(response.file, offset, count) < count:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            # client gone, it resumes with a range request
+            pass
+        finally:
+            response.close()
+
+
+class AsyncHTTPServer:
+    """HTTP/1.1 server of HTTPDaemon running on an asyncio loop, a few
+    thousands of machines fetching at once do not make as many threads.
+    Connections are kept alive, at most max_connections are served at once
+    (others wait for a slot) and a response is sent only as fast as the
+    client reads it. Same interface as socketserver servers used by
+    HTTPDaemon (server_address, serve_forever, shutdown)."""
+
+    def __init__(
+        self, server_address, max_connections=1024, idle_timeout=15, backlog=4096
+    ):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.slots = None
+        self.connections = set()
+        self.stopped = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        host, port = server_address
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(
+                self.handle,
+                host or "0.0.0.0",
+                port,
+                backlog=backlog,
+                reuse_address=True,
+                limit=1 << 16,
+            )
+        )
+        self.server_address = self.server.sockets[0].getsockname()
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+            self.server.close()
+            for task in self.connections:
+                task.cancel()
+            self.loop.run_until_complete(
+                asyncio.gather(*self.connections, return_exceptions=True)
+            )
+            self.loop.run_until_complete(self.server.wait_closed())
+        finally:
+            self.loop.close()
+            self.stopped.set()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.stopped.wait()
+
+    async def handle(self, reader, writer):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_connections)
+        task = asyncio.current_task()
+        self.connections.add(task)
+        client = writer.get_extra_info("peername")[0]
+        try:
+            async with self.slots:
+                while await self.handle_request(reader, writer, client):
+                    pass
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            http.client.HTTPException,
+            ConnectionError,
+            ValueError,
+        ):
+            # idle, gone or misbehaving client
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def handle_request(self, reader, writer, client):
+        """Answer next request on connection, return whether it is kept
+        alive."""
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.idle_timeout)
+        request_line, _, header_lines = head.partition(b"\r\n")
+        request = request_line.decode("latin-1").split()
+        if len(request) != 3:
+            await self.send(writer, client, error_response(400, "Bad request"), False)
+            return False
+        method, target, version = request
+        headers = http.client.parse_headers(io.BytesIO(header_lines))
+        connection = headers.get("Connection", "").lower()
+        if version == "HTTP/1.1":
+            keep_alive = connection != "close"
+        else:
+            keep_alive = connection == "keep-alive"
+        length = int(headers.get("Content-Length") or 0)
+        if length:
+            # not expected, skipped
+            await reader.readexactly(length)
+
+        if method not in ("GET", "HEAD"):
+            response = error_response(501, f"Unsupported method {method}")
+        else:
+            response = respond(client, method, target, headers)
+            if response is None:
+                response = directory_response(target, headers, method == "HEAD")
+        await self.send(writer, client, response, keep_alive)
+        return keep_alive
+
+    async def send(self, writer, client, response, keep_alive):
+        status = http.HTTPStatus(response.status)
+        lines = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Date: {email.utils.formatdate(usegmt=True)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        lines += [f"{name}: {value}" for name, value in response.headers]
+        try:
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            writer.write(response.body)
+            # client reading slowly holds this connection only
+            await writer.drain()
+            if not response.file:
+                return
+            for offset, count, delay in response.chunks(client):
+                if delay:
+                    await asyncio.sleep(delay)
+                sent = await self.loop.sendfile(
+                    writer.transport, response.file, offset, count
+                )
+                if sent < count:
+                    raise ConnectionError("file truncated")
+        finally:
+            response.close()
 
 
 class HTTPDaemon:
     lock = threading.Lock()
     machines = []
+    # boot notifications by ip
+    booted = {}
+    booted_condition = threading.Condition(lock)
     expected_nb_machines = 0
-    # get_done_event = threading.Event()
     directory = ""
     ctx = None
+    # files served from memory by url path
+    cache = {}
+    # preloaded files of directory (deployment files fetched by all machines)
+    preloaded = ["deploy/*.json"]
+    # slices of deployments by url path
+    deployments = {}
+    # files served (as is, with ranges) by url path, see serve_file
+    files = {}
+    chunk_size = 1 << 20
+    # bytes/s of each client, 0 for unlimited
+    rate_limit = 0
+    limiters = {}
+    # peer-assisted distribution of files, see Peers
+    peers = None
 
-    def __init__(self, ctx=None, port=0):
+    def __init__(
+        self,
+        ctx=None,
+        port=0,
+        rate_limit=0,
+        server="asyncio",
+        max_connections=1024,
+        peers=False,
+    ):
         HTTPDaemon.ctx = ctx
-        self.httpd = socketserver.ThreadingTCPServer(("", port), HTTPRequestHandler)
+        HTTPDaemon.rate_limit = rate_limit
+        with HTTPDaemon.lock:
+            # notifications of machines of a previous daemon (deployment)
+            HTTPDaemon.booted = {}
+        HTTPDaemon.peers = Peers() if peers else None
+        if peers:
+            # run by machines to download files and serve them to others
+            HTTPDaemon.files["/peer.py"] = op.join(
+                op.dirname(op.abspath(__file__)), "tools", "peer.py"
+            )
+        if server == "asyncio":
+            self.httpd = AsyncHTTPServer(("", port), max_connections)
+        else:
+            # a thread by connection
+            self.httpd = socketserver.ThreadingTCPServer(("", port), HTTPRequestHandler)
         self.port = self.httpd.server_address[1]
 
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -62,14 +653,76 @@ class HTTPDaemon:
     def start(self, expected_nb_machines=0, directory=os.getcwd()):
         HTTPDaemon.expected_nb_machines = expected_nb_machines
         HTTPDaemon.directory = directory
+        self.preload()
 
         self.httpd_thread.start()
 
-        # HTTPDaemon.get_done_event.wait()
-        # self.httpd.shutdown()
+    def preload(self):
+        """Load preloaded files of directory in memory (again if changed)."""
+        for pattern in HTTPDaemon.preloaded:
+            for path in glob.glob(op.join(HTTPDaemon.directory, pattern)):
+                url_path = "/" + op.relpath(path, HTTPDaemon.directory)
+                cached = CachedFile(path)
+                with HTTPDaemon.lock:
+                    HTTPDaemon.cache[url_path] = cached
+                    if url_path.startswith("/deploy/"):
+                        HTTPDaemon.deployments.pop(url_path, None)
+                        try:
+                            deployment = json.loads(cached.body)
+                        except ValueError:
+                            # served as is, no slices
+                            continue
+                        slices = DeploymentSlices(deployment)
+                        HTTPDaemon.deployments[url_path] = slices
+
+    @staticmethod
+    def node_slice(url_path, host):
+        """Slice of deployment at url_path for host, None if none."""
+        slices = HTTPDaemon.deployments.get(url_path)
+        body = slices and slices.body(host)
+        if not body:
+            return None
+        # not kept, N slices of size N would be
+        return CachedFile(url_path, body)
+
+    def serve_file(self, path):
+        """Serve path (e.g. kernel or initrd from store), return its url."""
+        real_path = op.realpath(path)
+        key = hashlib.sha1(real_path.encode()).hexdigest()[:16]
+        url_path = f"/files/{key}/{op.basename(real_path)}"
+        HTTPDaemon.files[url_path] = real_path
+        return f"http://{self.ip}:{self.port}{url_path}"
+
+    @staticmethod
+    def files_etag(path, stat):
+        key = hashlib.sha1(path.encode()).hexdigest()[:16]
+        return f'"{key}-{stat.st_size:x}-{int(stat.st_mtime):x}"'
+
+    @staticmethod
+    def rate_limiter(client):
+        if not HTTPDaemon.rate_limit:
+            return None
+        with HTTPDaemon.lock:
+            if client not in HTTPDaemon.limiters:
+                HTTPDaemon.limiters[client] = RateLimiter(HTTPDaemon.rate_limit)
+            return HTTPDaemon.limiters[client]
 
     def stop(self):
         self.httpd.shutdown()
 
+    def wait_booted(self, ips, timeout=None):
+        """Wait for boot notifications of all ips, return those which did not
+        notify within timeout seconds."""
+        deadline = None if timeout is None else time.time() + timeout
+        with HTTPDaemon.booted_condition:
+            while True:
+                missing = [ip for ip in ips if ip not in HTTPDaemon.booted]
+                if not missing:
+                    return []
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return missing
+                HTTPDaemon.booted_condition.wait(remaining)
+
     # def wait(self, nb_machines):
     #    pass
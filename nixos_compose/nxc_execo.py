@@ -95,6 +95,9 @@ def get_oar_job_nodes_nxc(
 
     print("generating deploy info")
     flavour.generate_deployment_info()
+    if ctx.httpd:
+        # httpd started before deployment file is (re)generated
+        ctx.httpd.preload()
 
     flavour.ctx.mode = {"name": "ssh", "vm": False, "shell": "ssh"}
     # flavour.ctx.ssh = f"OAR_JOB_ID={oar_job_id} oarsh"
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# Local benchmark of HTTPDaemon servers facing a synchronized wave of machines
+# fetching their deployment at once (as after a kexec on a large reservation).
+# Machines are simulated on this host by distinct loopback addresses
+# (127.0.0.0/8), server runs in its own process to measure its threads, memory
+# and cpu. Run from repository root:
+#   python -m nixos_compose.tools.httpd_bench -n 1000,5000
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import socket
+import statistics
+import subprocess
+import tempfile
+import shutil
+
+COMPOSITION = "composition::g5k-ramdisk"
+
+
+def loopback_address(i):
+    # 127.0.0.1 is the server
+    i += 2
+    return f"127.{i >> 16}.{(i >> 8) & 255}.{i & 255}"
+
+
+def raise_nofile_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def make_deployment(directory, nb_clients):
+    deploy_dir = os.path.join(directory, "deploy")
+    os.makedirs(deploy_dir, exist_ok=True)
+    deployment = {
+        "ssh_key.pub": "ssh-rsa " + "A" * 372 + " bench@nxc",
+        "user": "bench",
+        "composition": "composition",
+        "deployment": {
+            loopback_address(i): {"role": "node", "host": f"node{i}"}
+            for i in range(nb_clients)
+        },
+    }
+    with open(os.path.join(deploy_dir, f"{COMPOSITION}.json"), "w") as f:
+        json.dump(deployment, f, indent=2)
+
+
+def serve(args):
+    """Server process: run HTTPDaemon until stdin is closed."""
+    from nixos_compose.httpd import HTTPDaemon
+
+    raise_nofile_limit()
+    httpd = HTTPDaemon(
+        port=args.port, server=args.serve, max_connections=args.max_connections
+    )
+    httpd.start(directory=args.work_dir)
+    sys.stdin.read()
+    httpd.stop()
+
+
+class ServerStats:
+    """Peak threads and memory, and cpu time of server process from /proc."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.max_threads = 0
+        self.cpu0 = self.cpu()
+
+    def status(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            return dict(line.split(":", 1) for line in f if ":" in line)
+
+    def cpu(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def sample(self):
+        self.max_threads = max(self.max_threads, int(self.status()["Threads"]))
+
+    def peak_rss(self):
+        return int(self.status()["VmHWM"].split()[0]) * 1024
+
+    async def sample_every(self, interval=0.05):
+        while True:
+            self.sample()
+            await asyncio.sleep(interval)
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    version, status = lines[0].split()[:2]
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    await reader.readexactly(int(headers.get("content-length", 0)))
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.1":
+        keep_alive = connection != "close"
+    else:
+        keep_alive = connection == "keep-alive"
+    return int(status), keep_alive
+
+
+async def machine(source, port, path, nb_requests, go):
+    """nb_requests GET of path from source address, on one kept alive
+    connection as long as server allows it. Return latencies."""
+    await go.wait()
+    latencies = []
+    reader = writer = None
+    try:
+        for _ in range(nb_requests):
+            tic = time.time()
+            if writer is None:
+                reader, writer = await asyncio.open_connection(
+                    "127.0.0.1", port, local_addr=(source, 0)
+                )
+            request = f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n"
+            writer.write(request.encode())
+            status, keep_alive = await read_response(reader)
+            if status != 200:
+                raise Exception(f"status {status}")
+            latencies.append(time.time() - tic)
+            if not keep_alive:
+                writer.close()
+                writer = None
+    finally:
+        if writer:
+            writer.close()
+    return latencies
+
+
+async def wave(nb_clients, port, path, args, stats):
+    go = asyncio.Event()
+    clients = [
+        asyncio.ensure_future(
+            asyncio.wait_for(
+                machine(loopback_address(i), port, path, args.requests, go),
+                args.timeout,
+            )
+        )
+        for i in range(nb_clients)
+    ]
+    sampler = asyncio.ensure_future(stats.sample_every())
+    # all machines at once
+    tic = time.time()
+    go.set()
+    results = await asyncio.gather(*clients, return_exceptions=True)
+    duration = time.time() - tic
+    sampler.cancel()
+    return results, duration
+
+
+def wait_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise Exception(f"server not listening on port {port}")
+
+
+def bench(server, nb_clients, port, args):
+    """Run a wave of nb_clients machines against server ('asyncio' or
+    'threading') and return its measures."""
+    work_dir = tempfile.mkdtemp(prefix="httpd-bench-", dir=args.work_dir)
+    make_deployment(work_dir, nb_clients)
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "nixos_compose.tools.httpd_bench",
+            "--serve",
+            server,
+            "--port",
+            str(port),
+            "--max-connections",
+            str(args.max_connections),
+            "--work-dir",
+            work_dir,
+        ],
+        stdin=subprocess.PIPE,
+        # a line by request
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_port(port)
+        stats = ServerStats(process.pid)
+        kind = "deploy" if args.full else "node"
+        path = f"/{kind}/{COMPOSITION}.json"
+        results, duration = asyncio.get_event_loop().run_until_complete(
+            wave(nb_clients, port, path, args, stats)
+        )
+        cpu = stats.cpu() - stats.cpu0
+        peak_rss = stats.peak_rss()
+    finally:
+        process.stdin.close()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    latencies = [t for r in results if isinstance(r, list) for t in r]
+    errors = [r for r in results if not isinstance(r, list)]
+    latencies.sort()
+    return {
+        "server": server,
+        "clients": nb_clients,
+        "requests": args.requests,
+        "ok": not errors,
+        "errors": len(errors),
+        "duration": duration,
+        "requests_per_s": len(latencies) / duration,
+        "latency_median": statistics.median(latencies) if latencies else 0,
+        "latency_p99": latencies[int(len(latencies) * 0.99)] if latencies else 0,
+        "max_threads": stats.max_threads,
+        "peak_rss": peak_rss,
+        "cpu": cpu,
+    }
+
+
+ROW = "{:<10} {:>7} {:>6} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8} {:>7}"
+
+
+def print_row(row):
+    line = ROW.format(
+        row["server"],
+        row["clients"],
+        row["errors"],
+        f"{row['duration']:.2f}s",
+        f"{row['requests_per_s']:.0f}",
+        f"{row['latency_median'] * 1000:.1f}",
+        f"{row['latency_p99'] * 1000:.1f}",
+        row["max_threads"],
+        f"{row['peak_rss'] / 1e6:.1f}",
+        f"{row['cpu']:.2f}s",
+    )
+    if not row["ok"]:
+        line += "  FAILED"
+    print(line, flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="httpd_bench",
+        description="Benchmark HTTPDaemon servers against machines simulated on local host fetching their deployment at once",
+    )
+    parser.add_argument(
+        "--servers",
+        "-S",
+        dest="servers",
+        default="asyncio,threading",
+        help="comma separated list of servers (asyncio, threading), 'asyncio,threading' by default",
+    )
+    parser.add_argument(
+        "--clients",
+        "-n",
+        dest="clients",
+        default="1000,2000,5000",
+        help="comma separated list of numbers of machines, '1000,2000,5000' by default",
+    )
+    parser.add_argument(
+        "--requests",
+        "-r",
+        dest="requests",
+        default=1,
+        type=int,
+        help="number of requests of each machine (on a kept alive connection if server allows it)",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="machines fetch whole deployment file instead of their slice",
+    )
+    parser.add_argument(
+        "--max-connections",
+        dest="max_connections",
+        default=1024,
+        type=int,
+        help="connections served at once by asyncio server",
+    )
+    parser.add_argument(
+        "--port",
+        "-p",
+        dest="port",
+        default=8800,
+        type=int,
+        help="first port used, each run has its own one",
+    )
+    parser.add_argument(
+        "--timeout",
+        "-t",
+        dest="timeout",
+        default=60,
+        type=float,
+        help="time limit in seconds of each machine requests",
+    )
+    parser.add_argument("--json", dest="json", help="write results to this JSON file")
+    parser.add_argument(
+        "--work-dir",
+        dest="work_dir",
+        help="where to create temporary directories of deployment files",
+    )
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+
+    # main()
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        sys.exit(0)
+
+    nofile = raise_nofile_limit()
+    servers = args.servers.split(",")
+    nb_clients = [int(n) for n in args.clients.split(",")]
+    if max(nb_clients) + 64 > nofile:
+        parser.error(f"at most {nofile - 64} clients (open files limit)")
+
+    print(
+        ROW.format(
+            "server",
+            "clients",
+            "errors",
+            "time",
+            "req/s",
+            "median ms",
+            "p99 ms",
+            "threads",
+            "RSS MB",
+            "cpu",
+        )
+    )
+    rows = []
+    port = args.port
+    for n in nb_clients:
+        for server in servers:
+            row = bench(server, n, port, args)
+            # fresh port for each run, previous one may be in TIME_WAIT
+            port += 1
+            rows.append(row)
+            print_row(row)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+    sys.exit(0 if all(row["ok"] for row in rows) else 1)
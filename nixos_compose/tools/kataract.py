@@ -1,8 +1,26 @@
 #!/usr/bin/env python3
+import os
 import sys
+import json
+import time
+import shlex
+import select
+import socket
+import zlib
+import struct
+import hashlib
 import argparse
+import signal
+import shutil
+import tarfile
+import tempfile
+import subprocess
 import asyncio
+import ipaddress
+import threading
 from string import Template
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 CMD_BASE = Template(
     r'echo "s=\$$(mktemp); echo \\"$inner_cmd\\" > \$$s; nohup bash \$$s > /dev/null 2> /dev/null < /dev/null &" | $ssh $host "bash -s"'
@@ -16,33 +34,233 @@ CMD_TEE = Template(
     "until nc -z $host $port3; do sleep 0.01; done; nc -l $port0 | tee >(cat > /dev/tcp/$host/$port2) | base64 -d > $file_output & nc -l $port1"
 )
 
+# Python engine: each receiver runs this script (sent on the stdin of the remote
+# python) as a relay. A relay pulls raw bytes from its upstream peer, writes them
+# to disk and serves its own children from the written file with os.sendfile.
+# The first relay pulls from a seed launched on the local host, which may
+# compress chunks, relays then forward them compressed.
+CMD_SEED = Template("$python $script $args")
+CMD_RELAY = Template("$ssh $host $remote_cmd < $script")
+
+# several files sent as one tar stream through a single ssh session per host
+CMD_TAR = Template("set -o pipefail; $tar | $ssh $host $remote_cmd")
+
 # B  = cmd_base.substitute({'inner_cmd' : 'until nc -z localhost 5556; do sleep 0.01; done; nc -l 4444 | tee >(cat > /dev/tcp/127.0.0.1/5555) | base64 -d > /tmp/yopB & nc -l 4446'})
 
 # A = 'until nc -z localhost 4446; do sleep 0.01; done; base64 /tmp/vm-state-client1/client1.qcow2  >/dev/tcp/127.0.0.1/4444'
 
 
 def elog(msg, *args):
-    print("\033[91mError:\033[0m", *args, file=sys.stderr)
+    print("\033[91mError:\033[0m", msg, *args, file=sys.stderr)
 
 
 def vlog(msg, *args):
-    print(*args)
+    print(msg, *args)
+
+
+class Task(str):
+    """Command of a task, tagged with the host it targets and the number of
+    bytes it is expected to transfer."""
+
+    def __new__(cls, cmd, host=None, nbytes=0):
+        task = super().__new__(cls, cmd)
+        task.host = host
+        task.nbytes = nbytes
+        return task
+
+
+class TaskResult:
+    """Outcome of a task: return code (None on timeout), outputs, duration of
+    the last attempt, number of attempts, bytes transferred and bytes actually
+    sent on the wire (less when compressed)."""
+
+    def __init__(self, task, rc, stdout, stderr, duration, attempts):
+        self.host = getattr(task, "host", None)
+        self.cmd = str(task)
+        self.rc = rc
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.attempts = attempts
+        self.bytes = 0
+        self.wire_bytes = 0
+        self.report = {}
+        if rc == 0:
+            self.bytes = getattr(task, "nbytes", 0)
+            self.report = parse_report(stdout)
+            if "bytes" in self.report:
+                self.bytes = self.report["bytes"]
+            self.wire_bytes = self.report.get("wire_bytes", self.bytes)
+
+    @property
+    def ok(self):
+        return self.rc == 0
+
+    @property
+    def rate(self):
+        return self.bytes / self.duration if self.duration else 0
+
+    def as_dict(self):
+        result = {
+            "host": self.host,
+            "rc": self.rc,
+            "duration": self.duration,
+            "bytes": self.bytes,
+            "wire_bytes": self.wire_bytes,
+            "rate": self.rate,
+            "attempts": self.attempts,
+        }
+        # how a relay got the file
+        for key in ("codec", "upstream", "resumed", "dead", "lost"):
+            if key in self.report:
+                result[key] = self.report[key]
+        return result
+
+    def __repr__(self):
+        return (
+            f"<TaskResult {self.host} rc={self.rc} {self.duration:.2f}s {self.bytes}B>"
+        )
+
 
+def parse_report(stdout):
+    """JSON report printed on last line by seed and relay modes, if any."""
+    lines = stdout.decode(errors="ignore").strip().splitlines()
+    if lines:
+        try:
+            report = json.loads(lines[-1])
+            if isinstance(report, dict):
+                return report
+        except ValueError:
+            pass
+    return {}
 
-async def run(cmd):
+
+async def run(cmd, timeout=None, progress=None):
+    """Run cmd, progress lines of its stderr are given to progress callback."""
+    # own session so that a timed out task is killed with its children (ssh...)
     proc = await asyncio.create_subprocess_shell(
         cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
         executable="/bin/bash",
+        start_new_session=True,
+        limit=1 << 20,
     )
+    stderr_lines = []
 
-    stdout, stderr = await proc.communicate()
+    async def read_stderr():
+        async for line in proc.stderr:
+            if line.startswith(PROGRESS.encode()):
+                if progress:
+                    progress(int(line.split()[1]))
+            else:
+                stderr_lines.append(line)
 
-    return (proc.returncode, stdout, stderr)
+    async def communicate():
+        stdout, _ = await asyncio.gather(proc.stdout.read(), read_stderr())
+        await proc.wait()
+        return stdout
 
+    def kill_session():
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
 
-def generate_pipe_tasks(
+    try:
+        stdout = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        kill_session()
+        stdout, stderr = await proc.communicate()
+        stderr_lines += [stderr, b"kataract: task timed out\n"]
+        return (None, stdout, b"".join(stderr_lines))
+    except BaseException:
+        # cancelled or interrupted: out of reach of Ctrl-C in its own session,
+        # task would be left running
+        kill_session()
+        await proc.wait()
+        raise
+
+    return (proc.returncode, stdout, b"".join(stderr_lines))
+
+
+async def run_task(task, semaphore, timeout=None, retries=0, progress=None):
+    def task_progress(nbytes):
+        progress(task, nbytes)
+
+    attempts = 0
+    while True:
+        attempts += 1
+        async with semaphore:
+            t0 = time.time()
+            rc, stdout, stderr = await run(
+                task, timeout, task_progress if progress else None
+            )
+            duration = time.time() - t0
+        if rc == 0 or attempts > retries:
+            result = TaskResult(task, rc, stdout, stderr, duration, attempts)
+            if progress and result.ok:
+                progress(task, result.bytes)
+            return result
+
+
+class Progress:
+    """Bytes received by each host during a broadcast of nbytes, with their
+    recent rate (bytes/s over the last window seconds)."""
+
+    def __init__(self, hosts, nbytes, window=2):
+        self.t0 = time.time()
+        self.nbytes = nbytes
+        self.window = window
+        self.history = {h: [(self.t0, 0)] for h in hosts}
+
+    def update(self, host, nbytes):
+        if host not in self.history:
+            return
+        now = time.time()
+        history = self.history[host]
+        history.append((now, nbytes))
+        # keep one point older than window to compute rate over it
+        while len(history) > 2 and now - history[1][0] > self.window:
+            history.pop(0)
+
+    def received(self, host):
+        return self.history[host][-1][1]
+
+    def rate(self, host):
+        t_first, b_first = self.history[host][0]
+        t_last, b_last = self.history[host][-1]
+        if b_last >= self.nbytes or time.time() - t_last > self.window:
+            return 0
+        return (b_last - b_first) / max(t_last - t_first, 1e-6)
+
+    @property
+    def total(self):
+        return sum(self.received(h) for h in self.history)
+
+    def running(self):
+        return [h for h in self.history if self.received(h) < self.nbytes]
+
+    def slowest(self):
+        running = self.running()
+        return min(running, key=self.rate) if running else None
+
+    def text(self, label=""):
+        mb = 1e6
+        total = self.total
+        done = len(self.history) - len(self.running())
+        elapsed = max(time.time() - self.t0, 1e-6)
+        text = f"{label}{done}/{len(self.history)} hosts"
+        text += f", {total / mb:.0f}/{self.nbytes * len(self.history) / mb:.0f} MB"
+        text += f", {sum(self.rate(h) for h in self.history) / mb:.1f} MB/s"
+        text += f" (avg {total / elapsed / mb:.1f} MB/s)"
+        slowest = self.slowest()
+        if slowest is not None and len(self.history) > 1:
+            text += f", slowest: {slowest} {self.rate(slowest) / mb:.1f} MB/s"
+        return text
+
+
+def generate_bash_pipe_tasks(
     hosts, file_input, file_output, port0="5555", port1="5556", ssh="ssh"
 ):
     hosts_rev = hosts.copy()
@@ -62,7 +280,7 @@ def generate_pipe_tasks(
         )
         return CMD_BASE.substitute({"inner_cmd": cmd_tee, "ssh": ssh, "host": h})
 
-    tees = [cmd_tee(h, hosts_rev[i]) for i, h in enumerate(hosts_rev[1:])]
+    tees = [Task(cmd_tee(h, hosts_rev[i]), h) for i, h in enumerate(hosts_rev[1:])]
 
     cmd_end = CMD_END.substitute(
         {"port1": port1, "port0": port0, "file_output": file_output}
@@ -73,7 +291,7 @@ def generate_pipe_tasks(
         {"host": hosts[0], "port1": port1, "port0": port0, "file_input": file_input}
     )
 
-    tasks_cmd = [end] + tees + [start]
+    tasks_cmd = [Task(end, hosts_rev[0])] + tees + [Task(start, "seed")]
 
     # for c in tasks_cmd:
     #    print(c)
@@ -82,33 +300,1047 @@ def generate_pipe_tasks(
     return tasks_cmd
 
 
-def generate_scp_tasks(hosts, file_input, file_output, scp="scp", user=""):
+CHUNK_SIZE = 4 << 20
+BLOCK_SIZE = 1 << 20
+TOPOLOGIES = ["chain", "tree", "rack"]
+# name of the archive broadcast in output directory when sending several files
+BUNDLE_NAME = "kataract-bundle.tar"
+# stderr line of relays giving the number of bytes received so far
+PROGRESS = "kataract-progress"
+PROGRESS_INTERVAL = 0.5
+# frame header: chunk index, length of chunk on the wire, crc32 of chunk
+FRAME = struct.Struct("!III")
+# index of the empty frames sent to children waiting for a chunk, so that they
+# can tell a live upstream waiting on its own upstream from a dead one
+HEARTBEAT = 0xFFFFFFFF
+
+# zstd needs python zstandard module on every host, auto only considers zlib
+CODECS = ["none", "zlib", "zstd"]
+COMPRESSIONS = ["auto"] + CODECS
+ZLIB_LEVEL = 1
+# bytes/s assumed when link speed cannot be read (1 GbE)
+DEFAULT_BANDWIDTH = 125_000_000
+# compression must speed up transfer by this factor to be worth it
+COMPRESSION_GAIN = 1.2
+
+
+class ChunkError(Exception):
+    """Raised when a received chunk is not the expected one or is corrupted."""
+
+
+class StaleStateError(Exception):
+    """Raised when chunks kept from a previous transfer belong to another file."""
+
+
+def _codec(name, level=None):
+    """Return compress and decompress functions of codec name."""
+    if name == "none":
+        return None, None
+    if name == "zlib":
+        level = ZLIB_LEVEL if level is None else level
+        return (lambda data: zlib.compress(data, level)), zlib.decompress
+    if name == "zstd":
+        import zstandard
+
+        level = 3 if level is None else level
+        return (
+            lambda data: zstandard.ZstdCompressor(level=level).compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data),
+        )
+    raise ValueError(f"unknown codec: {name}")
+
+
+class Stream:
+    """File being broadcast, split in chunks of chunk_size bytes. Tracks the
+    chunks already written and verified as (crc, offset, length) of their wire
+    form, shared between the thread pulling from upstream and the ones serving
+    children. Children are served from fd, or from spool_fd which holds the
+    compressed chunks when the stream is compressed.
+
+    Children are known by id. A child may be adopted from a dead relay, and a
+    child without connection for more than twice stall_timeout is considered
+    lost: children of a dead relay detect it within stall_timeout and come
+    over in the meantime.
+    """
+
+    def __init__(
+        self,
+        path,
+        size=None,
+        chunk_size=CHUNK_SIZE,
+        digest=None,
+        chunks=None,
+        codec="none",
+        stall_timeout=30,
+    ):
+        self.path = path
+        self.size = size
+        self.chunk_size = chunk_size
+        self.digest = digest
+        self.chunks = chunks if chunks is not None else []
+        self.codec = codec
+        self.fd = None
+        self.spool_fd = None
+        self.stall_timeout = stall_timeout
+        # last time something was received from upstream
+        self.progress = time.time()
+        # last time progress was reported on stderr
+        self.reported = 0
+        self.failed = False
+        self.children = {}
+        self.cond = threading.Condition()
+
+    @property
+    def header(self):
+        return f"{self.size} {self.chunk_size} {self.digest} {self.codec}"
+
+    @property
+    def nb_chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    @property
+    def wire_fd(self):
+        return self.fd if self.codec == "none" else self.spool_fd
+
+    @property
+    def wire_bytes(self):
+        return sum(length for _, _, length in self.chunks)
+
+    @property
+    def received(self):
+        return min(len(self.chunks) * self.chunk_size, self.size)
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def report_progress(self, force=False):
+        now = time.time()
+        if force or now - self.reported >= PROGRESS_INTERVAL:
+            self.reported = now
+            print(f"{PROGRESS} {self.received}", file=sys.stderr, flush=True)
+
+    def set_header(self, header):
+        size, chunk_size, digest, codec = header.split()
+        with self.cond:
+            self.size, self.chunk_size = int(size), int(chunk_size)
+            self.digest, self.codec = digest, codec
+            self.cond.notify_all()
+
+    def add_chunk(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def fail(self):
+        with self.cond:
+            self.failed = True
+            self.cond.notify_all()
+
+    def expect_children(self, children):
+        now = time.time()
+        with self.cond:
+            for child in children:
+                self.children[child] = {"done": False, "connections": 0, "seen": now}
+
+    def child_connected(self, child, skipped):
+        # relays skipped by the child are dead, they will not come
+        with self.cond:
+            for relay in skipped:
+                self.children.pop(relay, None)
+            state = self.children.setdefault(
+                child, {"done": False, "connections": 0, "seen": time.time()}
+            )
+            state["connections"] += 1
+            self.cond.notify_all()
+
+    def child_disconnected(self, child, done):
+        with self.cond:
+            state = self.children.get(child)
+            if state:
+                state["connections"] -= 1
+                state["seen"] = time.time()
+                state["done"] = state["done"] or done
+                self.cond.notify_all()
+
+    def lost_children(self):
+        now = time.time()
+        return [
+            child
+            for child, state in self.children.items()
+            if not (state["done"] or state["connections"])
+            and now - state["seen"] > 2 * self.stall_timeout
+        ]
+
+    def wait_children(self, timeout):
+        """Wait until each child is done or lost, return the lost ones."""
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                if self.failed:
+                    raise ChunkError("stream failed")
+                pending = [c for c, s in self.children.items() if not s["done"]]
+                lost = self.lost_children()
+                if len(lost) == len(pending):
+                    return lost
+                if time.time() > deadline:
+                    raise TimeoutError(f"{len(pending)} children not served")
+                self.cond.wait(min(1, max(0, deadline - time.time())))
+
+
+def file_checksums(path, chunk_size=CHUNK_SIZE):
+    """Return sha256 digest of the file and crc32 of each of its chunks."""
+    sha = hashlib.sha256()
+    crcs = []
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk and crcs:
+                break
+            sha.update(chunk)
+            crcs.append(zlib.crc32(chunk))
+            if len(chunk) < chunk_size:
+                break
+    return sha.hexdigest(), crcs
+
+
+def link_bandwidth(host):
+    """Speed in bytes/s of the local network interface used to reach host,
+    None when it cannot be read (e.g. loopback or virtual interface)."""
+    try:
+        route = subprocess.run(
+            ["ip", "route", "get", socket.gethostbyname(host)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout.split()
+        with open(f"/sys/class/net/{route[route.index('dev') + 1]}/speed") as f:
+            speed = int(f.read())
+    except (OSError, ValueError, IndexError):
+        return None
+    # speed is in Mb/s, -1 when unknown
+    return speed * 125_000 if speed > 0 else None
+
+
+def compression_profile(path, codec="zlib", level=None, samples=3):
+    """Measure on a few chunks spread over path the compression ratio and the
+    compression and decompression speeds (bytes/s on one thread) of codec."""
+    compress, decompress = _codec(codec, level)
+    size = os.path.getsize(path)
+    raw = wire = 0
+    compress_time = decompress_time = 0.0
+    with open(path, "rb") as f:
+        for i in range(samples):
+            f.seek(size * i // samples)
+            data = f.read(CHUNK_SIZE)
+            t0 = time.perf_counter()
+            compressed = compress(data)
+            t1 = time.perf_counter()
+            decompress(compressed)
+            t2 = time.perf_counter()
+            raw += len(data)
+            wire += len(compressed)
+            compress_time += t1 - t0
+            decompress_time += t2 - t1
+    if not raw:
+        return 1.0, float("inf"), float("inf")
+    return wire / raw, raw / max(compress_time, 1e-9), raw / max(decompress_time, 1e-9)
+
+
+def choose_codec(
+    path, host=None, bandwidth=None, threads=None, codec="zlib", level=None
+):
+    """Return codec when it makes the transfer of path faster, 'none' otherwise.
+
+    A raw transfer runs at link bandwidth (bytes/s, speed of the interface
+    reaching host by default). A compressed one is bounded by compression on
+    threads cores, link bandwidth divided by compression ratio and
+    decompression on receivers.
+    """
+    if bandwidth is None:
+        bandwidth = (host and link_bandwidth(host)) or DEFAULT_BANDWIDTH
+    threads = threads or os.cpu_count() or 1
+    ratio, compress_speed, decompress_speed = compression_profile(path, codec, level)
+    rate = min(compress_speed * threads, bandwidth / ratio, decompress_speed)
+    return codec if rate > COMPRESSION_GAIN * bandwidth else "none"
+
+
+def _state_path(file_output):
+    return f"{file_output}.kat"
+
+
+def _spool_path(file_output):
+    return f"{file_output}.katz"
+
+
+def _load_state(file_output):
+    """Header and chunks of the good chunks of a previous interrupted transfer.
+    Chunks end at the first malformed line (torn write of an interrupted
+    relay), a malformed header discards the state."""
+    try:
+        with open(_state_path(file_output)) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None, []
+    if not lines or len(lines[0].split()) != 4:
+        return None, []
+    chunks = []
+    for line in lines[1:]:
+        try:
+            chunk = tuple(int(x) for x in line.split())
+        except ValueError:
+            break
+        if len(chunk) != 3:
+            break
+        chunks.append(chunk)
+    return lines[0], chunks
+
+
+def _recv_line(sock):
+    line = b""
+    while not line.endswith(b"\n"):
+        c = sock.recv(1)
+        if not c:
+            raise ConnectionError("connection closed by peer")
+        line += c
+    return line.decode().rstrip("\n")
+
+
+def _recv_exactly(sock, view):
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("connection closed by upstream")
+        received += n
+
+
+def _pwrite(fd, data, offset):
+    data = memoryview(data)
+    written = 0
+    while written < len(data):
+        written += os.pwrite(fd, data[written:], offset + written)
+
+
+def _listen(port):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("", int(port)))
+    server.listen(128)
+    return server
+
+
+def _connect(address, timeout, wait_listen=True):
+    # like the 'until nc -z' of bash engine, upstream may not listen yet
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return socket.create_connection(address)
+        except OSError as e:
+            refused = isinstance(e, ConnectionRefusedError)
+            if time.time() > deadline or (refused and not wait_listen):
+                raise
+            time.sleep(0.01)
+
+
+def _sendfile(sock, fd, offset, count):
+    # a socket with a timeout is non-blocking, wait for it to be writable
+    poller = select.poll()
+    poller.register(sock, select.POLLOUT)
+    timeout = sock.gettimeout()
+    sent = 0
+    while sent < count:
+        try:
+            n = os.sendfile(sock.fileno(), fd, offset + sent, count - sent)
+        except BlockingIOError:
+            if not poller.poll(None if timeout is None else timeout * 1000):
+                raise socket.timeout("send timed out")
+            continue
+        if n == 0:
+            raise ConnectionError("connection closed by peer")
+        sent += n
+    return sent
+
+
+def _serve_child(conn, stream):
+    # request: GET <first chunk> <child id> [<dead relays skipped by child>]
+    request = _recv_line(conn).split()
+    index, child = int(request[1]), request[2]
+    skipped = request[3].split(",") if len(request) > 3 else []
+    heartbeat = stream.stall_timeout / 3
+    conn.settimeout(stream.stall_timeout)
+    stream.child_connected(child, skipped)
+    done = False
+    try:
+        with stream.cond:
+            # empty lines until header is known
+            while not stream.cond.wait_for(
+                lambda: stream.size is not None or stream.failed, timeout=heartbeat
+            ):
+                conn.sendall(b"\n")
+            if stream.failed:
+                return
+        conn.sendall(f"{stream.header}\n".encode())
+        while index < stream.nb_chunks:
+            with stream.cond:
+                ready = stream.cond.wait_for(
+                    lambda: len(stream.chunks) > index or stream.failed,
+                    timeout=heartbeat,
+                )
+                if stream.failed:
+                    return
+                if ready:
+                    crc, offset, length = stream.chunks[index]
+            if not ready:
+                conn.sendall(FRAME.pack(HEARTBEAT, 0, 0))
+                continue
+            conn.sendall(FRAME.pack(index, length, crc))
+            _sendfile(conn, stream.wire_fd, offset, length)
+            index += 1
+        done = _recv_line(conn) == "OK"
+    finally:
+        stream.child_disconnected(child, done)
+
+
+def _serve_child_quietly(conn, stream):
+    # a child losing its connection will come back asking for its next chunk
+    try:
+        with conn:
+            _serve_child(conn, stream)
+    except (OSError, ValueError, IndexError):
+        pass
+
+
+def _serve(server, stream):
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(
+            target=_serve_child_quietly, args=(conn, stream), daemon=True
+        ).start()
+
+
+def _compress_chunks(stream, compress, threads):
+    # chunks are compressed in parallel (zlib and zstd release the GIL) and
+    # appended in order to the spool, children are served as soon as each is
+    def compress_chunk(index):
+        offset = index * stream.chunk_size
+        data = os.pread(stream.fd, stream.chunk_length(index), offset)
+        return zlib.crc32(data), compress(data)
+
+    # map would read and compress the whole file up front, only a window of
+    # chunks is in flight instead
+    window = 2 * threads
+    pending = deque()
+    offset = 0
+
+    def append_chunk():
+        nonlocal offset
+        crc, data = pending.popleft().result()
+        _pwrite(stream.spool_fd, data, offset)
+        stream.add_chunk((crc, offset, len(data)))
+        offset += len(data)
+
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            for index in range(stream.nb_chunks):
+                if len(pending) == window:
+                    append_chunk()
+                pending.append(pool.submit(compress_chunk, index))
+            while pending:
+                append_chunk()
+    except Exception:
+        stream.fail()
+        raise
+
+
+def _max_wire_length(chunk_size):
+    # compressed form of incompressible data is slightly bigger than the data
+    return chunk_size + (chunk_size >> 6) + 1024
+
+
+def _pull(sock, stream, fd, sha, state, node, skipped):
+    sock.settimeout(stream.stall_timeout)
+    request = f"GET {len(stream.chunks)} {node}"
+    if skipped:
+        request += " " + ",".join(skipped)
+    sock.sendall(f"{request}\n".encode())
+    header = ""
+    while not header:
+        header = _recv_line(sock)
+        stream.progress = time.time()
+    if stream.size is None:
+        stream.set_header(header)
+        state.write(f"{header}\n")
+        state.flush()
+    elif header != stream.header:
+        raise StaleStateError(header)
+
+    decompress = _codec(stream.codec)[1]
+    frame = memoryview(bytearray(FRAME.size))
+    view = memoryview(bytearray(_max_wire_length(stream.chunk_size)))
+    while len(stream.chunks) < stream.nb_chunks:
+        index = len(stream.chunks)
+        _recv_exactly(sock, frame)
+        stream.progress = time.time()
+        frame_index, length, crc = FRAME.unpack(frame)
+        if frame_index == HEARTBEAT:
+            continue
+        if frame_index != index:
+            raise ChunkError(f"unexpected chunk {frame_index} (expected {index})")
+        if length > len(view) or (
+            decompress is None and length != stream.chunk_length(index)
+        ):
+            raise ChunkError(f"bad length {length} for chunk {index}")
+        wire = view[:length]
+        _recv_exactly(sock, wire)
+        data = wire
+        if decompress:
+            try:
+                data = decompress(wire)
+            except Exception as e:
+                raise ChunkError(f"cannot decompress chunk {index}: {e}")
+        if len(data) != stream.chunk_length(index) or zlib.crc32(data) != crc:
+            raise ChunkError(f"bad checksum for chunk {index}")
+        _pwrite(fd, data, index * stream.chunk_size)
+        if decompress:
+            # compressed chunks are kept as received to be forwarded to children
+            offset = sum(stream.chunks[-1][1:]) if stream.chunks else 0
+            _pwrite(stream.spool_fd, wire, offset)
+        else:
+            offset = index * stream.chunk_size
+        sha.update(data)
+        state.write(f"{crc} {offset} {length}\n")
+        state.flush()
+        stream.add_chunk((crc, offset, length))
+        stream.report_progress()
+    sock.sendall(b"OK\n")
+
+
+def seed(
+    file_input,
+    port,
+    children=(),
+    timeout=600,
+    chunk_size=CHUNK_SIZE,
+    codec="none",
+    threads=None,
+    stall_timeout=30,
+):
+    """Serve file_input to the first relay(s) of the pipeline (children ids),
+    compressed by codec on threads cores (all by default) when it is not
+    'none'."""
+    t0 = time.time()
+    size = os.path.getsize(file_input)
+    if codec == "auto":
+        codec = choose_codec(file_input)
+    if codec == "none":
+        digest, crcs = file_checksums(file_input, chunk_size)
+        chunks = [
+            (crc, i * chunk_size, min(chunk_size, size - i * chunk_size))
+            for i, crc in enumerate(crcs)
+        ]
+        stream = Stream(file_input, size, chunk_size, digest, chunks)
+    else:
+        compress = _codec(codec)[0]
+        digest = file_sha256(file_input)
+        stream = Stream(file_input, size, chunk_size, digest, codec=codec)
+    stream.stall_timeout = stall_timeout
+    stream.expect_children(children)
+    stream.fd = os.open(file_input, os.O_RDONLY)
+    if codec != "none":
+        spool = tempfile.TemporaryFile()
+        stream.spool_fd = spool.fileno()
+        threading.Thread(
+            target=_compress_chunks,
+            args=(stream, compress, threads or os.cpu_count()),
+            daemon=True,
+        ).start()
+
+    server = _listen(port)
+    threading.Thread(target=_serve, args=(server, stream), daemon=True).start()
+    lost = stream.wait_children(timeout)
+    return {
+        "bytes": stream.size,
+        "wire_bytes": stream.wire_bytes,
+        "duration": time.time() - t0,
+        "sha256": stream.digest,
+        "codec": stream.codec,
+        "lost": lost,
+    }
+
+
+def relay(
+    upstreams,
+    port,
+    file_output,
+    children=(),
+    timeout=600,
+    stall_timeout=30,
+    unpack=None,
+    node=None,
+):
+    """Pull file from upstreams[0] into file_output while serving it to children
+    (ids of the relays fed by this one, node being its own id).
+
+    Chunks are verified as they arrive and recorded in file_output.kat. When
+    the connection breaks, stalls or delivers a bad chunk, transfer is resumed
+    from the last good chunk. When nothing, not even a heartbeat, comes from
+    upstream for stall_timeout, or when upstream refuses connection after it
+    was reached, it is deemed dead and the next one of upstreams (its
+    ancestors up to the seed) is used instead. A relay launched
+    again on an interrupted transfer resumes it the same way. Compressed
+    chunks are decompressed into file_output and kept in file_output.katz to
+    be forwarded as they are. When unpack is given, file_output is a bundle
+    extracted into this directory once complete and removed once children are
+    served.
+    """
+    t0 = time.time()
+    deadline = t0 + timeout
+    if node is None:
+        node = f"{socket.gethostname()}:{port}"
+
+    if unpack:
+        os.makedirs(unpack, exist_ok=True)
+    header, chunks = _load_state(file_output)
+    stream = Stream(file_output, chunks=chunks, stall_timeout=stall_timeout)
+    stream.expect_children(children)
+    if header:
+        stream.set_header(header)
+    stream.fd = fd = os.open(file_output, os.O_RDWR | os.O_CREAT, 0o644)
+    spool = _spool_path(file_output)
+    stream.spool_fd = os.open(spool, os.O_RDWR | os.O_CREAT, 0o644)
+    sha = hashlib.sha256()
+    # rebuild hash state of the chunks already there, up to the first one
+    # truncated or corrupted since it was recorded
+    for index, (crc, _, _) in enumerate(chunks):
+        data = os.pread(fd, stream.chunk_length(index), index * stream.chunk_size)
+        if len(data) != stream.chunk_length(index) or zlib.crc32(data) != crc:
+            del chunks[index:]
+            break
+        sha.update(data)
+    if not chunks:
+        os.ftruncate(fd, 0)
+        os.ftruncate(stream.spool_fd, 0)
+    state = open(_state_path(file_output), "w")
+    if header:
+        state.write(f"{header}\n")
+        state.writelines(f"{crc} {offset} {length}\n" for crc, offset, length in chunks)
+        state.flush()
+
+    server = _listen(port)
+    threading.Thread(target=_serve, args=(server, stream), daemon=True).start()
+    resumed = 0
+    skipped = []
+    upstream = upstreams[0]
+    # upstream already connected, its process is gone when it refuses
+    reached = False
+    try:
+        while True:
+            try:
+                address = split_host(upstream, port)
+                connect_timeout = min(stall_timeout, deadline - time.time())
+                with _connect(address, connect_timeout, not reached) as sock:
+                    reached = True
+                    _pull(sock, stream, fd, sha, state, node, skipped)
+                break
+            except StaleStateError as e:
+                # start again from scratch with upstream file
+                stream.chunks.clear()
+                stream.set_header(str(e))
+                os.ftruncate(fd, 0)
+                os.ftruncate(stream.spool_fd, 0)
+                state.seek(0)
+                state.truncate()
+                state.write(f"{e}\n")
+                sha = hashlib.sha256()
+            except (OSError, ChunkError) as e:
+                if time.time() > deadline:
+                    raise
+                resumed += 1
+                refused = reached and isinstance(e, ConnectionRefusedError)
+                if refused or time.time() - stream.progress > stall_timeout:
+                    skipped.append(upstream)
+                    if len(skipped) == len(upstreams):
+                        raise
+                    upstream = upstreams[len(skipped)]
+                    reached = False
+                    stream.progress = time.time()
+                    dead = skipped[-1]
+                    print(f"{dead} is dead, pull from {upstream}", file=sys.stderr)
+                print(f"resume from chunk {len(stream.chunks)}: {e}", file=sys.stderr)
+        if sha.hexdigest() != stream.digest:
+            raise ChunkError(f"sha256 mismatch on {file_output}")
+        pull_duration = time.time() - t0
+        state.close()
+        os.remove(_state_path(file_output))
+        if unpack:
+            unpack_bundle(file_output, unpack)
+
+        lost = stream.wait_children(deadline - time.time())
+    except Exception:
+        stream.fail()
+        raise
+    finally:
+        state.close()
+        os.close(fd)
+        os.close(stream.spool_fd)
+    os.remove(spool)
+    if unpack:
+        os.remove(file_output)
+    return {
+        "bytes": stream.size,
+        "wire_bytes": stream.wire_bytes,
+        "duration": time.time() - t0,
+        "pull_duration": pull_duration,
+        "sha256": stream.digest,
+        "codec": stream.codec,
+        "resumed": resumed,
+        "upstream": upstream,
+        "dead": skipped,
+        "lost": lost,
+    }
+
+
+def split_host(host, default_port):
+    """Split an optional ':port' suffix from a host name."""
+    if ":" in host:
+        name, port = host.rsplit(":", 1)
+        return name, int(port)
+    return host, int(default_port)
+
+
+def source_address(host):
+    """Return the local address used to reach host (it does not have to answer)."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect((host, 1))
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+
+def parse_topology(topology):
+    """Parse 'chain', 'tree[:k]' or 'rack[:k]' into (kind, fanout)."""
+    kind, _, fanout = topology.partition(":")
+    if kind not in TOPOLOGIES:
+        raise ValueError(f"unknown topology: {topology}")
+    return kind, int(fanout) if fanout else 2
+
+
+def rack_key(host):
+    """Group of a host: /24 network of an address or cluster name of a hostname
+    (e.g. dahu for dahu-12.grenoble.grid5000.fr)."""
+    try:
+        ip = ipaddress.ip_address(host)
+        return str(ipaddress.ip_network(f"{ip}/24", strict=False))
+    except ValueError:
+        return host.split(".")[0].rstrip("0123456789").rstrip("-")
+
+
+def _tree_parents(indexes, fanout, root_parent):
+    # k-ary tree laid out in breadth-first order, indexes[0] being the root
+    return {
+        index: root_parent if i == 0 else indexes[(i - 1) // fanout]
+        for i, index in enumerate(indexes)
+    }
+
+
+def build_topology(hosts, topology="chain"):
+    """Return the upstream index of each host, -1 means the seed.
+
+    chain: each host forwards to the next one (depth N).
+    tree:k: k-ary tree (depth log_k(N)), the seed only feeds the root.
+    rack:k: hosts grouped by rack_key, a k-ary tree in each group, group roots
+    are chained so that each inter-group link carries the file once.
+    """
+    kind, fanout = parse_topology(topology)
+    if kind == "chain":
+        return [i - 1 for i in range(len(hosts))]
+    if kind == "tree":
+        parents = _tree_parents(list(range(len(hosts))), fanout, -1)
+        return [parents[i] for i in range(len(hosts))]
+
+    groups = {}
+    for i, host in enumerate(hosts):
+        groups.setdefault(rack_key(host), []).append(i)
+    parents = {}
+    previous_root = -1
+    for indexes in groups.values():
+        parents.update(_tree_parents(indexes, fanout, previous_root))
+        previous_root = indexes[0]
+    return [parents[i] for i in range(len(hosts))]
+
+
+def generate_python_pipe_tasks(
+    hosts,
+    file_input,
+    file_output,
+    port="5555",
+    ssh="ssh",
+    python="python3",
+    source=None,
+    timeout=600,
+    topology="chain",
+    chunk_size=CHUNK_SIZE,
+    stall_timeout=30,
+    compression="none",
+    bandwidth=None,
+    unpack=None,
+):
+    script = os.path.realpath(__file__)
+    addresses = [split_host(h, port) for h in hosts]
+    if source is None:
+        source = source_address(addresses[0][0])
+    if compression == "auto":
+        compression = choose_codec(file_input, addresses[0][0], bandwidth)
+
+    parents = build_topology([a[0] for a in addresses], topology)
+    ids = ["{}:{}".format(*a) for a in addresses]
+
+    def children_args(i):
+        return [a for j, p in enumerate(parents) if p == i for a in ("-c", ids[j])]
+
+    def upstreams_args(i):
+        # ancestors up to the seed, successive fallbacks when upstream dies
+        args = []
+        while parents[i] != -1:
+            i = parents[i]
+            args += ["-u", ids[i]]
+        return args + ["-u", f"{source}:{port}"]
+
+    seed_args = ["--mode", "seed", "-i", file_input, "-p", port]
+    seed_args += children_args(-1) + ["--chunk-size", chunk_size]
+    seed_args += ["--timeout", timeout, "--compress", compression]
+    seed_args += ["--stall-timeout", stall_timeout]
+    seed = CMD_SEED.substitute(
+        {
+            "python": shlex.quote(sys.executable),
+            "script": shlex.quote(script),
+            "args": " ".join(shlex.quote(str(a)) for a in seed_args),
+        }
+    )
+    seed = Task(seed, "seed")
+
+    def cmd_relay(i):
+        host, relay_port = addresses[i]
+        relay_args = [python, "-", "--mode", "relay", "--id", ids[i]]
+        relay_args += upstreams_args(i) + ["-p", relay_port, "-o", file_output]
+        relay_args += children_args(i)
+        relay_args += ["--timeout", timeout, "--stall-timeout", stall_timeout]
+        if unpack:
+            relay_args += ["--unpack", unpack]
+        remote_cmd = " ".join(shlex.quote(str(a)) for a in relay_args)
+        cmd = CMD_RELAY.substitute(
+            {
+                "ssh": ssh,
+                "host": host,
+                "remote_cmd": shlex.quote(remote_cmd),
+                "script": shlex.quote(script),
+            }
+        )
+        return Task(cmd, hosts[i])
+
+    return [seed] + [cmd_relay(i) for i in range(len(addresses))]
+
+
+def generate_pipe_tasks(
+    hosts,
+    file_input,
+    file_output,
+    port0="5555",
+    port1="5556",
+    ssh="ssh",
+    engine="python",
+    topology="chain",
+    **kwargs,
+):
+    """Generate the commands of a pipeline broadcast, kwargs are python engine
+    options (see generate_python_pipe_tasks)."""
+    if engine == "bash":
+        if parse_topology(topology)[0] != "chain":
+            raise ValueError("bash engine only supports chain topology")
+        return generate_bash_pipe_tasks(
+            hosts, file_input, file_output, port0=port0, port1=port1, ssh=ssh
+        )
+    return generate_python_pipe_tasks(
+        hosts,
+        file_input,
+        file_output,
+        port=port0,
+        ssh=ssh,
+        topology=topology,
+        **kwargs,
+    )
+
+
+def ssh_compressed(cmd):
+    """ssh or scp command cmd with compression. A session multiplexed on a
+    master connection keeps its master's (lack of) compression, so it is not
+    multiplexed: first ControlPath option given wins for ssh."""
+    program, _, options = cmd.partition(" ")
+    if os.path.basename(program) in ("ssh", "scp"):
+        program += " -o ControlPath=none"
+    return f"{program} -C {options}".rstrip()
+
+
+def generate_scp_tasks(
+    hosts,
+    file_input,
+    file_output,
+    scp="scp",
+    user="",
+    compression="none",
+    bandwidth=None,
+):
     if user:
         user = f"{user}@"
-    tasks_cmd = [f"{scp} {file_input} {user}{h}:{file_output}" for h in hosts]
+    if compression == "auto":
+        # ssh compresses with zlib at its default level, concurrent scp share
+        # the link and cores of local host
+        compression = choose_codec(file_input, hosts[0], bandwidth, level=6)
+    if compression != "none":
+        scp = ssh_compressed(scp)
+    nbytes = os.path.getsize(file_input)
+    tasks_cmd = [
+        Task(f"{scp} {file_input} {user}{h}:{file_output}", h, nbytes) for h in hosts
+    ]
     # print(tasks_cmd)
     return tasks_cmd
 
 
-def exec_kataract_tasks(tasks_cmd, elog=elog, vlog=vlog):
+def make_bundle(files, bundle):
+    """Write files (symlinks followed) at the root of tar archive bundle."""
+    with tarfile.open(bundle, "w", dereference=True) as tar:
+        for f in files:
+            tar.add(f, arcname=os.path.basename(f))
+
+
+def unpack_bundle(bundle, directory):
+    """Extract regular files of bundle into directory, each one replacing
+    atomically any previous version."""
+    os.makedirs(directory, exist_ok=True)
+    with tarfile.open(bundle) as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            path = os.path.join(directory, os.path.basename(member.name))
+            with tar.extractfile(member) as src, open(f"{path}.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst, BLOCK_SIZE)
+            os.chmod(f"{path}.tmp", member.mode)
+            os.replace(f"{path}.tmp", path)
+
+
+def generate_tar_tasks(
+    hosts, files, directory, ssh="ssh", compression="none", bandwidth=None
+):
+    """Commands streaming files as one tar archive through a single ssh session
+    per host, extracted in directory."""
+    if compression == "auto":
+        largest = max(files, key=os.path.getsize)
+        compression = choose_codec(largest, hosts[0], bandwidth, level=6)
+    if compression != "none":
+        ssh = ssh_compressed(ssh)
+    tar = "tar -c -h -f -"
+    for f in files:
+        # -C options are relative to each other
+        tar += f" -C {shlex.quote(os.path.dirname(os.path.abspath(f)))}"
+        tar += f" {shlex.quote(os.path.basename(f))}"
+    directory = shlex.quote(directory)
+    remote_cmd = shlex.quote(f"mkdir -p {directory} && tar -x -f - -C {directory}")
+    nbytes = sum(os.path.getsize(f) for f in files)
+
+    def cmd_tar(host):
+        return CMD_TAR.substitute(
+            {"tar": tar, "ssh": ssh, "host": host, "remote_cmd": remote_cmd}
+        )
+
+    return [Task(cmd_tar(h), h, nbytes) for h in hosts]
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def generate_digest_tasks(hosts, files, ssh="ssh"):
+    """Commands printing sha256 of files present on each host. Missing files
+    are not an error (first deployment), unreachable hosts are."""
+    remote_cmd = "sha256sum " + " ".join(shlex.quote(f) for f in files)
+    remote_cmd += " 2>/dev/null || true"
+    return [Task(f"{ssh} {h} {shlex.quote(remote_cmd)}", h) for h in hosts]
+
+
+def parse_digests(stdout):
+    """Map path -> sha256 from sha256sum output."""
+    digests = {}
+    for line in stdout.decode().splitlines():
+        digest, _, path = line.partition("  ")
+        if path:
+            digests[path] = digest
+    return digests
+
+
+def failed_hosts(results):
+    """Receivers whose task failed, a failed seed means all of them did."""
+    if any(r.host == "seed" and not r.ok for r in results):
+        return [r.host for r in results if r.host != "seed"]
+    return [r.host for r in results if not r.ok]
+
+
+def exec_kataract_tasks(
+    tasks_cmd,
+    elog=elog,
+    vlog=vlog,
+    concurrency=None,
+    timeout=60,
+    retries=0,
+    progress=None,
+):
+    """Run tasks with at most concurrency of them at once (all if None), each
+    attempt limited to timeout seconds and retried up to retries times on
+    failure. Tasks of a pipeline depend on each other and must not be limited.
+    progress(task, nbytes) is called as relays report bytes received and when
+    a task succeeds. Return a TaskResult per task, in order.
+    """
     asyncio.set_event_loop(asyncio.new_event_loop())
     loop = asyncio.get_event_loop()
 
-    tasks = [run(task_cmd) for task_cmd in tasks_cmd]
+    semaphore = asyncio.Semaphore(concurrency or max(1, len(tasks_cmd)))
+    tasks = [
+        run_task(task_cmd, semaphore, timeout, retries, progress)
+        for task_cmd in tasks_cmd
+    ]
 
-    finished, unfinished = loop.run_until_complete(asyncio.wait(tasks, timeout=60))
+    t0 = time.time()
+    gathered = asyncio.gather(*tasks)
+    try:
+        results = loop.run_until_complete(gathered)
+    except BaseException:
+        # interrupted (KeyboardInterrupt...): running tasks are cancelled, which
+        # kills their sessions
+        gathered.cancel()
+        try:
+            loop.run_until_complete(gathered)
+        except BaseException:
+            pass
+        # let pipes of killed tasks be closed before the loop
+        loop.run_until_complete(asyncio.sleep(0.1))
+        raise
+    finally:
+        loop.close()
 
-    if len(unfinished) > 0:
-        elog("Failed")
-
-    vlog(f"unfinished: {len(unfinished)}")
-    vlog(f"finished: {len(finished)}")
+    failed = [r for r in results if not r.ok]
+    nb_bytes = sum(r.bytes for r in results)
+    vlog(
+        f"finished: {len(results) - len(failed)}/{len(results)} tasks, {nb_bytes} bytes in {time.time() - t0:.2f}s"
+    )
+    for r in failed:
+        elog(f"{r.host or r.cmd}: failed after {r.attempts} attempt(s), rc: {r.rc}")
+        vlog(f"{r.stderr.decode(errors='ignore').strip()}")
 
-    for task in finished:
-        r = task.result()
-        if r[0] != 0 or r[2]:
-            vlog(f"{r}")
-    loop.close()
+    return results
 
 
 if __name__ == "__main__":
@@ -117,14 +1349,17 @@ if __name__ == "__main__":
         description="File broadcaster based on TCP Pipeline. Pipeline is initiated by bash command sent through ssh connection",
     )
     parser.add_argument(
-        "--input", "-i", dest="file_input", required=True, help="input file to send"
+        "--input",
+        "-i",
+        dest="files_input",
+        action="append",
+        help="input file to send, several ones are sent as a bundle",
     )
     parser.add_argument(
         "--output",
         "-o",
         dest="file_output",
-        required=True,
-        help="output file to write on receiver hosts",
+        help="output file to write on receiver hosts (directory with several inputs)",
     )
     parser.add_argument(
         "--ssh",
@@ -134,7 +1369,10 @@ if __name__ == "__main__":
         help="ssh command to use to reach host, 'ssh' by default",
     )
     parser.add_argument(
-        "-m", dest="hosts", action="append", required=True, help="receiver hosts"
+        "-m",
+        dest="hosts",
+        action="append",
+        help="receiver hosts (host or host:port with python engine)",
     )
     parser.add_argument(
         "--port-data",
@@ -150,28 +1388,222 @@ if __name__ == "__main__":
         dest="port_ready",
         default=5556,
         type=int,
-        help="port to test if host is ready to receive.",
+        help="port to test if host is ready to receive (bash engine only).",
     )
     parser.add_argument(
         "--scp", "-S", dest="scp", action="store_true", help="use scp to send file."
     )
+    parser.add_argument(
+        "--engine",
+        "-e",
+        dest="engine",
+        choices=["python", "bash"],
+        default="python",
+        help="pipeline engine: raw bytes relayed by python (default) or base64 through nc",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        dest="chunk_size",
+        default=CHUNK_SIZE,
+        type=int,
+        help=f"size of checksummed chunks (python engine), {CHUNK_SIZE} by default",
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        dest="stall_timeout",
+        default=30,
+        type=float,
+        help="a receiver getting nothing, not even heartbeats, from upstream for this time deems it dead and resumes from the next ancestor",
+    )
+    parser.add_argument(
+        "--compress",
+        "-z",
+        dest="compression",
+        choices=COMPRESSIONS,
+        default="auto",
+        help="compress data on the wire (scp uses ssh compression for any codec): auto (default, when it is faster than link bandwidth allows), none, zlib or zstd (python zstandard required on all hosts)",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        dest="bandwidth",
+        default=None,
+        type=float,
+        help="link bandwidth in Mb/s used by auto compression, speed of the interface to first host by default",
+    )
+    parser.add_argument(
+        "--concurrency",
+        "-j",
+        dest="concurrency",
+        default=None,
+        type=int,
+        help="maximum number of scp running at once, all by default",
+    )
+    parser.add_argument(
+        "--task-timeout",
+        dest="task_timeout",
+        default=None,
+        type=float,
+        help="time limit in seconds of each task attempt, --timeout by default",
+    )
+    parser.add_argument(
+        "--retries",
+        dest="retries",
+        default=0,
+        type=int,
+        help="number of retries of a failed task (a retried relay resumes its transfer)",
+    )
+    parser.add_argument(
+        "--topology",
+        "-T",
+        dest="topology",
+        default="chain",
+        help="broadcast topology (python engine): chain (default), tree[:k] (k-ary tree, k=2 by default) or rack[:k] (k-ary tree by rack/cluster, racks chained)",
+    )
+    parser.add_argument(
+        "--python",
+        dest="python",
+        default="python3",
+        help="python interpreter on receiver hosts, 'python3' by default",
+    )
+    parser.add_argument(
+        "--timeout",
+        "-t",
+        dest="timeout",
+        default=600,
+        type=float,
+        help="time limit in seconds for seed/relay operations",
+    )
+    # internal options used by python engine on each side of the pipeline
+    parser.add_argument(
+        "--mode",
+        dest="mode",
+        choices=["broadcast", "seed", "relay"],
+        default="broadcast",
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument(
+        "--upstream",
+        "-u",
+        dest="upstreams",
+        action="append",
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument("--id", dest="node", help=argparse.SUPPRESS)
+    parser.add_argument("--unpack", dest="unpack", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--child",
+        "-c",
+        dest="children",
+        action="append",
+        default=[],
+        help=argparse.SUPPRESS,
+    )
 
     # main()
     args = parser.parse_args()
 
-    # if not args.file_input()
+    if args.mode == "seed":
+        result = seed(
+            args.files_input[0],
+            args.port_data,
+            args.children,
+            args.timeout,
+            args.chunk_size,
+            args.compression,
+            stall_timeout=args.stall_timeout,
+        )
+        print(json.dumps(result))
+        sys.exit(0)
+
+    if args.mode == "relay":
+        result = relay(
+            args.upstreams,
+            args.port_data,
+            args.file_output,
+            args.children,
+            args.timeout,
+            args.stall_timeout,
+            args.unpack,
+            args.node,
+        )
+        print(json.dumps(result))
+        sys.exit(0)
+
+    if not (args.files_input and args.file_output and args.hosts):
+        parser.error("--input, --output and -m are required")
+
+    try:
+        parse_topology(args.topology)
+    except ValueError as e:
+        parser.error(str(e))
+    bandwidth = args.bandwidth * 125_000 if args.bandwidth else None
+    bundle = len(args.files_input) > 1
+    if bundle and not args.scp and args.engine == "bash":
+        parser.error("bash engine sends a single file")
+
+    file_input = args.files_input[0]
+    file_output = args.file_output
+    unpack = None
+    if bundle and not args.scp:
+        fd, file_input = tempfile.mkstemp(suffix=".tar")
+        os.close(fd)
+        make_bundle(args.files_input, file_input)
+        file_output = os.path.join(args.file_output, BUNDLE_NAME)
+        unpack = args.file_output
+
     if not args.scp:
         tasks_cmd = generate_pipe_tasks(
             args.hosts,
-            args.file_input,
-            args.file_output,
+            file_input,
+            file_output,
             port0=args.port_data,
             port1=args.port_ready,
             ssh=args.ssh,
+            engine=args.engine,
+            topology=args.topology,
+            python=args.python,
+            timeout=args.timeout,
+            chunk_size=args.chunk_size,
+            stall_timeout=args.stall_timeout,
+            compression=args.compression,
+            bandwidth=bandwidth,
+            unpack=unpack,
         )
+        # tasks of a pipeline wait for each other, they cannot be throttled
+        concurrency = None
+    elif bundle:
+        tasks_cmd = generate_tar_tasks(
+            args.hosts,
+            args.files_input,
+            args.file_output,
+            ssh=args.ssh,
+            compression=args.compression,
+            bandwidth=bandwidth,
+        )
+        concurrency = args.concurrency
     else:
         tasks_cmd = generate_scp_tasks(
-            args.hosts, args.file_input, args.file_output, scp="scp"
+            args.hosts,
+            file_input,
+            file_output,
+            scp="scp",
+            compression=args.compression,
+            bandwidth=bandwidth,
         )
+        concurrency = args.concurrency
 
-    exec_kataract_tasks(tasks_cmd)
+    try:
+        results = exec_kataract_tasks(
+            tasks_cmd,
+            concurrency=concurrency,
+            timeout=args.task_timeout or args.timeout,
+            retries=args.retries,
+        )
+    finally:
+        if unpack:
+            os.remove(file_input)
+    dead = failed_hosts(results)
+    if dead:
+        elog(f"dead hosts: {' '.join(dead)}")
+    print(json.dumps([r.as_dict() for r in results], indent=2))
+    sys.exit(0 if all(r.ok for r in results) else 1)
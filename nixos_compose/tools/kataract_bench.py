@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# Local benchmark of kataract broadcasts: receivers are simulated on this host
+# by distinct loopback addresses (127.0.0.0/8) listening on distinct ports,
+# reached through "ssh" and "scp" shims running commands in one directory per
+# host. No reservation nor sshd needed. Run from repository root:
+#   python -m nixos_compose.tools.kataract_bench -n 10,50 -s 256M
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import statistics
+import tempfile
+
+from nixos_compose.tools import kataract
+
+FAKE_SSH = """#!/usr/bin/env bash
+host=$1; shift
+mkdir -p {hosts_dir}/$host && cd {hosts_dir}/$host && exec bash -c "$*"
+"""
+
+# scp options (e.g. -C) are ignored, file is streamed through the ssh shim
+FAKE_SCP = """#!/usr/bin/env bash
+args=()
+for a in "$@"; do [[ $a == -* ]] || args+=("$a"); done
+dst=${{args[1]}}
+exec {fake_ssh} "${{dst%%:*}}" "cat > ${{dst#*:}}" < "${{args[0]}}"
+"""
+
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+def parse_size(size):
+    if size[-1].upper() in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1].upper()])
+    return int(size)
+
+
+def loopback_address(i):
+    # 127.0.0.1 is the seed
+    i += 2
+    return f"127.0.{i >> 8}.{i & 255}"
+
+
+def make_shims(work_dir):
+    hosts_dir = os.path.join(work_dir, "hosts")
+    fake_ssh = os.path.join(work_dir, "fake-ssh")
+    fake_scp = os.path.join(work_dir, "fake-scp")
+    with open(fake_ssh, "w") as f:
+        f.write(FAKE_SSH.format(hosts_dir=hosts_dir))
+    with open(fake_scp, "w") as f:
+        f.write(FAKE_SCP.format(fake_ssh=fake_ssh))
+    for shim in (fake_ssh, fake_scp):
+        os.chmod(shim, 0o755)
+    return hosts_dir, fake_ssh, fake_scp
+
+
+def make_input(path, size, compressible=False):
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            n = min(kataract.BLOCK_SIZE, size - written)
+            if compressible:
+                line = f"{written} kataract benchmark line\n".encode()
+                block = (line * (n // len(line) + 1))[:n]
+            else:
+                block = os.urandom(n)
+            f.write(block)
+            written += n
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def bench(mode, nb_hosts, file_input, work_dir, port, shims, args):
+    """Broadcast file_input to nb_hosts simulated hosts with mode (a topology
+    of python engine or 'scp') and return its measures."""
+    hosts_dir, fake_ssh, fake_scp = shims
+    shutil.rmtree(hosts_dir, ignore_errors=True)
+    size = os.path.getsize(file_input)
+
+    if mode == "scp":
+        hosts = [loopback_address(i) for i in range(nb_hosts)]
+        tasks_cmd = kataract.generate_scp_tasks(
+            hosts, file_input, "output.bin", scp=fake_scp, compression=args.compression
+        )
+        concurrency = args.concurrency
+    else:
+        hosts = [f"{loopback_address(i)}:{port + 1 + i}" for i in range(nb_hosts)]
+        # bash engine cannot be simulated: all its hosts listen on same ports
+        tasks_cmd = kataract.generate_pipe_tasks(
+            hosts,
+            file_input,
+            "output.bin",
+            port0=port,
+            ssh=fake_ssh,
+            topology=mode,
+            source="127.0.0.1",
+            timeout=args.timeout,
+            compression=args.compression,
+        )
+        concurrency = None
+
+    cpu0 = children_cpu()
+    t0 = time.time()
+    results = kataract.exec_kataract_tasks(
+        tasks_cmd,
+        elog=kataract.elog,
+        vlog=lambda msg: None,
+        concurrency=concurrency,
+        timeout=args.timeout,
+    )
+    duration = time.time() - t0
+    cpu = children_cpu() - cpu0
+
+    receivers = [r for r in results if r.host != "seed"]
+    hops = []
+    for r in receivers:
+        report = kataract.parse_report(r.stdout)
+        hop_duration = report.get("pull_duration", r.duration)
+        if r.ok and hop_duration > 0:
+            hops.append(size / hop_duration)
+    ok = all(r.ok for r in results) and len(hops) == nb_hosts
+    return {
+        "mode": mode,
+        "hosts": nb_hosts,
+        "size": size,
+        "ok": ok,
+        "duration": duration,
+        "throughput": size * nb_hosts / duration,
+        "hop_throughput_median": statistics.median(hops) if hops else 0,
+        "hop_throughput_min": min(hops) if hops else 0,
+        "wire_bytes": sum(r.wire_bytes for r in receivers),
+        "cpu": cpu,
+        "cpu_per_gb": cpu / (size * nb_hosts / 1e9),
+    }
+
+
+ROW = "{:<10} {:>5} {:>10} {:>9} {:>9} {:>9} {:>9} {:>8} {:>8}"
+
+
+def print_row(row, baseline=None):
+    line = ROW.format(
+        row["mode"],
+        row["hosts"],
+        row["size"],
+        f"{row['duration']:.2f}s",
+        f"{row['throughput'] / 1e6:.1f}",
+        f"{row['hop_throughput_median'] / 1e6:.1f}",
+        f"{row['hop_throughput_min'] / 1e6:.1f}",
+        f"{row['cpu']:.2f}s",
+        f"{row['cpu_per_gb']:.2f}",
+    )
+    if not row["ok"]:
+        line += "  FAILED"
+    if baseline:
+        line += f"  x{row['duration'] / baseline['duration']:.2f} vs baseline"
+    print(line, flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="kataract_bench",
+        description="Benchmark kataract broadcasts towards receivers simulated on local host",
+    )
+    parser.add_argument(
+        "--modes",
+        "-M",
+        dest="modes",
+        default="chain,tree:2,scp",
+        help="comma separated list of topologies (chain, tree[:k], rack[:k]) or scp, 'chain,tree:2,scp' by default",
+    )
+    parser.add_argument(
+        "--hosts",
+        "-n",
+        dest="hosts",
+        default="4,16",
+        help="comma separated list of numbers of receivers, '4,16' by default",
+    )
+    parser.add_argument(
+        "--sizes",
+        "-s",
+        dest="sizes",
+        default="16M,256M",
+        help="comma separated list of file sizes (K, M and G suffixes), '16M,256M' by default",
+    )
+    parser.add_argument(
+        "--compressible",
+        action="store_true",
+        help="use compressible data instead of random bytes",
+    )
+    parser.add_argument(
+        "--compress",
+        "-z",
+        dest="compression",
+        choices=kataract.COMPRESSIONS,
+        default="none",
+        help="compression on the wire, none by default",
+    )
+    parser.add_argument(
+        "--concurrency",
+        "-j",
+        dest="concurrency",
+        default=None,
+        type=int,
+        help="maximum number of scp running at once, all by default",
+    )
+    parser.add_argument(
+        "--port",
+        "-p",
+        dest="port",
+        default=7000,
+        type=int,
+        help="first port used, each receiver of a run listens on its own one",
+    )
+    parser.add_argument(
+        "--timeout",
+        "-t",
+        dest="timeout",
+        default=600,
+        type=float,
+        help="time limit in seconds of each broadcast",
+    )
+    parser.add_argument("--json", dest="json", help="write results to this JSON file")
+    parser.add_argument(
+        "--baseline",
+        dest="baseline",
+        help="JSON file of a previous run to compare durations with",
+    )
+    parser.add_argument(
+        "--work-dir",
+        dest="work_dir",
+        help="where to create the temporary directory of input file and simulated hosts",
+    )
+
+    # main()
+    args = parser.parse_args()
+    modes = args.modes.split(",")
+    nb_hosts = [int(n) for n in args.hosts.split(",")]
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    for mode in modes:
+        if mode != "scp":
+            try:
+                kataract.parse_topology(mode)
+            except ValueError as e:
+                parser.error(str(e))
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            for row in json.load(f):
+                baseline[(row["mode"], row["hosts"], row["size"])] = row
+
+    work_dir = tempfile.mkdtemp(prefix="kataract-bench-", dir=args.work_dir)
+    shims = make_shims(work_dir)
+    file_input = os.path.join(work_dir, "input.bin")
+    print(
+        ROW.format(
+            "mode",
+            "hosts",
+            "size",
+            "time",
+            "MB/s",
+            "hop MB/s",
+            "min hop",
+            "cpu",
+            "cpu/GB",
+        )
+    )
+    rows = []
+    port = args.port
+    try:
+        for size in sizes:
+            make_input(file_input, size, args.compressible)
+            for n in nb_hosts:
+                for mode in modes:
+                    row = bench(mode, n, file_input, work_dir, port, shims, args)
+                    # fresh ports for each run, previous ones may be in TIME_WAIT
+                    port += n + 2
+                    rows.append(row)
+                    print_row(row, baseline.get((mode, n, size)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+    sys.exit(0 if all(row["ok"] for row in rows) else 1)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# Peer of HTTPDaemon peer-assisted distribution, run on machines (python3
+# standard library only, fetched from the daemon at /peer.py): files are
+# downloaded from the daemon or from the peer it redirects to, each complete
+# file is advertised to the daemon and served to next machines until the daemon
+# has no more requests for them. A file given with its sha256 is not downloaded
+# when an identical copy is already at its destination.
+#   python3 peer.py --server http://10.0.0.1:8000 /files/<key>/bzImage=/tmp/kernel
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+import http.client
+import http.server
+import socketserver
+import urllib.error
+import urllib.parse
+import urllib.request
+
+CHUNK_SIZE = 1 << 20
+
+
+def log(msg):
+    print(f"nxc-peer: {msg}", file=sys.stderr, flush=True)
+
+
+def parse_range(range_header, size):
+    """(start, end) of a single byte range, None for whole file or if not
+    satisfiable."""
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header or "")
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        end = size if not last else min(int(last) + 1, size)
+    if start >= size or start >= end:
+        return None
+    return (start, end)
+
+
+class PeerHandler(http.server.BaseHTTPRequestHandler):
+    # complete files by url path
+    files = {}
+    lock = threading.Lock()
+    active = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        local_path = PeerHandler.files.get(path)
+        if not local_path:
+            self.send_error(404, "File not found")
+            return
+        with PeerHandler.lock:
+            PeerHandler.active += 1
+        try:
+            with open(local_path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                byte_range = parse_range(self.headers.get("Range"), size)
+                if byte_range:
+                    start, end = byte_range
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+                else:
+                    start, end = 0, size
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(end - start))
+                self.send_header("Accept-Ranges", "bytes")
+                self.end_headers()
+                self.connection.sendfile(f, start, end - start)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with PeerHandler.lock:
+                PeerHandler.active -= 1
+
+
+class PeerServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class RedirectRecorder(urllib.request.HTTPRedirectHandler):
+    """Remember where daemon redirected, to report a failing peer."""
+
+    location = None
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        self.location = newurl
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def file_sha256(path):
+    """sha256 digest of file at path, None if there is none."""
+    sha = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                sha.update(block)
+    except OSError:
+        return None
+    return sha.hexdigest()
+
+
+def download(server, url_path, destination, retries=10, timeout=30):
+    """Fetch url_path to destination, from daemon or the peer it redirects
+    to, resuming partial download. A failing peer is reported on retry."""
+    partial = f"{destination}.part"
+    failed = None
+    for attempt in range(retries):
+        query = "?" + urllib.parse.urlencode({"failed": failed}) if failed else ""
+        request = urllib.request.Request(f"{server}{url_path}{query}")
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+        recorder = RedirectRecorder()
+        opener = urllib.request.build_opener(recorder)
+        try:
+            with opener.open(request, timeout=timeout) as response:
+                mode = "ab" if response.status == 206 else "wb"
+                with open(partial, mode) as f:
+                    shutil.copyfileobj(response, f, CHUNK_SIZE)
+            os.replace(partial, destination)
+            return recorder.location
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset:
+                # already complete
+                os.replace(partial, destination)
+                return recorder.location
+            error = e
+        except (urllib.error.URLError, OSError, http.client.HTTPException) as e:
+            error = e
+        failed = None
+        if recorder.location:
+            failed = urllib.parse.urlsplit(recorder.location).netloc
+        log(f"{url_path} from {failed or 'server'} failed ({error}), retry")
+        time.sleep(min(attempt, 5))
+    raise Exception(f"failed to download {url_path}")
+
+
+def daemon_request(server, endpoint, **params):
+    url = f"{server}/peers/{endpoint}?{urllib.parse.urlencode(params)}"
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.read()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="nxc-peer",
+        description="Download files from HTTPDaemon and serve them to other machines",
+    )
+    parser.add_argument("--server", required=True, help="base url of HTTPDaemon")
+    parser.add_argument(
+        "--port",
+        default=0,
+        type=int,
+        help="port to serve files on, any free one by default",
+    )
+    parser.add_argument(
+        "--seed-time",
+        dest="seed_time",
+        default=120,
+        type=float,
+        help="maximum time in seconds to serve files once all are downloaded",
+    )
+    parser.add_argument(
+        "--retries", default=10, type=int, help="download attempts of each file"
+    )
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="url_path=destination[=sha256] of each file to download",
+    )
+
+    # main()
+    args = parser.parse_args()
+    server = args.server.rstrip("/")
+    httpd = PeerServer(("", args.port), PeerHandler)
+    port = httpd.server_address[1]
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    for pair in args.files:
+        url_path, destination, *digest = pair.split("=", 2)
+        os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+        if digest and file_sha256(destination) == digest[0]:
+            # kept from a previous deployment, served to peers all the same
+            log(f"{url_path} already in {destination}")
+        else:
+            tic = time.time()
+            source = download(server, url_path, destination, args.retries)
+            log(f"{url_path} from {source or server} in {time.time() - tic:.2f}s")
+        PeerHandler.files[url_path] = destination
+        try:
+            daemon_request(server, "have", path=url_path, port=port)
+        except (urllib.error.URLError, OSError) as e:
+            log(f"advertise {url_path} failed ({e})")
+
+    # seed until no machine needs these files anymore
+    deadline = time.time() + args.seed_time
+    while time.time() < deadline:
+        try:
+            done = json.loads(daemon_request(server, "status", port=port))["done"]
+        except (urllib.error.URLError, OSError, ValueError):
+            done = True
+        if done and not PeerHandler.active:
+            break
+        time.sleep(0.5)
+    try:
+        daemon_request(server, "leave", port=port)
+    except (urllib.error.URLError, OSError):
+        pass
+    httpd.shutdown()
@@ -0,0 +1,342 @@
+import os
+import os.path as op
+import socket
+import subprocess
+import threading
+import time
+from types import SimpleNamespace
+
+import click
+import pytest
+
+import nixos_compose.actions as actions
+
+# Local ssh and scp replacements: commands of a host run in a directory named
+# after it, dead hosts cannot be reached
+FAKE_SSH = """#!/usr/bin/env bash
+host=${{1#*@}}; shift
+[[ " {dead_hosts} " == *" $host "* ]] && exit 255
+mkdir -p {hosts_dir}/$host && cd {hosts_dir}/$host && exec bash -c "$*"
+"""
+
+FAKE_SCP = """#!/usr/bin/env bash
+target=${{@: -1}}; source=${{@: -2:1}}
+host=${{target%%:*}}; host=${{host#*@}}; path=${{target#*:}}
+[[ " {dead_hosts} " == *" $host "* ]] && exit 1
+mkdir -p {hosts_dir}/$host/$path && cp $source {hosts_dir}/$host/$path/
+"""
+
+# detached kexec launch is recorded
+FAKE_SCREEN = """#!/usr/bin/env bash
+echo "$@" > screen.log
+"""
+
+
+def fake_commands(tmp_path, monkeypatch, dead_hosts=()):
+    """Put fake ssh, scp and screen first in PATH, return hosts directory."""
+    hosts_dir = op.join(tmp_path, "hosts")
+    bin_dir = op.join(tmp_path, "bin")
+    os.makedirs(bin_dir)
+    commands = (("ssh", FAKE_SSH), ("scp", FAKE_SCP), ("screen", FAKE_SCREEN))
+    for name, script in commands:
+        path = op.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(script.format(hosts_dir=hosts_dir, dead_hosts=" ".join(dead_hosts)))
+        os.chmod(path, 0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    return hosts_dir
+
+
+def make_ctx(tmp_path, ips, **kwargs):
+    ctx = SimpleNamespace(
+        envdir=str(tmp_path),
+        composition_name="composition",
+        flavour=SimpleNamespace(name="g5k-ramdisk"),
+        deployment_info={"all": {}, "deployment": {ip: {} for ip in ips}},
+        ip_addresses=ips,
+        ssh="ssh",
+        ssh_master=False,
+        push_path="push/",
+        push_mode="scp",
+        push_bundle=False,
+        push_compression="none",
+        push_concurrency=4,
+        push_timeout=60,
+        push_retries=0,
+        force_push=False,
+        show_spinner=False,
+        log=print,
+        vlog=print,
+        elog=print,
+        wlog=print,
+    )
+    for key, value in kwargs.items():
+        setattr(ctx, key, value)
+    return ctx
+
+
+def kexec_files(tmp_path):
+    files = []
+    for name in ("bzImage", "initrd", "kexec.sh"):
+        path = op.join(tmp_path, name)
+        with open(path, "wb") as f:
+            f.write(os.urandom(10000))
+        files.append(path)
+    return files
+
+
+def test_push_failure(tmp_path, monkeypatch):
+    ips = ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    hosts_dir = fake_commands(tmp_path, monkeypatch, dead_hosts=["10.0.0.3"])
+    files = kexec_files(tmp_path)
+    monkeypatch.setattr(actions, "kexec_files", lambda ctx: files)
+    warnings = []
+    ctx = make_ctx(tmp_path, ips, force_push=True, wlog=warnings.append)
+    ctx.host2ip_address = {f"node{i}": ip for i, ip in enumerate(ips)}
+
+    # a machine without files could not boot, deployment goes on without it
+    actions.push_on_machines(ctx)
+    for ip in "10.0.0.2", "10.0.0.4":
+        assert sorted(os.listdir(op.join(hosts_dir, ip, "push"))) == [
+            "bzImage",
+            "initrd",
+            "kexec.sh",
+        ]
+    assert op.exists(op.join(tmp_path, "push.json"))
+    assert len(warnings) == 1 and "10.0.0.3" in warnings[0]
+    assert ctx.ip_addresses == ["10.0.0.2", "10.0.0.4"]
+    assert list(ctx.deployment_info["deployment"]) == ["10.0.0.2", "10.0.0.4"]
+    assert ctx.host2ip_address == {"node0": "10.0.0.2", "node2": "10.0.0.4"}
+
+    fake_commands(tmp_path / "dead", monkeypatch, dead_hosts=ctx.ip_addresses)
+    with pytest.raises(click.ClickException, match="push failed on all 2 machine"):
+        actions.push_on_machines(ctx)
+
+
+def test_launch_ssh_kexec(tmp_path, monkeypatch):
+    ips = ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    hosts_dir = fake_commands(tmp_path, monkeypatch)
+    ctx = make_ctx(tmp_path, ips)
+    results = actions.launch_ssh_kexec(ctx)
+    assert all(r.ok for r in results)
+    for ip in ips:
+        with open(op.join(hosts_dir, ip, "screen.log")) as f:
+            assert "push//kexec.sh" in f.read()
+
+    # machines kexec was not launched on are not waited for
+    hosts_dir = fake_commands(tmp_path / "dead", monkeypatch, dead_hosts=ips[1:2])
+    with pytest.raises(click.ClickException, match="failed on 1 machine.*10.0.0.3"):
+        actions.launch_ssh_kexec(ctx)
+
+
+# ssh master connections and their closing are recorded, dead hosts refuse them
+FAKE_SSH_MASTER = """#!/usr/bin/env bash
+echo "$@" >> {log}
+[[ " {dead_hosts} " == *" ${{@: -1}} "* ]] && exit 255
+exit 0
+"""
+
+
+def test_ssh_masters(tmp_path, monkeypatch):
+    ips = ["10.0.0.2", "10.0.0.3"]
+    bin_dir = op.join(tmp_path, "bin")
+    os.makedirs(bin_dir)
+    log = op.join(tmp_path, "ssh.log")
+    with open(op.join(bin_dir, "ssh"), "w") as f:
+        f.write(FAKE_SSH_MASTER.format(log=log, dead_hosts="10.0.0.3"))
+    os.chmod(op.join(bin_dir, "ssh"), 0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    warnings = []
+    ctx = make_ctx(
+        tmp_path, ips, ssh="ssh -p 2222", ssh_master=True, wlog=warnings.append
+    )
+    control_dir = actions.ssh_control_dir(ctx)
+    assert actions.ssh_control_options(ctx) == f"-o ControlPath={control_dir}/%C"
+
+    # masters are opened with the configured ssh command
+    actions.open_ssh_masters(ctx, ips)
+    with open(log) as f:
+        lines = sorted(f.read().splitlines())
+    assert len(lines) == 2
+    for line, ip in zip(lines, ips):
+        assert line.startswith(f"-p 2222 -o ControlPath={control_dir}/%C")
+        assert "-o ControlMaster=yes -o ControlPersist=yes" in line
+        assert line.endswith(f"-N -f {ip}")
+    assert len(warnings) == 1 and "10.0.0.3" in warnings[0]
+
+    os.remove(log)
+    for name in "socket1", "socket2":
+        open(op.join(control_dir, name), "w").close()
+    actions.close_ssh_masters(ctx)
+    with open(log) as f:
+        lines = sorted(f.read().splitlines())
+    assert lines == [
+        f"-o ControlPath={control_dir}/{name} -O exit nxc"
+        for name in ("socket1", "socket2")
+    ]
+    assert not op.exists(control_dir)
+
+    ctx.ssh_master = False
+    assert actions.ssh_control_options(ctx) == ""
+
+
+def listen(ip, port):
+    """Open port of a host, until the returned function is called."""
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((ip, port))
+    server.listen(16)
+
+    def accept():
+        try:
+            while True:
+                server.accept()[0].close()
+        except OSError:
+            pass
+
+    def close():
+        # wakes up accept, a closed socket would still be listening meanwhile
+        server.shutdown(socket.SHUT_RDWR)
+        server.close()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return close
+
+
+def test_wait_tcp_ports():
+    port = 7022
+    rebooted, missed = "127.0.0.2", "127.0.0.3"
+    close = {ip: listen(ip, port) for ip in (rebooted, missed)}
+    opened = {}
+    tic = time.time()
+
+    def reboot():
+        close[rebooted]()
+        time.sleep(0.5)
+        close[rebooted] = listen(rebooted, port)
+
+    threading.Timer(0.5, reboot).start()
+    try:
+        assert (
+            actions.wait_tcp_ports(
+                [rebooted, missed],
+                port,
+                rebooting=True,
+                down_grace=1.5,
+                interval=0.05,
+                timeout=5,
+                progress=lambda ip: opened.setdefault(ip, time.time() - tic),
+            )
+            == []
+        )
+        # open port of a host not rebooting is taken at once
+        tic = time.time()
+        assert actions.wait_tcp_ports([missed], port, timeout=5) == []
+        assert time.time() - tic < 0.5
+    finally:
+        for close_port in close.values():
+            close_port()
+    # rebooting hosts are seen down first, or given up on after grace
+    assert 1 <= opened[rebooted] < 1.5
+    assert 1.5 <= opened[missed] < 2
+
+
+def test_wait_tcp_ports_backoff(monkeypatch):
+    probes = []
+    probe = actions.probe_tcp_port
+
+    async def recorded_probe(ip, port, timeout=1):
+        probes.append(time.time())
+        return await probe(ip, port, timeout)
+
+    monkeypatch.setattr(actions, "probe_tcp_port", recorded_probe)
+    tic = time.time()
+    down = actions.wait_tcp_ports(
+        ["127.0.0.5"], 7022, interval=0.1, max_interval=0.4, timeout=2
+    )
+    assert down == ["127.0.0.5"]
+    assert 2 <= time.time() - tic < 2.5
+    delays = [b - a for a, b in zip(probes, probes[1:])]
+    # doubling up to max interval: 0.1, 0.2, 0.4, 0.4...
+    assert [round(d, 1) for d in delays[:4]] == [0.1, 0.2, 0.4, 0.4]
+    assert max(delays) < 0.5
+
+
+# creates downloaded file empty, records its url
+FAKE_CURL = """#!/usr/bin/env bash
+while [ $# -gt 1 ]; do [ "$1" = -o ] && touch "$2"; shift; done
+echo "$1" >> curl.log
+"""
+
+
+def place(hosts_dir, ip, name, data):
+    os.makedirs(op.join(hosts_dir, ip, "push"), exist_ok=True)
+    with open(op.join(hosts_dir, ip, "push", name), "wb") as f:
+        f.write(data)
+
+
+def test_hosts_missing_files(tmp_path, monkeypatch):
+    ips = ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    hosts_dir = fake_commands(tmp_path, monkeypatch)
+    kernel, initrd, script = kexec_files(tmp_path)
+    with open(initrd, "rb") as f:
+        data = f.read()
+    # identical copy, stale one, none
+    place(hosts_dir, "10.0.0.2", "initrd", data)
+    place(hosts_dir, "10.0.0.3", "initrd", data[:-1] + b"x")
+    with open(kernel, "rb") as f:
+        for ip in ips:
+            place(hosts_dir, ip, "bzImage", f.read())
+            f.seek(0)
+
+    errors = []
+    ctx = make_ctx(tmp_path, ips, elog=errors.append)
+    assert actions.hosts_missing_files(ctx, [kernel, initrd, script]) == {
+        kernel: [],
+        initrd: ["10.0.0.3", "10.0.0.4"],
+        script: ips,
+    }
+    # missing files are expected, on first deployment
+    assert errors == []
+
+
+def test_pull_files_command(tmp_path, monkeypatch):
+    kernel, initrd, _ = kexec_files(tmp_path)
+    host_dir = op.join(tmp_path, "host")
+    with open(kernel, "rb") as f:
+        place(tmp_path, "host", "bzImage", f.read())
+    place(tmp_path, "host", "initrd", b"stale")
+    # fake curl records downloads
+    curl = op.join(tmp_path, "curl")
+    with open(curl, "w") as f:
+        f.write(FAKE_CURL)
+    os.chmod(curl, 0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+
+    ctx = make_ctx(tmp_path, [], pull_peers=False)
+    ctx.httpd = SimpleNamespace(
+        serve_file=lambda path: f"http://10.0.0.1:8000/files/key/{op.basename(path)}"
+    )
+
+    def downloads():
+        cmd = actions.pull_files_command(ctx, [kernel, initrd])
+        log = op.join(host_dir, "curl.log")
+        if op.exists(log):
+            os.remove(log)
+        subprocess.run(["bash", "-c", cmd], cwd=host_dir)
+        if not op.exists(log):
+            return []
+        with open(log) as f:
+            return [op.basename(url) for url in f.read().split()]
+
+    # files already present are not downloaded again, unless forced
+    assert downloads() == ["initrd"]
+    ctx.force_push = True
+    assert downloads() == ["bzImage", "initrd"]
+
+    # peer helper is given their digests to check
+    ctx.force_push = False
+    ctx.pull_peers = True
+    ctx.httpd.ip, ctx.httpd.port = "10.0.0.1", 8000
+    cmd = actions.pull_files_command(ctx, [kernel, initrd])
+    assert f"/files/key/bzImage=push/bzImage={actions.file_sha256(kernel)}" in cmd
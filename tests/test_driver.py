@@ -0,0 +1,291 @@
+import subprocess
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from nixos_compose.driver.driver import Driver, ParallelError
+from nixos_compose.driver.logger import Logger
+from nixos_compose.driver.machine import Machine
+from nixos_compose.flavours.grid5000 import G5kRamdiskFlavour
+
+# qemu connecting to monitor and shell sockets of the driver late, as on a host
+# loaded by launches of all VMs at once
+FAKE_QEMU = """
+import socket, sys, time
+time.sleep(1.5)
+monitor = socket.socket(socket.AF_UNIX)
+monitor.connect(sys.argv[1])
+shell = socket.socket(socket.AF_UNIX)
+shell.connect(sys.argv[2])
+monitor.sendall(b"QEMU monitor\\n(qemu) ")
+print("serial console", flush=True)
+sys.stdin.read()
+"""
+
+
+class FakeStartCommand:
+    def run(self, state_dir, shared_dir, monitor_path, shell_path):
+        return subprocess.Popen(
+            [sys.executable, "-c", FAKE_QEMU, str(monitor_path), str(shell_path)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+
+class StubMachine:
+    """Machine of the driver running commands as python callables"""
+
+    def __init__(self, name, delay=0, fail=False, shutdown_delay=0):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.shutdown_delay = shutdown_delay
+        self.commands = []
+        self.down = False
+
+    def is_up(self):
+        return True
+
+    def wait_for_shutdown(self):
+        time.sleep(self.shutdown_delay)
+        self.down = True
+
+    def execute(self, command, timeout=None):
+        time.sleep(self.delay)
+        self.commands.append(command)
+        if self.fail:
+            return (1, f"{command} failed on {self.name}")
+        return (0, f"{command} on {self.name}")
+
+    def succeed(self, *commands, timeout=None):
+        output = ""
+        for command in commands:
+            status, out = self.execute(command, timeout)
+            if status != 0:
+                raise Exception(f"command `{command}` failed (exit code {status})")
+            output += out
+        return output
+
+
+def make_ctx(**flavour_methods):
+    flavour = SimpleNamespace(driver_initialize=lambda d: None, **flavour_methods)
+    return SimpleNamespace(
+        flavour=flavour, no_start=True, execute_test_script=True, elog=print
+    )
+
+
+def make_driver(machines, ctx=None):
+    ctx = ctx or make_ctx()
+    ctx.flavour.machines = machines
+    return Driver(ctx, [], [], "")
+
+
+def test_parallel_execute():
+    machines = [StubMachine(f"node{i}", delay=0.2) for i in range(8)]
+    driver = make_driver(machines)
+    tic = time.time()
+    results = driver.parallel_execute(None, "hostname")
+    # concurrently
+    assert time.time() - tic < 1
+    assert results == {m.name: (0, f"hostname on {m.name}") for m in machines}
+
+
+def test_parallel_succeed_collect_all():
+    machines = [
+        StubMachine("node0"),
+        StubMachine("node1", fail=True),
+        StubMachine("node2", delay=0.3),
+        StubMachine("node3", fail=True),
+    ]
+    driver = make_driver(machines)
+    # failed machines are all reported together, driver does not exit
+    with pytest.raises(ParallelError) as error:
+        driver.parallel_succeed(None, "true", fail_fast=False)
+    assert set(error.value.errors) == {"node1", "node3"}
+    assert all(m.commands == ["true"] for m in machines)
+
+
+def test_parallel_machine_exits():
+    machines = [StubMachine(f"node{i}", delay=0.1) for i in range(3)]
+
+    def start(machine):
+        if machine.name == "node1":
+            # as rootlog.error of a machine failing to start
+            raise SystemExit(1)
+        return machine.execute("start")
+
+    driver = make_driver(machines)
+    # SystemExit is no Exception, it is reported all the same
+    with pytest.raises(ParallelError) as error:
+        driver.parallel(start)
+    assert list(error.value.errors) == ["node1"]
+    assert isinstance(error.value.errors["node1"], SystemExit)
+    assert [m.commands for m in machines] == [["start"], [], ["start"]]
+    with pytest.raises(SystemExit):
+        driver.parallel(start, fail_fast=True)
+
+
+def test_parallel_fail_fast():
+    machines = [StubMachine("node0", fail=True)] + [
+        StubMachine(f"node{i}", delay=0.5) for i in range(1, 4)
+    ]
+    driver = make_driver(machines)
+    tic = time.time()
+    with pytest.raises(Exception, match="failed") as error:
+        driver.parallel(lambda m: m.succeed("true"), max_workers=2, fail_fast=True)
+    assert not isinstance(error.value, ParallelError)
+    assert time.time() - tic < 0.4
+    time.sleep(0.6)
+    # calls not yet started are cancelled
+    assert sum(1 for m in machines if m.commands) == 2
+
+
+def test_parallel_timeout():
+    machines = [StubMachine("node0"), StubMachine("node1", delay=1)]
+    driver = make_driver(machines)
+    with pytest.raises(ParallelError) as error:
+        driver.parallel(lambda m: m.execute("true"), timeout=0.2)
+    assert list(error.value.errors) == ["node1"]
+
+
+def test_run_tests_sync_failures():
+    machines = [
+        StubMachine("node0"),
+        StubMachine("node1", fail=True),
+        StubMachine("node2", delay=2),
+        StubMachine("node3", delay=0.2),
+    ]
+    driver = make_driver(machines)
+    tic = time.time()
+    # failed and late syncs are reported, they do not fail the run
+    driver.run_tests(sync_timeout=0.5)
+    assert time.time() - tic < 1.5
+    assert [m.commands for m in machines] == [["sync"], ["sync"], [], ["sync"]]
+
+
+def test_join_all():
+    machines = [StubMachine(f"node{i}", shutdown_delay=0.3) for i in range(8)]
+    driver = make_driver(machines)
+    tic = time.time()
+    assert driver.join_all() == []
+    assert time.time() - tic < 1
+    assert all(m.down for m in machines)
+
+    # stragglers are returned once deadline is reached
+    machines = [StubMachine("node0"), StubMachine("node1", shutdown_delay=2)]
+    driver = make_driver(machines)
+    tic = time.time()
+    assert driver.join_all(timeout=0.3) == ["node1"]
+    assert time.time() - tic < 1
+
+
+def test_start_all_concurrently(tmp_path):
+    ctx = make_ctx(start=lambda m: m._start_vm(), start_process_shell=lambda m: None)
+    machines = [
+        Machine(ctx, tmp_path, FakeStartCommand(), name=f"vm{i}") for i in range(4)
+    ]
+    driver = make_driver(machines, ctx)
+    try:
+        tic = time.time()
+        driver.start_all()
+        # in about the time of one start, sockets accepted after more than 1s
+        assert time.time() - tic < 3
+        assert all(m.booted for m in machines)
+    finally:
+        for m in machines:
+            if m.process:
+                m.process.kill()
+                m.process.wait()
+            if m.serial_thread:
+                m.serial_thread.join()
+
+
+def test_start_all_streamed(tmp_path, monkeypatch):
+    ctx = make_ctx()
+    ctx.stream_ready = True
+    ctx.push_path = None
+    flavour = G5kRamdiskFlavour(ctx)
+    flavour.driver_initialize = lambda d: None
+    shells = []
+
+    def start_shell(machine):
+        shells.append(machine.name)
+        machine.process_shell = object()
+
+    monkeypatch.setattr(flavour, "start_shell", start_shell)
+    ctx.flavour = flavour
+    machines = [
+        Machine(ctx, tmp_path, "", name=f"node{i}", ip=f"10.0.0.{i}") for i in range(3)
+    ]
+    driver = make_driver(machines, ctx)
+
+    started = threading.Thread(target=driver.start_all)
+    started.start()
+    # no shell is opened to machines still rebooting
+    time.sleep(0.3)
+    assert started.is_alive() and not shells
+    flavour.machine_ready(machines[1])
+    assert shells == ["node1"]
+    for machine in machines[0], machines[2]:
+        flavour.machine_ready(machine)
+    started.join(5)
+    assert not started.is_alive()
+    assert sorted(shells) == ["node0", "node1", "node2"]
+    assert all(m.connected for m in machines)
+
+
+def test_streamed_machine_restarted(tmp_path, monkeypatch):
+    ctx = make_ctx()
+    ctx.stream_ready = True
+    ctx.external_connect = True
+    ctx.push_path = None
+    flavour = G5kRamdiskFlavour(ctx)
+    shells = []
+
+    def start_shell(machine):
+        shells.append(machine.name)
+        machine.start_process_shell(["bash"])
+
+    monkeypatch.setattr(flavour, "start_shell", start_shell)
+    ctx.flavour = flavour
+    machine = Machine(ctx, tmp_path, "", name="node0", ip="10.0.0.1")
+    flavour.machine_ready(machine)
+    try:
+        assert machine.execute("echo up") == (0, "up\n")
+        # shell of timed out command is dropped, a new one is opened
+        assert machine.execute("sleep 5", timeout=0.3) == (-1, "")
+        assert machine.process_shell is None
+        assert machine.execute("echo again") == (0, "again\n")
+        assert shells == ["node0", "node0"]
+    finally:
+        if machine.process_shell:
+            machine.process_shell.close()
+
+
+def test_logger_concurrent_nested(tmp_path, monkeypatch):
+    logfile = tmp_path / "log.xml"
+    monkeypatch.setenv("LOGFILE", str(logfile))
+    logger = Logger()
+
+    def step(i):
+        with logger.nested(f"step {i}", {"machine": f"node{i}"}):
+            for j in range(20):
+                logger.log(f"line {j}", {"machine": f"node{i}"})
+                time.sleep(0.001)
+        return threading.current_thread().name
+
+    with logger.nested("parallel steps"):
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(step, range(8)))
+    logger.close()
+
+    # well formed, lines of threads inside nest of main thread
+    root = ET.parse(logfile).getroot()
+    (nest,) = root.findall("nest")
+    assert len(nest.findall("line")) == 8 * (20 + 2) + 1
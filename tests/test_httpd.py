@@ -0,0 +1,372 @@
+import gzip
+import hashlib
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pytest
+
+from nixos_compose.httpd import HTTPDaemon, Peers
+
+servers = pytest.mark.parametrize("server", ["asyncio", "threading"])
+
+
+@servers
+def test_httpd_boot_notification(tmp_path, server):
+    httpd = HTTPDaemon(server=server)
+    httpd.start(directory=str(tmp_path))
+    try:
+        assert httpd.wait_booted(["127.0.0.1"], timeout=0.1) == ["127.0.0.1"]
+        url = f"http://127.0.0.1:{httpd.port}/boot?host=node1&role=server&uptime=12.5"
+        with urllib.request.urlopen(url) as response:
+            assert response.status == 204
+        assert httpd.wait_booted(["127.0.0.1"], timeout=1) == []
+        booted = httpd.booted["127.0.0.1"]
+        assert (booted["host"], booted["role"], booted["uptime"]) == (
+            "node1",
+            "server",
+            12.5,
+        )
+    finally:
+        httpd.stop()
+
+    # a new daemon waits for machines to boot again
+    httpd = HTTPDaemon(server=server)
+    httpd.start(directory=str(tmp_path))
+    try:
+        assert httpd.booted == {}
+        assert httpd.wait_booted(["127.0.0.1"], timeout=0.1) == ["127.0.0.1"]
+    finally:
+        httpd.stop()
+
+
+@servers
+def test_httpd_cached_deployment(tmp_path, server):
+    deploy = tmp_path / "deploy"
+    deploy.mkdir()
+    content = b'{"deployment": {}}' * 100
+    (deploy / "composition::g5k-ramdisk.json").write_bytes(content)
+    httpd = HTTPDaemon(server=server)
+    httpd.start(directory=str(tmp_path))
+    url = f"http://127.0.0.1:{httpd.port}/deploy/composition%3A%3Ag5k-ramdisk.json"
+    try:
+        with urllib.request.urlopen(url) as response:
+            assert response.read() == content
+            etag = response.headers["ETag"]
+
+        request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request) as response:
+            assert response.headers["Content-Encoding"] == "gzip"
+            assert gzip.decompress(response.read()) == content
+
+        request = urllib.request.Request(url, headers={"If-None-Match": etag})
+        try:
+            urllib.request.urlopen(request)
+            assert False, "304 expected"
+        except urllib.error.HTTPError as e:
+            assert e.code == 304
+    finally:
+        httpd.stop()
+
+
+@servers
+def test_httpd_file_ranges(tmp_path, server):
+    content = bytes(range(256)) * 1024
+    (tmp_path / "initrd").write_bytes(content)
+    httpd = HTTPDaemon(server=server)
+    httpd.start(directory=str(tmp_path / "empty"))
+    url = httpd.serve_file(str(tmp_path / "initrd")).replace(httpd.ip, "127.0.0.1")
+    try:
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Accept-Ranges"] == "bytes"
+            assert response.read() == content
+            etag = response.headers["ETag"]
+
+        # resumed and segmented downloads
+        for header, status, expected in [
+            ("bytes=1000-", 206, content[1000:]),
+            ("bytes=10-19", 206, content[10:20]),
+            ("bytes=-100", 206, content[-100:]),
+        ]:
+            request = urllib.request.Request(url, headers={"Range": header})
+            with urllib.request.urlopen(request) as response:
+                assert response.status == status
+                assert response.read() == expected
+
+        request = urllib.request.Request(
+            url, headers={"Range": "bytes=10-", "If-Range": '"changed"'}
+        )
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 200
+            assert response.read() == content
+
+        request = urllib.request.Request(
+            url, headers={"Range": f"bytes={len(content)}-", "If-Range": etag}
+        )
+        try:
+            urllib.request.urlopen(request)
+            assert False, "416 expected"
+        except urllib.error.HTTPError as e:
+            assert e.code == 416
+            assert e.headers["Content-Range"] == f"bytes */{len(content)}"
+    finally:
+        httpd.stop()
+
+
+@servers
+def test_httpd_rate_limit(tmp_path, server):
+    content = b"x" * (1 << 17)
+    (tmp_path / "kernel").write_bytes(content)
+    httpd = HTTPDaemon(rate_limit=1 << 19, server=server)
+    httpd.start(directory=str(tmp_path))
+    url = httpd.serve_file(str(tmp_path / "kernel")).replace(httpd.ip, "127.0.0.1")
+    try:
+        tic = time.time()
+        with urllib.request.urlopen(url) as response:
+            assert response.read() == content
+        # 128 KiB at 512 KiB/s
+        assert time.time() - tic >= 0.2
+    finally:
+        httpd.stop()
+        HTTPDaemon.rate_limit = 0
+
+
+@servers
+def test_httpd_node_slice(tmp_path, server):
+    deploy = tmp_path / "deploy"
+    deploy.mkdir()
+    deployment = {
+        "ssh_key.pub": "ssh-rsa AAAA",
+        "user": "nxc",
+        "deployment": {
+            f"10.0.0.{i}": {"role": "node", "host": f"node{i}"} for i in range(1, 50)
+        },
+    }
+    deployment["deployment"]["127.0.0.1"] = {"role": "server", "host": "server"}
+    (deploy / "composition::g5k-ramdisk.json").write_text(json.dumps(deployment))
+    httpd = HTTPDaemon(server=server)
+    httpd.start(directory=str(tmp_path))
+    node_url = f"http://127.0.0.1:{httpd.port}/node/composition::g5k-ramdisk.json"
+    try:
+        # keyed by client ip
+        with urllib.request.urlopen(node_url) as r:
+            node_slice = json.loads(r.read())
+        assert node_slice["deployment"] == {
+            "127.0.0.1": {"role": "server", "host": "server"}
+        }
+        assert node_slice["hosts"]["10.0.0.7"] == "node7"
+        assert len(node_slice["hosts"]) == 50
+        assert node_slice["ssh_key.pub"] == "ssh-rsa AAAA"
+
+        # keyed by host parameter, ip or hostname
+        for host in ["10.0.0.3", "node3"]:
+            with urllib.request.urlopen(f"{node_url}?host={host}") as r:
+                assert json.loads(r.read())["deployment"] == {
+                    "10.0.0.3": {"role": "node", "host": "node3"}
+                }
+
+        try:
+            urllib.request.urlopen(f"{node_url}?host=unknown")
+            assert False, "404 expected"
+        except urllib.error.HTTPError as e:
+            assert e.code == 404
+
+        # whole file still served
+        deploy_url = node_url.replace("/node/", "/deploy/")
+        with urllib.request.urlopen(deploy_url) as r:
+            assert json.loads(r.read()) == deployment
+    finally:
+        httpd.stop()
+
+
+@servers
+def test_httpd_head_and_directory_file(tmp_path, server):
+    (tmp_path / "result").write_bytes(b"done")
+    httpd = HTTPDaemon(server=server)
+    httpd.start(directory=str(tmp_path))
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", httpd.port)
+        connection.request("HEAD", "/result")
+        response = connection.getresponse()
+        assert (response.status, response.read()) == (200, b"")
+        assert response.headers["Content-Length"] == "4"
+        connection.close()
+        with urllib.request.urlopen(f"http://127.0.0.1:{httpd.port}/result") as r:
+            assert r.read() == b"done"
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{httpd.port}/../../etc/passwd")
+            assert False, "404 expected"
+        except urllib.error.HTTPError as e:
+            assert e.code == 404
+    finally:
+        httpd.stop()
+
+
+def test_httpd_keep_alive(tmp_path):
+    deploy = tmp_path / "deploy"
+    deploy.mkdir()
+    (deploy / "composition::vm.json").write_text('{"deployment": {}}')
+    httpd = HTTPDaemon()
+    httpd.start(directory=str(tmp_path))
+    try:
+        connection = http.client.HTTPConnection("127.0.0.1", httpd.port)
+        for _ in range(3):
+            connection.request("GET", "/deploy/composition::vm.json")
+            response = connection.getresponse()
+            assert response.read() == b'{"deployment": {}}'
+            assert response.headers["Connection"] == "keep-alive"
+        # same connection all along
+        assert connection.sock is not None
+        connection.close()
+    finally:
+        httpd.stop()
+
+
+def test_httpd_max_connections(tmp_path):
+    (tmp_path / "file").write_bytes(b"data")
+    httpd = HTTPDaemon(max_connections=1)
+    httpd.start(directory=str(tmp_path))
+    try:
+        # first connection holds the only slot while it is open
+        first = socket.create_connection(("127.0.0.1", httpd.port))
+        time.sleep(0.1)
+        results = []
+
+        def fetch():
+            with urllib.request.urlopen(f"http://127.0.0.1:{httpd.port}/file") as r:
+                results.append(r.read())
+
+        thread = threading.Thread(target=fetch)
+        thread.start()
+        thread.join(0.5)
+        assert results == []
+        first.close()
+        thread.join(5)
+        assert results == [b"data"]
+    finally:
+        httpd.stop()
+
+
+def fetch_from(source, port, path, headers={}):
+    connection = http.client.HTTPConnection(
+        "127.0.0.1", port, source_address=(source, 0)
+    )
+    connection.request("GET", path, headers=headers)
+    response = connection.getresponse()
+    result = (response.status, response.getheader("Location"), response.read())
+    connection.close()
+    return result
+
+
+def test_httpd_peers_policy():
+    peers = Peers(max_uploads=1, direct_uploads=1)
+    path = "/files/key/initrd"
+    assert peers.source(path, "10.0.0.1") is None
+    peers.direct_done()
+    peers.have(path, "10.0.0.1", 8001)
+    # peer, then daemon when peer is busy, then busy peer anyway
+    assert peers.source(path, "10.0.0.2") == ("10.0.0.1", 8001)
+    assert peers.source(path, "10.0.0.3") is None
+    assert peers.source(path, "10.0.0.4") == ("10.0.0.1", 8001)
+    assert not peers.done("10.0.0.1", 8001)
+    peers.have(path, "10.0.0.2", 8002)
+    assert peers.source(path, "10.0.0.5") == ("10.0.0.2", 8002)
+    # failed peer is not used anymore
+    assert peers.source(path, "10.0.0.5", failed="10.0.0.2:8002") == (
+        "10.0.0.1",
+        8001,
+    )
+
+
+@servers
+def test_httpd_peers(tmp_path, server):
+    content = os.urandom(1 << 20)
+    (tmp_path / "initrd").write_bytes(content)
+    httpd = HTTPDaemon(server=server, peers=True)
+    httpd.start(directory=str(tmp_path))
+    HTTPDaemon.peers.linger = 0.5
+    url = httpd.serve_file(str(tmp_path / "initrd"))
+    path = urllib.parse.urlsplit(url).path
+    base_url = f"http://127.0.0.1:{httpd.port}"
+    try:
+        # helper script is served to machines
+        with urllib.request.urlopen(f"{base_url}/peer.py") as r:
+            (tmp_path / "peer.py").write_bytes(r.read())
+        destination = tmp_path / "machine1" / "initrd"
+        peer = subprocess.Popen(
+            [
+                sys.executable,
+                str(tmp_path / "peer.py"),
+                "--server",
+                base_url,
+                "--seed-time",
+                "20",
+                f"{path}={destination}",
+            ]
+        )
+        deadline = time.time() + 10
+        while not HTTPDaemon.peers.holders.get(path) and time.time() < deadline:
+            time.sleep(0.05)
+        assert destination.read_bytes() == content
+        ((_, peer_port),) = HTTPDaemon.peers.holders[path]
+
+        # next machine is redirected to peer, which serves ranges
+        status, location, _ = fetch_from("127.0.0.2", httpd.port, path)
+        assert (status, location) == (302, f"http://127.0.0.1:{peer_port}{path}")
+        status, _, body = fetch_from(
+            "127.0.0.2", peer_port, path, {"Range": "bytes=1000-"}
+        )
+        assert (status, body) == (206, content[1000:])
+        # peer reported failed by a machine is not used anymore
+        failed = f"?failed=127.0.0.1:{peer_port}"
+        status, _, body = fetch_from("127.0.0.3", httpd.port, path + failed)
+        assert (status, body) == (200, content)
+
+        # machines got file, peer leaves
+        for client in ["127.0.0.2", "127.0.0.3"]:
+            HTTPDaemon.peers.have(path, client, 1)
+        assert peer.wait(10) == 0
+    finally:
+        httpd.stop()
+
+
+def test_httpd_peer_file_present(tmp_path):
+    content = os.urandom(1 << 16)
+    destination = tmp_path / "machine1" / "initrd"
+    destination.parent.mkdir()
+    destination.write_bytes(content)
+    httpd = HTTPDaemon(peers=True)
+    httpd.start(directory=str(tmp_path))
+    base_url = f"http://127.0.0.1:{httpd.port}"
+    # not served by daemon, file could not be downloaded
+    path = "/files/unknown/initrd"
+    digest = hashlib.sha256(content).hexdigest()
+    try:
+        with urllib.request.urlopen(f"{base_url}/peer.py") as r:
+            (tmp_path / "peer.py").write_bytes(r.read())
+        peer = subprocess.Popen(
+            [
+                sys.executable,
+                str(tmp_path / "peer.py"),
+                "--server",
+                base_url,
+                "--seed-time",
+                "2",
+                "--retries",
+                "1",
+                f"{path}={destination}={digest}",
+            ]
+        )
+        # identical copy kept
+        assert peer.wait(10) == 0
+        assert destination.read_bytes() == content
+    finally:
+        httpd.stop()
@@ -0,0 +1,475 @@
+import hashlib
+import json
+import os
+import os.path as op
+import sys
+import threading
+import time
+import zlib
+from subprocess import run
+
+import pytest
+
+import nixos_compose.tools.kataract as kataract
+
+KATARACT = kataract.__file__
+
+# Local ssh replacement: remote command is executed in a directory named after
+# the host, receivers are distinct loopback addresses listening on distinct ports
+FAKE_SSH = """#!/usr/bin/env bash
+host=$1; shift
+[ "$host" = "{dead_host}" ] && exit 255
+mkdir -p {hosts_dir}/$host && cd {hosts_dir}/$host && exec bash -c "$*"
+"""
+
+
+def prepare(tmp_path, size=3_000_000, dead_host=None):
+    hosts_dir = op.join(tmp_path, "hosts")
+    fake_ssh = op.join(tmp_path, "fake-ssh")
+    with open(fake_ssh, "w") as f:
+        f.write(FAKE_SSH.format(hosts_dir=hosts_dir, dead_host=dead_host))
+    os.chmod(fake_ssh, 0o755)
+
+    file_input = op.join(tmp_path, "input.bin")
+    with open(file_input, "wb") as f:
+        f.write(os.urandom(size))
+    return fake_ssh, file_input, hosts_dir
+
+
+def sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def run_kataract(args, tmp_path):
+    cmd = [sys.executable, KATARACT] + args
+    res = run(cmd, cwd=tmp_path)
+    print(f"cmd: {cmd} returncode: {res.returncode}")
+    assert not res.returncode
+    return res
+
+
+def test_kataract_python_chain(tmp_path):
+    fake_ssh, file_input, hosts_dir = prepare(tmp_path)
+    hosts = [f"127.0.0.{i}:{6100 + i}" for i in range(2, 6)]
+    args = ["-i", file_input, "-o", "output.bin", "-s", fake_ssh, "-p", "6100"]
+    for h in hosts:
+        args += ["-m", h]
+    run_kataract(args, tmp_path)
+
+    for h in hosts:
+        output = op.join(hosts_dir, h.split(":")[0], "output.bin")
+        assert sha256(output) == sha256(file_input)
+
+
+def test_kataract_python_tree(tmp_path):
+    fake_ssh, file_input, hosts_dir = prepare(tmp_path)
+    hosts = [f"127.0.0.{i}:{6200 + i}" for i in range(2, 9)]
+    args = ["-i", file_input, "-o", "output.bin", "-s", fake_ssh, "-p", "6200"]
+    args += ["--topology", "tree:3"]
+    for h in hosts:
+        args += ["-m", h]
+    run_kataract(args, tmp_path)
+
+    for h in hosts:
+        output = op.join(hosts_dir, h.split(":")[0], "output.bin")
+        assert sha256(output) == sha256(file_input)
+
+
+def test_kataract_python_dead_relay(tmp_path):
+    fake_ssh, file_input, hosts_dir = prepare(tmp_path, dead_host="127.0.0.3")
+    hosts = [f"127.0.0.{i}:{6600 + i}" for i in range(2, 6)]
+    args = ["-i", file_input, "-o", "output.bin", "-s", fake_ssh, "-p", "6600"]
+    args += ["--stall-timeout", "1"]
+    for h in hosts:
+        args += ["-m", h]
+    res = run([sys.executable, KATARACT] + args, cwd=tmp_path, capture_output=True)
+    # only the dead relay fails, its successor is fed by its predecessor
+    assert res.returncode == 1
+    results = json.loads(res.stdout[res.stdout.index(b"[") :])
+    assert [r["host"] for r in results if r["rc"]] == ["127.0.0.3:6603"]
+    for h in hosts[:1] + hosts[2:]:
+        output = op.join(hosts_dir, h.split(":")[0], "output.bin")
+        assert sha256(output) == sha256(file_input)
+
+
+def test_kataract_python_compressed(tmp_path):
+    fake_ssh, file_input, hosts_dir = prepare(tmp_path, size=0)
+    with open(file_input, "wb") as f:
+        for i in range(100_000):
+            f.write(f"{i} compressible line\n".encode())
+    hosts = [f"127.0.0.{i}:{6300 + i}" for i in range(2, 6)]
+    args = ["-i", file_input, "-o", "output.bin", "-s", fake_ssh, "-p", "6300"]
+    args += ["--topology", "tree:2", "--compress", "zlib", "--chunk-size", "65536"]
+    for h in hosts:
+        args += ["-m", h]
+    run_kataract(args, tmp_path)
+
+    for h in hosts:
+        host_dir = op.join(hosts_dir, h.split(":")[0])
+        assert sha256(op.join(host_dir, "output.bin")) == sha256(file_input)
+        assert os.listdir(host_dir) == ["output.bin"]
+
+
+def test_compress_chunks_window(tmp_path, monkeypatch):
+    path = op.join(tmp_path, "input.bin")
+    data = os.urandom(64 * 1000)
+    with open(path, "wb") as f:
+        f.write(data)
+    stream = kataract.Stream(path, size=len(data), chunk_size=1000, codec="zlib")
+    stream.fd = os.open(path, os.O_RDONLY)
+    spool = open(op.join(tmp_path, "spool"), "w+b")
+    stream.spool_fd = spool.fileno()
+    lock = threading.Lock()
+    compressed = []
+
+    def compress(chunk):
+        # chunks compressed ahead of those appended to spool
+        with lock:
+            compressed.append(len(stream.chunks))
+        return zlib.compress(chunk)
+
+    def slow_pwrite(fd, data, offset):
+        time.sleep(0.002)
+        pwrite(fd, data, offset)
+
+    pwrite = kataract._pwrite
+    monkeypatch.setattr(kataract, "_pwrite", slow_pwrite)
+    try:
+        kataract._compress_chunks(stream, compress, 2)
+        assert max(n - appended for n, appended in enumerate(compressed)) <= 4
+        spooled = b"".join(
+            zlib.decompress(os.pread(stream.spool_fd, length, offset))
+            for _, offset, length in stream.chunks
+        )
+        assert spooled == data
+    finally:
+        os.close(stream.fd)
+        spool.close()
+
+
+def test_kataract_python_bundle(tmp_path):
+    fake_ssh, file_input, hosts_dir = prepare(tmp_path)
+    script = op.join(tmp_path, "kexec.sh")
+    with open(script, "w") as f:
+        f.write("#!/bin/sh\n")
+    os.chmod(script, 0o755)
+    hosts = [f"127.0.0.{i}:{6400 + i}" for i in range(2, 5)]
+    args = ["-i", file_input, "-i", script, "-o", "push", "-s", fake_ssh]
+    args += ["-p", "6400"]
+    for h in hosts:
+        args += ["-m", h]
+    run_kataract(args, tmp_path)
+
+    for h in hosts:
+        push_dir = op.join(hosts_dir, h.split(":")[0], "push")
+        assert sorted(os.listdir(push_dir)) == ["input.bin", "kexec.sh"]
+        assert sha256(op.join(push_dir, "input.bin")) == sha256(file_input)
+        assert os.access(op.join(push_dir, "kexec.sh"), os.X_OK)
+
+
+def test_kataract_bench(tmp_path):
+    results = op.join(tmp_path, "bench.json")
+    args = ["-M", "chain,tree:2,scp", "-n", "3", "-s", "1M", "-p", "6500"]
+    args += ["--json", results, "--work-dir", str(tmp_path)]
+    # run as documented, from repository root
+    root = op.dirname(op.dirname(op.dirname(KATARACT)))
+    module = "nixos_compose.tools.kataract_bench"
+    res = run([sys.executable, "-m", module] + args, cwd=root)
+    assert not res.returncode
+
+    with open(results) as f:
+        rows = json.load(f)
+    assert [row["mode"] for row in rows] == ["chain", "tree:2", "scp"]
+    assert all(row["ok"] and row["hop_throughput_min"] > 0 for row in rows)
+
+
+def test_kataract_progress(tmp_path):
+    size = 40 << 20
+    fake_ssh, file_input, hosts_dir = prepare(tmp_path, size=size)
+    hosts = [f"127.0.0.{i}:{6700 + i}" for i in range(2, 5)]
+    tasks_cmd = kataract.generate_pipe_tasks(
+        hosts, file_input, "output.bin", port0=6700, ssh=fake_ssh, source="127.0.0.1"
+    )
+    receivers = [t.host for t in tasks_cmd if t.host != "seed"]
+    progress = kataract.Progress(receivers, size)
+    updates = []
+
+    def update(task, nbytes):
+        updates.append((task.host, nbytes))
+        progress.update(task.host, nbytes)
+
+    results = kataract.exec_kataract_tasks(tasks_cmd, progress=update)
+    assert all(r.ok for r in results)
+    assert progress.total == size * len(hosts)
+    assert not progress.running()
+    assert all(0 < n <= size for _, n in updates)
+    # relays reported some progress before the end of their transfer
+    assert any(n < size for _, n in updates)
+
+
+def test_compressed_push_not_multiplexed(tmp_path):
+    file_input = op.join(tmp_path, "input.bin")
+    with open(file_input, "wb") as f:
+        f.write(b"0" * 1000)
+    multiplexed = "-o ControlPath=/tmp/nxc-ssh/%C"
+    # ssh keeps first ControlPath given, compression of master would apply
+    (task,) = kataract.generate_scp_tasks(
+        ["10.0.0.2"], file_input, "/tmp", scp=f"scp {multiplexed}", compression="zlib"
+    )
+    assert task.startswith(f"scp -o ControlPath=none -C {multiplexed} ")
+    (task,) = kataract.generate_tar_tasks(
+        ["10.0.0.2"],
+        [file_input],
+        "/tmp",
+        ssh=f"ssh {multiplexed} ",
+        compression="zlib",
+    )
+    assert f"| ssh -o ControlPath=none -C {multiplexed} 10.0.0.2 " in task
+    (task,) = kataract.generate_scp_tasks(
+        ["10.0.0.2"], file_input, "/tmp", scp=f"scp {multiplexed}"
+    )
+    assert task.startswith(f"scp {multiplexed} ")
+
+
+# python of relays, the one of victim host writes slowly and is killed once
+# it received part of the file
+SLOW_PYTHON = """#!/usr/bin/env bash
+[ "$(basename $PWD)" = "{victim}" ] || exec python3 "$@"
+PYTHONPATH={slow_dir} python3 "$@" <&0 &
+pid=$!
+until [ -s output.bin ]; do sleep 0.01; done
+sleep 0.3
+kill -9 $pid
+wait $pid
+"""
+
+SLOW_SITECUSTOMIZE = """
+import os, time
+_pwrite = os.pwrite
+def pwrite(*args):
+    time.sleep(0.02)
+    return _pwrite(*args)
+os.pwrite = pwrite
+"""
+
+
+def test_kataract_python_relay_killed(tmp_path):
+    fake_ssh, file_input, hosts_dir = prepare(tmp_path, size=4 << 20)
+    slow_dir = op.join(tmp_path, "slow")
+    os.makedirs(slow_dir)
+    with open(op.join(slow_dir, "sitecustomize.py"), "w") as f:
+        f.write(SLOW_SITECUSTOMIZE)
+    slow_python = op.join(tmp_path, "slow-python")
+    with open(slow_python, "w") as f:
+        f.write(SLOW_PYTHON.format(victim="127.0.0.3", slow_dir=slow_dir))
+    os.chmod(slow_python, 0o755)
+
+    hosts = [f"127.0.0.{i}:{6800 + i}" for i in range(2, 6)]
+    args = ["-i", file_input, "-o", "output.bin", "-s", fake_ssh, "-p", "6800"]
+    args += ["--stall-timeout", "3", "--chunk-size", "65536"]
+    args += ["--python", slow_python]
+    for h in hosts:
+        args += ["-m", h]
+    tic = time.time()
+    res = run([sys.executable, KATARACT] + args, cwd=tmp_path, capture_output=True)
+    # children of killed relay come over to its upstream before it gives up on
+    # them (twice stall timeout), all but killed relay are served
+    assert time.time() - tic < 10
+    assert res.returncode == 1
+    results = json.loads(res.stdout[res.stdout.index(b"[") :])
+    assert [r["host"] for r in results if r["rc"]] == ["127.0.0.3:6803"]
+    # killed in the middle of its transfer
+    assert op.exists(op.join(hosts_dir, "127.0.0.3", "output.bin.kat"))
+    for h in hosts[:1] + hosts[2:]:
+        output = op.join(hosts_dir, h.split(":")[0], "output.bin")
+        assert sha256(output) == sha256(file_input)
+
+
+def test_exec_kataract_tasks_concurrency():
+    tasks = [kataract.Task("sleep 0.3", host=f"10.0.0.{i}") for i in range(4)]
+    tic = time.time()
+    results = kataract.exec_kataract_tasks(tasks, concurrency=2)
+    # two rounds of two tasks
+    assert 0.6 <= time.time() - tic < 1.2
+    assert all(r.ok for r in results)
+    assert [r.host for r in results] == [t.host for t in tasks]
+
+
+def killed(pid_file):
+    with open(pid_file) as f:
+        pid = f.read().strip()
+    # zombie until reaped by init
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(") ")[1][0] == "Z"
+    except FileNotFoundError:
+        return True
+
+
+def test_exec_kataract_tasks_timeout_retries(tmp_path):
+    pid_file = op.join(tmp_path, "pid")
+    flag = op.join(tmp_path, "flag")
+    tasks = [
+        # ssh like child of the task is killed with it
+        kataract.Task(f"sleep 30 & echo $! > {pid_file}; wait", host="slow"),
+        # fails at first attempt only
+        kataract.Task(f"[ -e {flag} ] || {{ touch {flag}; exit 1; }}", host="flaky"),
+    ]
+    results = kataract.exec_kataract_tasks(tasks, timeout=0.3, retries=1)
+    assert [(r.rc, r.attempts) for r in results] == [(None, 2), (0, 2)]
+    assert killed(pid_file)
+
+    os.remove(flag)
+    (result,) = kataract.exec_kataract_tasks(tasks[1:], retries=0)
+    assert (result.rc, result.attempts) == (1, 1)
+
+
+def test_exec_kataract_tasks_interrupted(tmp_path):
+    pid_file = op.join(tmp_path, "pid")
+    tasks = [
+        kataract.Task(f"sleep 30 & echo $! > {pid_file}; wait", host="slow"),
+        kataract.Task(f"sleep 0.3; echo {kataract.PROGRESS} 1 >&2", host="fast"),
+    ]
+
+    def interrupt(task, nbytes):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        kataract.exec_kataract_tasks(tasks, progress=interrupt)
+    # tasks run in their own session, Ctrl-C of the terminal does not reach them
+    assert killed(pid_file)
+
+
+CHUNK = 65536
+
+
+def start_seed(file_input, port, children=("relay",)):
+    seed = threading.Thread(
+        target=kataract.seed,
+        args=(file_input, port, children),
+        kwargs={"timeout": 30, "chunk_size": CHUNK, "stall_timeout": 1},
+        daemon=True,
+    )
+    seed.start()
+    return seed
+
+
+def start_proxy(port, upstream_port, tamper):
+    """Forward first connection to upstream, its downstream data going through
+    tamper(position, data), which holds the connection silent from the first
+    None it returns. Later connections are forwarded as they are."""
+    server = kataract._listen(port)
+
+    def pump(src, dst, tamper=None):
+        position = 0
+        try:
+            while True:
+                data = src.recv(CHUNK)
+                if tamper:
+                    data, position = tamper(position, data), position + len(data)
+                    if data is None:
+                        time.sleep(30)
+                if not data:
+                    break
+                dst.sendall(data)
+        except OSError:
+            # other direction closed both sockets
+            pass
+        src.close()
+        dst.close()
+
+    def serve():
+        for n in range(2):
+            conn, _ = server.accept()
+            upstream = kataract._connect(("127.0.0.1", upstream_port), 10)
+            args = (upstream, conn, tamper if n == 0 else None)
+            threading.Thread(target=pump, args=args, daemon=True).start()
+            threading.Thread(target=pump, args=(conn, upstream), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+
+def record_pulls(monkeypatch):
+    """First chunk requested by each pull of a relay."""
+    pulls = []
+    pull = kataract._pull
+
+    def recorded_pull(sock, stream, *args):
+        pulls.append(len(stream.chunks))
+        return pull(sock, stream, *args)
+
+    monkeypatch.setattr(kataract, "_pull", recorded_pull)
+    return pulls
+
+
+def test_kataract_resume_state(tmp_path, monkeypatch):
+    _, file_input, _ = prepare(tmp_path, size=10 * CHUNK + 1000)
+    output = op.join(tmp_path, "output.bin")
+    with open(file_input, "rb") as f:
+        data = f.read()
+    # interrupted relay: 6 chunks recorded, last one corrupted on disk, torn line
+    with open(output, "wb") as f:
+        f.write(data[: 5 * CHUNK] + os.urandom(CHUNK))
+    digest = hashlib.sha256(data).hexdigest()
+    with open(f"{output}.kat", "w") as f:
+        f.write(f"{len(data)} {CHUNK} {digest} none\n")
+        for i in range(6):
+            crc = zlib.crc32(data[i * CHUNK : (i + 1) * CHUNK])
+            f.write(f"{crc} {i * CHUNK} {CHUNK}\n")
+        f.write("1234 65")
+
+    pulls = record_pulls(monkeypatch)
+    start_seed(file_input, 6900)
+    report = kataract.relay(["127.0.0.1:6900"], 6901, output, timeout=30, node="relay")
+    assert pulls == [5]
+    assert report["sha256"] == digest and sha256(output) == digest
+    assert not op.exists(f"{output}.kat")
+
+
+def test_kataract_resume_bad_chunk(tmp_path, monkeypatch):
+    _, file_input, _ = prepare(tmp_path, size=10 * CHUNK)
+    output = op.join(tmp_path, "output.bin")
+    header = len(f"{10 * CHUNK} {CHUNK} {sha256(file_input)} none\n")
+    corrupted = header + 3 * (kataract.FRAME.size + CHUNK) + kataract.FRAME.size + 100
+
+    def flip_byte(position, data):
+        if position <= corrupted < position + len(data):
+            i = corrupted - position
+            data = data[:i] + bytes([data[i] ^ 0xFF]) + data[i + 1 :]
+        return data
+
+    pulls = record_pulls(monkeypatch)
+    start_seed(file_input, 6910)
+    start_proxy(6911, 6910, flip_byte)
+    report = kataract.relay(["127.0.0.1:6911"], 6912, output, timeout=30, node="relay")
+    # bad crc of chunk 3 detected, pulled again from same upstream
+    assert pulls == [0, 3]
+    assert report["resumed"] == 1 and report["dead"] == []
+    assert sha256(output) == sha256(file_input)
+
+
+def test_kataract_resume_stalled(tmp_path, monkeypatch):
+    _, file_input, _ = prepare(tmp_path, size=10 * CHUNK)
+    output = op.join(tmp_path, "output.bin")
+    header = len(f"{10 * CHUNK} {CHUNK} {sha256(file_input)} none\n")
+    # at least 4 chunks are forwarded
+    stalled = header + 4 * (kataract.FRAME.size + CHUNK)
+
+    def stall(position, data):
+        return data if position < stalled else None
+
+    pulls = record_pulls(monkeypatch)
+    start_seed(file_input, 6920)
+    start_proxy(6921, 6920, stall)
+    upstreams = ["127.0.0.1:6921", "127.0.0.1:6920"]
+    tic = time.time()
+    report = kataract.relay(
+        upstreams, 6922, output, timeout=30, stall_timeout=1, node="relay"
+    )
+    # silent upstream deemed dead after stall timeout, next ancestor takes over
+    assert time.time() - tic < 5
+    assert pulls[0] == 0 and pulls[-1] >= 4
+    assert report["upstream"] == "127.0.0.1:6920"
+    assert report["dead"] == ["127.0.0.1:6921"]
+    assert sha256(output) == sha256(file_input)
@@ -0,0 +1,35 @@
+import nixos_compose.driver.shell as shell_module
+from nixos_compose.driver.shell import FramedShell
+
+
+def test_framed_shell():
+    # banner printed at start is not taken as output of first command
+    shell = FramedShell(["bash", "-c", "echo motd; echo warning >&2; exec bash"])
+    try:
+        assert shell.execute("echo out; echo err >&2; exit 3") == (3, "out\n", "err\n")
+        assert shell.execute("printf 'no newline'") == (0, "no newline", "")
+        # syntax error and stdin reads do not break the shell
+        assert shell.execute("if then")[0] == 2
+        assert shell.execute("cat") == (0, "", "")
+        status, stdout, stderr = shell.execute(
+            "head -c 200000 /dev/zero | tee /dev/stderr"
+        )
+        assert (status, len(stdout), len(stderr)) == (0, 200000, 200000)
+        assert shell.execute("sleep 5", timeout=0.2) is None
+    finally:
+        shell.close()
+
+
+def test_framed_shell_split_markers(monkeypatch):
+    # end markers arrive over several reads
+    monkeypatch.setattr(shell_module, "BUFFER_SIZE", 5)
+    shell = FramedShell(["bash"])
+    try:
+        assert shell.execute("seq 3; echo err >&2; exit 255") == (
+            255,
+            "1\n2\n3\n",
+            "err\n",
+        )
+        assert shell.execute("printf x") == (0, "x", "")
+    finally:
+        shell.close()
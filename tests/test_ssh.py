@@ -0,0 +1,144 @@
+import socket
+import subprocess
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from nixos_compose.driver.machine import Machine
+from nixos_compose.driver.ssh import SSHConnection, ssh_config_options
+
+# optional dependency (nixos-compose[paramiko])
+paramiko = pytest.importorskip("paramiko")
+
+
+class ShellServer(paramiko.ServerInterface):
+    """ssh server running exec requests with local shell, for a single key"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def get_allowed_auths(self, username):
+        return "publickey"
+
+    def check_auth_publickey(self, username, key):
+        if key == self.key:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        def run():
+            process = subprocess.run(command, shell=True, capture_output=True)
+            try:
+                channel.sendall(process.stdout)
+                channel.sendall_stderr(process.stderr)
+                channel.send_exit_status(process.returncode)
+                channel.close()
+            except (OSError, EOFError):
+                # timed out command, channel closed by client
+                pass
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+def start_ssh_server(client_key):
+    host_key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+
+    def serve():
+        connection, _ = listener.accept()
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(host_key)
+        transport.start_server(server=ShellServer(client_key))
+
+    threading.Thread(target=serve, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def test_ssh_config_options(tmp_path):
+    config = tmp_path / "config"
+    config.write_text(
+        "Host node-*\n"
+        "  User alice\n"
+        "  IdentityFile /keys/g5k\n"
+        "  ProxyJump access.grid5000.fr,rennes\n"
+        "Host vm\n"
+        "  HostName 127.0.0.1\n"
+        "  ProxyCommand nc %h %p\n"
+    )
+    options = ssh_config_options("node-1", 22, "root", str(config))
+    # user given takes precedence, as ssh -l
+    assert options["username"] == "root"
+    assert options["key_filename"] == ["/keys/g5k"]
+    assert options["proxy_command"] == "ssh -J access.grid5000.fr -W node-1:22 rennes"
+    options = ssh_config_options("vm", 22022, "root", str(config))
+    assert options["hostname"] == "127.0.0.1"
+    assert options["proxy_command"] == "nc 127.0.0.1 22022"
+    assert ssh_config_options("other", 22, "root", str(config)) == {
+        "hostname": "other",
+        "port": 22,
+        "username": "root",
+    }
+
+
+def test_ssh_connection(tmp_path):
+    key = paramiko.RSAKey.generate(2048)
+    key.write_private_key_file(str(tmp_path / "id_rsa"))
+    config = tmp_path / "config"
+    config.write_text(
+        f"Host localhost\n  HostName 127.0.0.1\n  IdentityFile {tmp_path}/id_rsa\n"
+    )
+    port = start_ssh_server(key)
+
+    connection = SSHConnection("localhost", port, "root", config_file=str(config))
+    try:
+        assert connection.is_active()
+        assert connection.execute("echo out; echo err >&2; exit 3") == (
+            3,
+            "out\n",
+            "err\n",
+        )
+        # binary output does not break the connection
+        assert connection.execute("printf 'a\\377b'; printf '\\377' >&2") == (
+            0,
+            "a\ufffdb",
+            "\ufffd",
+        )
+        status, stdout, _ = connection.execute("head -c 300000 /dev/zero")
+        assert (status, len(stdout)) == (0, 300000)
+        assert connection.execute("sleep 2", timeout=0.3)[0] is None
+
+        # channels of one connection used concurrently
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(connection.execute("sleep 0.5; echo ok"))
+            )
+            for _ in range(4)
+        ]
+        tic = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.time() - tic < 1.5
+        assert results == [(0, "ok\n", "")] * 4
+    finally:
+        connection.close()
+
+
+def test_ssh_backend(tmp_path):
+    ctx = SimpleNamespace(ssh_backend="process")
+    machine = Machine(ctx, tmp_path, "", ip="127.0.0.1", ssh_port=1)
+    assert not machine.start_ssh_connection()
+    # auto falls back to ssh process shell when connection fails
+    ctx.ssh_backend = "auto"
+    assert not machine.start_ssh_connection()
+    assert machine.ssh_connection is None
@@ -1,4 +1,12 @@
 from subprocess import run
+from types import SimpleNamespace
+
+import click
+import pytest
+
+from nixos_compose.commands import cmd_start
+from nixos_compose.flavours.grid5000 import G5KImageFlavour
+from nixos_compose.flavours.nspawn import NspawnFlavour
 
 
 def run_test(cmd, tmp_path, ret_test=1):
@@ -42,3 +50,35 @@ def test_start_vm_ramdisk(tmp_path):
     run_init("nxc init", tmp_path)
     run_test("nxc build -f vm-ramdisk", tmp_path)
     run_test("nxc start -t", tmp_path)
+
+
+def test_start_stream_unsupported():
+    ctx = SimpleNamespace(stream_ready=True, flavour=NspawnFlavour(None))
+    with pytest.raises(click.UsageError, match="--stream is not supported by nspawn"):
+        cmd_start.start(ctx, False, True, 0)
+    ctx.flavour = G5KImageFlavour(None)
+    with pytest.raises(click.UsageError, match="g5k-image"):
+        cmd_start.start(ctx, False, True, 0)
+
+
+def test_start_push_failure_closes_ssh_masters(monkeypatch):
+    calls = []
+    ctx = SimpleNamespace(
+        stream_ready=False,
+        flavour=SimpleNamespace(name="g5k-ramdisk"),
+        ip_addresses=["10.0.0.2"],
+        use_httpd=False,
+        push_path="push/",
+    )
+
+    def push_on_machines(ctx):
+        raise click.ClickException("push failed")
+
+    monkeypatch.setattr(cmd_start, "open_ssh_masters", lambda *a: calls.append("open"))
+    monkeypatch.setattr(cmd_start, "push_on_machines", push_on_machines)
+    monkeypatch.setattr(
+        cmd_start, "close_ssh_masters", lambda *a: calls.append("close")
+    )
+    with pytest.raises(click.ClickException, match="push failed"):
+        cmd_start.start(ctx, False, True, 0)
+    assert calls == ["open", "close"]